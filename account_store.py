@@ -0,0 +1,701 @@
+import atexit
+import operator
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from binary_store import BinaryAccounts
+from ledger import Ledger, ledger_file_for, migrate_transactions, timestamp_now
+from locking import StripedLock
+from metrics import REGISTRY
+from money import check_cents, format_cents_array, parse_cents_array
+from pins import stored_digest
+from settlement import CHUNK_SIZE, copy_settlement, ledger_frames, net_amounts, settlements_dir_for
+from snapshots import VersionChain
+from storage import (AccountNotFound, InsufficientFunds, InvalidBatch, Storage, is_binary_store, lock_table,
+                     validate_batch)
+from wal import WriteAheadLog, read_checkpoint, upgrade_record, write_checkpoint
+
+
+# Read the accounts CSV into a DataFrame
+def read_accounts(file_name):
+    """
+    Reads the CSV file into a Pandas DataFrame.
+    The 'Balance' column is kept in dollars in the file and parsed from its
+    text into int64 cents, so no balance is rounded through a float.
+    """
+    df = pd.read_csv(file_name, dtype={'Balance': str})
+    df['Balance'] = parse_cents_array(df['Balance'])
+    return df
+
+
+# Write the accounts DataFrame back to the CSV file
+def write_accounts(df, file_name):
+    """
+    Writes the DataFrame back to the CSV file, formatting the cents in the
+    'Balance' column as dollars.
+    The file is replaced atomically so a crash never leaves a half-written table.
+    """
+    tmp_name = file_name + ".tmp"
+    with open(tmp_name, 'w', newline='', encoding='utf-8') as f:
+        df.assign(Balance=format_cents_array(df['Balance'])).to_csv(f, index=False, float_format="%.2f")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, file_name)
+
+
+class AccountIndex:
+    """
+    Hash index from account number to row number.
+    Lookups are O(1); add() and remove() keep it in sync with inserts and deletes.
+    """
+
+    def __init__(self, account_numbers, rows):
+        self._rows = dict(zip(account_numbers.tolist(), rows.tolist()))
+
+    def find(self, account_number):
+        return self._rows.get(account_number)
+
+    def find_many(self, account_numbers):
+        """
+        Returns a NumPy array of rows for the given account numbers, -1 where missing.
+        """
+        rows = self._rows
+        return np.fromiter((rows.get(n, -1) for n in account_numbers), dtype=np.int64,
+                           count=len(account_numbers))
+
+    def add(self, account_number, row):
+        self._rows[account_number] = row
+
+    def remove(self, account_number):
+        return self._rows.pop(account_number, None)
+
+    def __contains__(self, account_number):
+        return account_number in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+
+class AccountStore(Storage):
+    """
+    Keeps the account table resident in memory.
+    The table only holds current balances; history lives in the Ledger.
+    Every mutation is first appended to a write-ahead log and then applied in
+    memory; a background thread periodically compacts the log into the CSV
+    file. On startup the log is replayed on top of the last checkpoint.
+
+    The table is either a CSV file or a binary store directory (see
+    binary_store.py). With a binary store the balance and live arrays are
+    views of the mapped files, so updates land in them in place and
+    compaction only has to flush the mapped pages. There is no DataFrame
+    then: opening builds the index from the account number column and
+    PINs and names are read from the mapped columns when asked for.
+
+    Transfers to and from other shards go through prepare_transfer() and
+    commit_transfer() or abort_transfer(). Prepared transfers are logged
+    like any mutation, and their records are kept in the log across
+    compactions until they are decided.
+
+    Balances live in an int64 array of cents aligned with the DataFrame
+    rows; amounts passed in must be whole cents too. Each
+    balance check and update runs under the account's stripe of a
+    StripedLock, so different accounts proceed in parallel while updates to
+    the same account are linearizable.
+
+    Reads never take those locks. Every applied mutation publishes a new
+    immutable Version of the balances (see snapshots.py) and readers answer
+    from the current one, so they see each mutation (a transfer, a
+    settlement) either completely or not at all, and never wait behind
+    writers, group commits or settlements. view() hands out that Version
+    for reads that span several calls. So in_memory is True.
+
+    Only one store may have a table open at a time: it holds the table's
+    lock (see storage.lock_table) from before the table is read until it is
+    closed.
+    """
+
+    in_memory = True
+
+    def __init__(self, df, file_name, flush_interval=1.0, fsync=True, stripes=64,
+                 details_cache_size=100_000, binary=None, lock=None):
+        self._table_lock = lock or lock_table(file_name)
+        self.checkpoint_seq = read_checkpoint(file_name)
+        self.ledger = Ledger(ledger_file_for(file_name), recorded_after=self.checkpoint_seq)
+        self.binary = binary
+        if binary is None:
+            legacy = 'Transactions' in df.columns
+            self.df = migrate_transactions(df, self.ledger).reset_index(drop=True)
+            if legacy:
+                # The first open rewrites the table without the column, once its entries are durable
+                self.ledger.save_aggregates()
+                write_accounts(self.df, file_name)
+            self.balances = self.df['Balance'].to_numpy(dtype=np.int64, copy=True)
+            self.live = np.ones(len(self.df), dtype=bool)
+            account_numbers = self.df['Account Number'].to_numpy()
+        else:
+            self.df = None
+            self.balances = binary.balances
+            self.live = binary.live
+            account_numbers = binary.account_numbers
+        live_rows = np.flatnonzero(self.live)
+        self.index = AccountIndex(account_numbers[live_rows], live_rows)
+        # Bumped on every change to a row; with the per-process epoch it forms the ETag
+        self.versions = np.zeros(len(self.balances), dtype=np.int64)
+        self.epoch = os.urandom(4).hex()
+        # Read-through cache of get_details; lookups take no lock, changes take _details_lock
+        self._details = OrderedDict()
+        self._details_lock = threading.Lock()
+        self.details_cache_size = details_cache_size
+        self.locks = StripedLock(stripes)
+        self.file_name = file_name
+        self.flush_interval = flush_interval
+        self._checkpoint_lock = threading.Lock()
+        self.wal = WriteAheadLog(file_name + ".wal", fsync=fsync)
+        self.prepared = {}
+        self.chain = None
+        # Rows of closed accounts, so versions from before the close still find them
+        self._closed_rows = {}
+        # Copies of the settlement files (see settle) whose records are still in the log, by path
+        self._settlements = {}
+        # (row mask, Event) of the settlement whose ledger rows are being written
+        self._settling = None
+        for record in self.wal.replay():
+            if record['seq'] > self.checkpoint_seq:
+                record = upgrade_record(record)
+                self._apply(record)
+                if record['op'] == 'settle':
+                    self._settle_ledger(record)
+            elif 'txid' in record:
+                # Already in the table; only the prepared transfers still need tracking
+                self._track(record)
+        self.wal.last_seq = max(self.wal.last_seq, self.checkpoint_seq, self.ledger.last_seq)
+        self.ledger.recorded.clear()
+        self._drop_settlements(self.checkpoint_seq, unknown=True)
+        self.chain = VersionChain(self.wal.last_seq, self.balances, self.live, self.versions)
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def load(cls, file_name, flush_interval=1.0, fsync=True):
+        """
+        Loads the account table once. Returns None if the file does not exist.
+        file_name may also name a binary store directory. Raises TableInUse
+        if another store has it open.
+        """
+        if not os.path.exists(file_name):
+            return None
+        lock = lock_table(file_name)
+        try:
+            if is_binary_store(file_name):
+                return cls(None, file_name, flush_interval, fsync, binary=BinaryAccounts(file_name), lock=lock)
+            return cls(read_accounts(file_name), file_name, flush_interval, fsync, lock=lock)
+        except BaseException:
+            lock.close()
+            raise
+
+    def find(self, account_number):
+        """
+        Returns the row index of the account, or None if it does not exist.
+        """
+        return self.index.find(account_number)
+
+    def _require(self, account_number):
+        index = self.find(account_number)
+        if index is None:
+            raise AccountNotFound(account_number)
+        return index
+
+    def _commit(self, account_number, op, amount, balance, **extra):
+        """
+        Logs a mutation durably, then applies it to the in-memory table.
+        Must be called with the account's stripe (or every stripe) held.
+        """
+        extra.setdefault('ts', timestamp_now())
+        self._log([{'account': account_number, 'op': op, 'amount': amount, 'balance': balance, **extra}])
+
+    def _log(self, records):
+        """
+        Makes records durable with one log write, then applies them in order.
+        Must be called with the stripes of every account involved held;
+        writers holding other stripes share the log's fsync (group commit).
+        """
+        with REGISTRY.phase('mutation'):
+            self.wal.append_many(records)
+            for record in records:
+                self._apply(record)
+
+    def _apply(self, record):
+        """
+        Applies one logged mutation to the in-memory table and the ledger
+        (except for a settlement, see _settle_ledger).
+        Used both for live writes and for replay on startup; ledger entries
+        already written before a crash are not written again. Writers that
+        share a group commit apply in any order, so this goes by the
+        sequence numbers the ledger held on open, not by its highest one.
+        """
+        account_number = record['account']
+        op = record['op']
+        rows = []
+        if op == 'open':
+            if account_number not in self.index:
+                if self.binary is None:
+                    row = len(self.df)
+                    self.balances = np.append(self.balances, np.int64(record['balance']))
+                    self.live = np.append(self.live, True)
+                    self.df.loc[row] = {'Account Number': account_number, 'pin': record['pin'],
+                                        'Name': record['name'], 'Balance': record['balance']}
+                else:
+                    row = self.binary.append(account_number, stored_digest(account_number, record['pin']),
+                                             record['name'], record['balance'])
+                    self.balances, self.live = self.binary.balances, self.binary.live
+                self.versions = np.append(self.versions, 0)
+                self.index.add(account_number, row)
+                rows = [row]
+        elif op == 'close':
+            row = self.index.remove(account_number)
+            if row is not None:
+                self.live[row] = False
+                self.versions[row] += 1
+                self._closed_rows[account_number] = row
+                rows = [row]
+        elif op == 'settle':
+            rows = self.index.find_many(record['accounts'])
+            self.balances[rows] = record['balances']
+            self.versions[rows] += 1
+        elif op == 'transfer':
+            row, receiver_row = self.index.find(account_number), self.index.find(record['receiver'])
+            self.balances[row] = record['balance']
+            self.balances[receiver_row] = record['receiver_balance']
+            self.versions[row] += 1
+            self.versions[receiver_row] += 1
+            rows = [row, receiver_row]
+        else:
+            row = self.index.find(account_number)
+            self.balances[row] = record['balance']
+            self.versions[row] += 1
+            rows = [row]
+        if 'txid' in record:
+            self._track(record)
+        if op != 'settle' and record['seq'] not in self.ledger.recorded:
+            self._append_ledger(record)
+        # Replay publishes one base version once it is done
+        if self.chain is not None and len(rows):
+            self.chain.publish(record['seq'], rows, self.balances, self.live, self.versions)
+
+    def _append_ledger(self, record):
+        """
+        Writes the ledger entries of one logged mutation. If a settlement's
+        rows for one of its accounts are still being written, it waits for
+        them, so each account's entries stay in time order (Ledger.page
+        relies on it).
+        """
+        account_number = record['account']
+        op = record['op']
+        settling = self._settling
+        if settling is not None:
+            pending, done = settling
+            if op == 'close':
+                rows = [self._closed_rows.get(account_number)]
+            else:
+                rows = [self.index.find(number) for number in (account_number, record.get('receiver'))]
+            if any(row is not None and row < len(pending) and pending[row] for row in rows):
+                done.wait()
+        if op == 'transfer':
+            self.ledger.append_transfer(account_number, record['receiver'], record['amount'],
+                                        seq=record['seq'], timestamp=record.get('ts'))
+        elif op == 'withdraw':
+            self.ledger.append(account_number, 'withdrawal', -record['amount'],
+                               seq=record['seq'], timestamp=record.get('ts'))
+        elif op == 'commit':
+            self.ledger.append(account_number, 'transfer_out' if record['amount'] < 0 else 'transfer_in',
+                               record['amount'], record.get('counterparty'),
+                               seq=record['seq'], timestamp=record.get('ts'))
+        elif op == 'deposit' or (op == 'open' and record['balance'] > 0):
+            self.ledger.append(account_number, 'deposit', record['balance'] if op == 'open' else record['amount'],
+                               seq=record['seq'], timestamp=record.get('ts'))
+        elif op == 'close':
+            self.ledger.append(account_number, 'close', 0, seq=record['seq'], timestamp=record.get('ts'))
+
+    def _settle_ledger(self, record):
+        """
+        Writes the ledger rows of a logged settlement, read again from the
+        store's copy of its file, after any written before a crash.
+        """
+        if os.path.dirname(record['source']) == os.path.abspath(settlements_dir_for(self.file_name)):
+            self._settlements[record['source']] = record['seq']
+        for frame in ledger_frames(record['source'], record['accounts'], record['seq'], record['ts'],
+                                   skip=self.ledger.recorded.get(record['seq'], 0)):
+            self.ledger.append_frame(frame)
+
+    def _drop_settlements(self, seq, unknown=False):
+        """
+        Deletes the copies of settlement files whose records a checkpoint at
+        seq covers; with unknown, also every other copy not in the log (left
+        by an earlier run).
+        """
+        for path, logged in list(self._settlements.items()):
+            if logged <= seq:
+                del self._settlements[path]
+                os.remove(path)
+        directory = os.path.abspath(settlements_dir_for(self.file_name))
+        if unknown and os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if os.path.join(directory, name) not in self._settlements:
+                    os.remove(os.path.join(directory, name))
+
+    def _track(self, record):
+        """
+        Keeps self.prepared in step with a logged prepare, commit or abort.
+        """
+        if record['op'] == 'prepare':
+            self.prepared[record['txid']] = record
+        else:
+            self.prepared.pop(record['txid'], None)
+
+    def view(self):
+        """
+        Returns the current Version: a consistent point-in-time view of every balance.
+        """
+        return self.chain.current
+
+    def _visible(self, account_number, view=None):
+        """
+        Returns (row, (balance, live, version)) of an account as of a Version
+        (the current one by default). Raises AccountNotFound if it did not exist then.
+        """
+        view = view or self.chain.current
+        row = self.index.find(account_number)
+        state = view.row(row)
+        if state is None or not state[1]:
+            row = self._closed_rows.get(account_number)
+            state = view.row(row)
+            if state is None or not state[1]:
+                raise AccountNotFound(account_number)
+        return row, state
+
+    def exists(self, account_number):
+        try:
+            self._visible(account_number)
+        except AccountNotFound:
+            return False
+        return True
+
+    def add_account(self, account_number, pin, name, balance=0):
+        """
+        Inserts a new account row and registers it in the index.
+        """
+        with self.locks.hold_all():
+            if account_number in self.index:
+                raise ValueError(f"Account {account_number} already exists")
+            self._commit(account_number, 'open', 0, operator.index(balance), pin=pin, name=name)
+
+    def remove_account(self, account_number):
+        """
+        Deletes an account row and drops it from the index. Only an empty
+        account can be closed; its ledger history and aggregates are closed
+        with it.
+        """
+        with self.locks.hold_all():
+            if self.balances[self._require(account_number)] != 0:
+                raise ValueError(f"Account {account_number} has a nonzero balance")
+            if any(record['account'] == account_number for record in self.prepared.values()):
+                raise ValueError(f"Account {account_number} has a transfer in progress")
+            self._commit(account_number, 'close', 0, 0)
+
+    def _fields(self, row):
+        """
+        Returns (account_number, stored PIN, name) of a row.
+        """
+        if self.binary is not None:
+            return self.binary.row(row)
+        return int(self.df.at[row, 'Account Number']), str(self.df.at[row, 'pin']), self.df.at[row, 'Name']
+
+    def get_account(self, account_number):
+        row, (balance, _, _) = self._visible(account_number)
+        _, pin, name = self._fields(row)
+        return {'account_number': account_number, 'pin': pin, 'name': name, 'balance': balance}
+
+    def accounts(self):
+        """
+        Yields every account as of the current Version.
+        """
+        view = self.chain.current
+        balances, live, _ = view.arrays()
+        if self.binary is not None:
+            live_rows = np.flatnonzero(live)
+            for start in range(0, len(live_rows), CHUNK_SIZE):
+                rows = live_rows[start:start + CHUNK_SIZE]
+                for account_number, pin, name, balance in zip(*self.binary.rows(rows), balances[rows].tolist()):
+                    yield {'account_number': account_number, 'pin': pin, 'name': name, 'balance': balance}
+            return
+        df = self.df.iloc[:view.size][live].assign(Balance=balances[live])
+        for account_number, pin, name, balance in zip(df['Account Number'].tolist(), df['pin'].astype(str).tolist(),
+                                                      df['Name'].tolist(), df['Balance'].tolist()):
+            yield {'account_number': account_number, 'pin': pin, 'name': name, 'balance': balance}
+
+    def get_balance(self, account_number):
+        return self._visible(account_number)[1][0]
+
+    def etag(self, account_number):
+        """
+        Returns the current version tag of the account without touching its data.
+        """
+        return f"{self.epoch}-{self._visible(account_number)[1][2]}"
+
+    def get_details(self, account_number):
+        """
+        Returns (etag, details) for the account through a read-through cache.
+        A cached entry is reused only while the account's version is unchanged,
+        so any mutation invalidates it.
+        """
+        row, (balance, _, version) = self._visible(account_number)
+        cached = self._details.get(account_number)
+        if cached is not None and cached[0] == version:
+            return f"{self.epoch}-{version}", cached[1]
+        number, _, name = self._fields(row)
+        details = {'account_number': number, 'name': name, 'balance': balance}
+        with self._details_lock:
+            # A refreshed entry moves to the back; the oldest one is evicted first
+            self._details.pop(account_number, None)
+            if self._details and len(self._details) >= self.details_cache_size:
+                self._details.popitem(last=False)
+            self._details[account_number] = (version, details)
+        return f"{self.epoch}-{version}", details
+
+    def get_history(self, account_number):
+        """
+        Returns every ledger entry of the account (used by analytics).
+        """
+        self._visible(account_number)
+        return self.ledger.history(account_number)
+
+    def get_stats(self, account_number):
+        """
+        Returns the account's running aggregates (empty if it has no entries yet).
+        """
+        self._visible(account_number)
+        return self.ledger.stats(account_number) or {}
+
+    def get_statement(self, account_number, cursor=0, limit=50, **filters):
+        """
+        Returns one page of the account's ledger entries and the next cursor.
+        """
+        self._visible(account_number)
+        return self.ledger.page(account_number, cursor, limit, **filters)
+
+    def withdraw(self, account_number, amount):
+        """
+        Withdraws money from the account and returns the new balance.
+        Raises InsufficientFunds if the balance is too low.
+        """
+        amount = operator.index(amount)
+        with self.locks.hold(account_number):
+            balance = int(self.balances[self._require(account_number)])
+            if balance < amount:
+                raise InsufficientFunds(account_number)
+            self._commit(account_number, 'withdraw', amount, balance - amount)
+            return balance - amount
+
+    def deposit(self, account_number, amount):
+        """
+        Deposits money into the account and returns the new balance.
+        """
+        amount = operator.index(amount)
+        with self.locks.hold(account_number):
+            balance = check_cents(int(self.balances[self._require(account_number)]) + amount)
+            self._commit(account_number, 'deposit', amount, balance)
+            return balance
+
+    def transfer(self, sender, receiver, amount):
+        """
+        Moves money between two accounts atomically and returns the sender's
+        new balance. Both stripes are taken in ascending order, so opposite
+        transfers between the same pair cannot deadlock, and both balance
+        changes are logged as one record.
+        """
+        if sender == receiver:
+            raise ValueError("Cannot transfer to the same account")
+        amount = operator.index(amount)
+        with self.locks.hold(sender, receiver):
+            sender_balance = int(self.balances[self._require(sender)])
+            receiver_balance = int(self.balances[self._require(receiver)])
+            if sender_balance < amount:
+                raise InsufficientFunds(sender)
+            self._commit(sender, 'transfer', amount, sender_balance - amount,
+                         receiver=receiver, receiver_balance=check_cents(receiver_balance + amount))
+            return sender_balance - amount
+
+    def prepare_transfer(self, txid, account_number, amount, counterparty=None):
+        """
+        Reserves a debit (negative amount) or checks a credit for a
+        cross-shard transfer; see Storage.prepare_transfer.
+        """
+        amount = operator.index(amount)
+        with self.locks.hold(account_number):
+            balance = int(self.balances[self._require(account_number)])
+            if txid in self.prepared:
+                return balance
+            if amount < 0 and balance < -amount:
+                raise InsufficientFunds(account_number)
+            check_cents(balance + max(amount, 0))
+            self._commit(account_number, 'prepare', amount, balance + min(amount, 0),
+                         txid=txid, counterparty=counterparty)
+            return balance + min(amount, 0)
+
+    def _decide(self, txid, op):
+        prepared = self.prepared.get(txid)
+        if prepared is None:
+            return None
+        account_number, amount = prepared['account'], prepared['amount']
+        with self.locks.hold(account_number):
+            if txid not in self.prepared:
+                return None
+            balance = int(self.balances[self._require(account_number)])
+            # A commit adds a credit; an abort gives a reserved debit back
+            balance = check_cents(balance + (max(amount, 0) if op == 'commit' else -min(amount, 0)))
+            self._commit(account_number, op, amount, balance, txid=txid, counterparty=prepared.get('counterparty'))
+            return balance
+
+    def commit_transfer(self, txid):
+        return self._decide(txid, 'commit')
+
+    def abort_transfer(self, txid):
+        self._decide(txid, 'abort')
+
+    def pending_transfers(self):
+        return list(self.prepared)
+
+    def apply_batch(self, operations):
+        """
+        Applies a list of (op, account_number, amount) tuples, op being
+        'deposit' or 'withdraw'. The whole batch is validated first: unknown
+        ops or accounts and amounts that are not positive cents raise InvalidBatch and
+        nothing is applied. Operations then run in order; a withdrawal that
+        would overdraw is skipped and reported. Every applied operation is
+        made durable with one log write.
+        Returns one result dict per operation.
+        """
+        accounts = {account_number for _, account_number, _ in operations}
+        with self.locks.hold(*accounts):
+            validate_batch(operations, self.index)
+
+            balances = {n: int(self.balances[self.index.find(n)]) for n in accounts}
+            timestamp = timestamp_now()
+            results, records = [], []
+            for op, account_number, amount in operations:
+                balance = balances[account_number]
+                if op == 'withdraw' and balance < amount:
+                    results.append({'error': "Insufficient funds"})
+                    continue
+                balance = balance - amount if op == 'withdraw' else check_cents(balance + amount)
+                balances[account_number] = balance
+                records.append({'account': account_number, 'op': op, 'amount': int(amount),
+                                'balance': balance, 'ts': timestamp})
+                results.append({'balance': balance})
+            if records:
+                self._log(records)
+        return results
+
+    def settle(self, file_name, chunksize=CHUNK_SIZE):
+        """
+        Applies a settlement file in bulk. Net amounts per account are
+        aggregated while streaming the file, then applied to the balance
+        array in one vectorized step. Accounts that are unknown or would end
+        up overdrawn are rejected as a whole. The new balances are logged as a
+        single record; ledger rows for accepted lines are appended in bulk
+        afterwards, once the other writers are let through again. Until
+        they are written, a mutation of a settled account waits for them
+        before writing its own ledger entries.
+        The file is copied next to the log first and only the copy is read,
+        so replay does not depend on the original (see copy_settlement).
+        Returns (accepted net amounts, rejected account numbers).
+        """
+        source = copy_settlement(file_name, self.file_name)
+        try:
+            net = net_amounts(source, chunksize)
+        except ValueError:
+            os.remove(source)
+            raise
+        record = None
+        # No checkpoint may cover the record before its ledger rows are written
+        with self._checkpoint_lock:
+            with self.locks.hold_all():
+                rows = self.index.find_many(net.index.tolist())
+                found = rows >= 0
+                new_balances = self.balances[rows[found]] + net.to_numpy()[found]
+                ok = new_balances >= 0
+                accepted = net[found][ok]
+                rejected = net.index[~found].append(net.index[found][~ok])
+                if len(accepted):
+                    record = {'account': None, 'op': 'settle', 'amount': int(accepted.sum()),
+                              'balance': None, 'accounts': accepted.index.tolist(),
+                              'balances': new_balances[ok].tolist(),
+                              'source': source, 'ts': timestamp_now()}
+                    self._log([record])
+                    pending = np.zeros(len(self.balances), dtype=bool)
+                    pending[rows[found][ok]] = True
+                    self._settling = (pending, threading.Event())
+            if record is None:
+                os.remove(source)
+                return accepted, rejected
+            try:
+                self._settle_ledger(record)
+            finally:
+                settling, self._settling = self._settling, None
+                settling[1].set()
+        return accepted, rejected
+
+    def snapshot(self):
+        """
+        Returns a copy of the live account rows of a CSV table with their current balances.
+        Every stripe is held briefly so no logged mutation is half-applied.
+        """
+        with self.locks.hold_all():
+            seq = self.wal.last_seq
+            balances = self.balances.copy()
+            live = self.live.copy()
+            df = self.df.copy()
+        df['Balance'] = balances
+        return df[live], seq
+
+    def flush(self):
+        """
+        Compacts the write-ahead log into the CSV file (or flushes the
+        mapped pages of a binary store).
+        Writes a new checkpoint and drops the log records it covers.
+        """
+        with self._checkpoint_lock:
+            if self.wal.last_seq == self.checkpoint_seq:
+                return
+            with REGISTRY.phase('save'):
+                if self.binary is None:
+                    df, seq = self.snapshot()
+                    write_accounts(df, self.file_name)
+                else:
+                    with self.locks.hold_all():
+                        seq = self.wal.last_seq
+                    self.binary.flush()
+                self.ledger.save_aggregates()
+                write_checkpoint(self.file_name, seq)
+                self.checkpoint_seq = seq
+                self.wal.truncate(seq, {record['seq'] for record in list(self.prepared.values())})
+                self._drop_settlements(seq)
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        if not self._closed.is_set():
+            self._closed.set()
+            self.flush()
+            self.chain.close()
+            self.wal.close()
+            self.ledger.close()
+            self._table_lock.close()
@@ -0,0 +1,266 @@
+import argparse
+import io
+import os
+import sys
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from money import parse_cents_array
+
+SECONDS_PER_DAY = 86400
+
+# Array fields kept per account, with the value of an account that has no activity yet.
+# Money fields are int64 cents.
+FIELDS = {
+    'count': (np.int64, 0),
+    'total_in': (np.int64, 0),
+    'total_out': (np.int64, 0),
+    'min': (np.int64, np.iinfo(np.int64).max),
+    'max': (np.int64, np.iinfo(np.int64).min),
+    'last_activity': (np.int64, -1),
+    'day': (np.int64, -1),
+    'day_in': (np.int64, 0),
+    'day_out': (np.int64, 0),
+}
+
+
+# Convert a ledger timestamp to epoch seconds (naive timestamps are read as UTC)
+def epoch_seconds(timestamp):
+    if not timestamp:
+        return -1
+    return int(datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp())
+
+
+class RunningAggregates:
+    """
+    Per-account statistics kept up to date one ledger entry at a time:
+    transaction count, money in and out, smallest and largest amount,
+    last activity and the totals in and out on the day of the last activity.
+    Each update and lookup is O(1). covered records how many bytes of the
+    ledger file have been folded in, so a saved copy can be caught up by
+    reading only the ledger's tail.
+    """
+
+    def __init__(self, capacity=1024):
+        self._slots = {}
+        self.covered = 0
+        for name, (dtype, empty) in FIELDS.items():
+            setattr(self, name, np.full(capacity, empty, dtype=dtype))
+
+    def _slot(self, account_number):
+        slot = self._slots.get(account_number)
+        if slot is None:
+            slot = len(self._slots)
+            if slot == len(self.count):
+                for name, (dtype, empty) in FIELDS.items():
+                    grown = np.full(2 * slot, empty, dtype=dtype)
+                    grown[:slot] = getattr(self, name)
+                    setattr(self, name, grown)
+            self._slots[account_number] = slot
+        return slot
+
+    def update(self, account_number, amount, timestamp):
+        """
+        Folds one ledger entry (signed amount in cents, ISO timestamp) into the account's aggregates.
+        """
+        slot = self._slot(account_number)
+        self.count[slot] += 1
+        if amount >= 0:
+            self.total_in[slot] += amount
+        else:
+            self.total_out[slot] -= amount
+        self.min[slot] = min(self.min[slot], amount)
+        self.max[slot] = max(self.max[slot], amount)
+        seconds = epoch_seconds(timestamp)
+        if seconds < 0:
+            return
+        self.last_activity[slot] = max(self.last_activity[slot], seconds)
+        day = seconds // SECONDS_PER_DAY
+        if day > self.day[slot]:
+            self.day[slot], self.day_in[slot], self.day_out[slot] = day, 0, 0
+        if day == self.day[slot]:
+            if amount >= 0:
+                self.day_in[slot] += amount
+            else:
+                self.day_out[slot] -= amount
+
+    def fold(self, entry):
+        """
+        Folds in one parsed ledger entry; a 'close' entry forgets the account.
+        """
+        if entry['Type'] == 'close':
+            self.forget(entry['Account Number'])
+        else:
+            self.update(entry['Account Number'], entry['Amount'], entry['Timestamp'])
+
+    def forget(self, account_number):
+        """
+        Resets a closed account's aggregates, as if it never had any entries.
+        """
+        slot = self._slots.get(account_number)
+        if slot is None:
+            return
+        for name, (dtype, empty) in FIELDS.items():
+            getattr(self, name)[slot] = empty
+
+    def update_frame(self, frame):
+        """
+        Folds many ledger rows ('Account Number', 'Amount' in cents, 'Timestamp')
+        in at once using group-wise reductions.
+        """
+        if frame.empty:
+            return
+        amount = frame['Amount'].to_numpy(dtype=np.int64)
+        timestamps = pd.to_datetime(frame['Timestamp'].where(frame['Timestamp'] != ""), format='ISO8601')
+        seconds = np.where(timestamps.isna(), -1,
+                           timestamps.to_numpy(dtype='datetime64[s]').astype(np.int64))
+        rows = pd.DataFrame({
+            'account': frame['Account Number'].to_numpy(),
+            'amount': amount,
+            'in': np.where(amount >= 0, amount, 0),
+            'out': np.where(amount < 0, -amount, 0),
+            'seconds': seconds,
+            'day': np.where(seconds < 0, -1, seconds // SECONDS_PER_DAY),
+        })
+        grouped = rows.groupby('account', sort=False).agg(
+            count=('amount', 'size'), total_in=('in', 'sum'), total_out=('out', 'sum'),
+            min=('amount', 'min'), max=('amount', 'max'), last=('seconds', 'max'), day=('day', 'max'))
+        timed = rows[rows['day'] >= 0]
+        last_day = timed[timed['day'] == timed['account'].map(grouped['day'])]
+        day_totals = last_day.groupby('account')[['in', 'out']].sum().reindex(grouped.index, fill_value=0)
+
+        slots = np.fromiter((self._slot(n) for n in grouped.index.tolist()), dtype=np.int64, count=len(grouped))
+        self.count[slots] += grouped['count'].to_numpy()
+        self.total_in[slots] += grouped['total_in'].to_numpy()
+        self.total_out[slots] += grouped['total_out'].to_numpy()
+        self.min[slots] = np.minimum(self.min[slots], grouped['min'].to_numpy())
+        self.max[slots] = np.maximum(self.max[slots], grouped['max'].to_numpy())
+        self.last_activity[slots] = np.maximum(self.last_activity[slots], grouped['last'].to_numpy())
+        new_day = grouped['day'].to_numpy()
+        newer = new_day > self.day[slots]
+        self.day[slots[newer]] = new_day[newer]
+        self.day_in[slots[newer]] = 0
+        self.day_out[slots[newer]] = 0
+        same = (new_day == self.day[slots]) & (new_day >= 0)
+        self.day_in[slots[same]] += day_totals['in'].to_numpy()[same]
+        self.day_out[slots[same]] += day_totals['out'].to_numpy()[same]
+
+    def get(self, account_number):
+        """
+        Returns the account's aggregates as a dict (money in cents), or None if it has no entries.
+        """
+        slot = self._slots.get(account_number)
+        if slot is None or self.count[slot] == 0:
+            return None
+        last = int(self.last_activity[slot])
+        return {
+            'count': int(self.count[slot]),
+            'total_in': int(self.total_in[slot]),
+            'total_out': int(self.total_out[slot]),
+            'min': int(self.min[slot]),
+            'max': int(self.max[slot]),
+            'last_activity': datetime.fromtimestamp(last, timezone.utc).replace(tzinfo=None).isoformat()
+                             if last >= 0 else None,
+            'day_in': int(self.day_in[slot]),
+            'day_out': int(self.day_out[slot]),
+        }
+
+    def to_frame(self):
+        """
+        Returns the aggregates of every account with entries as a DataFrame
+        indexed by account number.
+        """
+        size = len(self._slots)
+        frame = pd.DataFrame({name: getattr(self, name)[:size] for name in FIELDS},
+                             index=pd.Index(list(self._slots), name='Account Number'))
+        return frame[frame['count'] > 0]
+
+    def save(self, file_name):
+        """
+        Writes the aggregates atomically to a NumPy .npz file.
+        """
+        size = len(self._slots)
+        tmp_name = file_name + ".tmp"
+        with open(tmp_name, 'wb') as f:
+            np.savez(f, accounts=np.array(list(self._slots), dtype=np.int64),
+                     covered=np.int64(self.covered),
+                     **{name: getattr(self, name)[:size] for name in FIELDS})
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        """
+        Reads aggregates saved by save(); returns an empty instance if there
+        are none or they predate cents (the ledger is then folded in again).
+        """
+        try:
+            data = np.load(file_name)
+        except FileNotFoundError:
+            return cls()
+        if data['total_in'].dtype.kind == 'f':
+            return cls()
+        accounts = data['accounts']
+        aggregates = cls(capacity=max(1024, 2 * len(accounts)))
+        aggregates._slots = dict(zip(accounts.tolist(), range(len(accounts))))
+        aggregates.covered = int(data['covered'])
+        for name in FIELDS:
+            getattr(aggregates, name)[:len(accounts)] = data[name]
+        return aggregates
+
+
+# Compare the running aggregates with ones recomputed from the whole ledger
+def verify(ledger_file):
+    """
+    Recomputes every account's aggregates from the ledger file and compares
+    them with the incrementally maintained ones. Returns a list of mismatches.
+    Nothing is written: the saved aggregates are caught up on the ledger's
+    tail in memory, as Ledger does when it opens, and a torn last line
+    (a write in progress) is left out of both sides.
+    """
+    from ledger import Ledger, aggregates_file_for, drop_closed
+
+    running = RunningAggregates.load(aggregates_file_for(ledger_file))
+    with open(ledger_file, 'rb') as f:
+        data = f.read()
+    data = data[:data.rfind(b"\n") + 1]
+    if running.covered > len(data):
+        running = RunningAggregates()
+    offset = data.find(b"\n") + 1
+    for line in io.BytesIO(data[max(offset, running.covered):]):
+        running.fold(Ledger._parse(line))
+    running = running.to_frame().sort_index()
+    expected = RunningAggregates()
+    frame = drop_closed(pd.read_csv(io.BytesIO(data), usecols=['Account Number', 'Type', 'Amount', 'Timestamp'],
+                                    dtype={'Amount': str, 'Timestamp': str}, keep_default_na=False))
+    expected.update_frame(frame.assign(Amount=parse_cents_array(frame['Amount'])))
+    expected = expected.to_frame().sort_index()
+    if not running.index.equals(expected.index):
+        return [f"Accounts differ: {sorted(set(running.index) ^ set(expected.index))}"]
+    mismatches = []
+    for name in FIELDS:
+        differs = running[name].to_numpy() != expected[name].to_numpy()
+        for account_number in running.index[differs]:
+            mismatches.append(f"Account {account_number}: {name} is {running.at[account_number, name]}, "
+                              f"ledger says {expected.at[account_number, name]}")
+    return mismatches
+
+
+def main():
+    from ledger import ledger_file_for
+
+    parser = argparse.ArgumentParser(description="Check the running per-account aggregates against the ledger.")
+    parser.add_argument("--database", default="bank_database.csv")
+    args = parser.parse_args()
+    mismatches = verify(ledger_file_for(args.database))
+    for mismatch in mismatches:
+        print(mismatch)
+    print("Aggregates match the ledger." if not mismatches else f"{len(mismatches)} mismatches found.")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
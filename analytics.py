@@ -0,0 +1,124 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from ledger import LEDGER_COLUMNS, drop_closed, ledger_file_for
+from money import parse_cents_array
+
+STATS_COLUMNS = ['Count', 'Mean', 'Min', 'Max', 'Net Flow', 'Final Balance', 'Trend', 'Forecast']
+# Statistics computed in cents
+MONEY_COLUMNS = STATS_COLUMNS[1:]
+
+
+# Load the whole ledger as numeric columns
+def load_ledger_frame(file_name):
+    """
+    Reads the ledger CSV with only the columns the analytics need, Amount in cents.
+    Entries that closed accounts left behind are dropped.
+    """
+    df = drop_closed(pd.read_csv(file_name, usecols=['Account Number', 'Type', 'Amount'],
+                                 dtype={'Account Number': np.int64, 'Amount': str}))
+    return pd.DataFrame({'Account Number': df['Account Number'], 'Amount': parse_cents_array(df['Amount'])})
+
+
+# Build a ledger frame from entries returned by Ledger.history/page
+def entries_frame(entries):
+    return pd.DataFrame(entries, columns=LEDGER_COLUMNS)[['Account Number', 'Amount']]
+
+
+# Compute per-account statistics for every account at once
+def account_stats(ledger_df, future_steps=5):
+    """
+    Computes, for every account in the ledger frame, the number of
+    transactions, mean/min/max amount, net flow, the final cumulative balance,
+    the slope of a least-squares line through the cumulative balance
+    (Trend, per transaction) and that line's value future_steps transactions
+    ahead (Forecast). Amounts are cents; Min, Max, Net Flow and Final Balance
+    stay exact int64 while Mean, Trend and Forecast are fractional cents.
+
+    All accounts are processed together: the rows are grouped with one stable
+    sort and every statistic is a group-wise NumPy reduction, so there is no
+    Python loop over accounts or transactions.
+    """
+    accounts = ledger_df['Account Number'].to_numpy()
+    amounts = ledger_df['Amount'].to_numpy(dtype=np.int64)
+    if len(accounts) == 0:
+        return pd.DataFrame(columns=STATS_COLUMNS, index=pd.Index([], name='Account Number'))
+
+    # Group rows by account while keeping each account's entries in ledger order
+    order = np.argsort(accounts, kind='stable')
+    accounts, amounts = accounts[order], amounts[order]
+    keys, starts, counts = np.unique(accounts, return_index=True, return_counts=True)
+
+    totals = np.add.reduceat(amounts, starts)
+    means = totals / counts
+
+    # Cumulative balance within each account and each row's position in its group
+    running = np.cumsum(amounts)
+    offsets = np.concatenate(([0], running[starts[1:] - 1]))
+    cumulative = running - np.repeat(offsets, counts)
+    x = np.arange(len(amounts)) - np.repeat(starts, counts)
+
+    # Least-squares line y = intercept + slope * x, fitted per account (in floats, x * y can exceed int64)
+    sum_x = np.add.reduceat(x, starts).astype(np.float64)
+    sum_y = np.add.reduceat(cumulative, starts).astype(np.float64)
+    sum_xy = np.add.reduceat(x * cumulative.astype(np.float64), starts)
+    sum_xx = np.add.reduceat(x * x, starts).astype(np.float64)
+    denominator = counts * sum_xx - sum_x ** 2
+    slope = np.divide(counts * sum_xy - sum_x * sum_y, denominator,
+                      out=np.zeros_like(sum_y), where=denominator != 0)
+    intercept = (sum_y - slope * sum_x) / counts
+
+    return pd.DataFrame({
+        'Count': counts,
+        'Mean': means,
+        'Min': np.minimum.reduceat(amounts, starts),
+        'Max': np.maximum.reduceat(amounts, starts),
+        'Net Flow': totals,
+        'Final Balance': cumulative[starts + counts - 1],
+        'Trend': slope,
+        'Forecast': intercept + slope * (counts - 1 + future_steps),
+    }, index=pd.Index(keys, name='Account Number'))
+
+
+# Convert the money columns of account_stats() output from cents to dollars
+def stats_in_dollars(stats):
+    return stats.assign(**{column: stats[column] / 100 for column in MONEY_COLUMNS})
+
+
+# Print one account's statistics the way the old analyze_transactions did
+def print_stats(stats, account_number, future_steps=5):
+    if account_number not in stats.index:
+        print("No transactions to analyze.")
+        return
+    row = stats_in_dollars(stats.loc[[account_number]]).iloc[0]
+    print(f"Total Transactions: {int(row['Count'])}")
+    print(f"Average Transaction Amount: ${row['Mean']:.2f}")
+    print(f"Maximum Transaction Amount: ${row['Max']:.2f}")
+    print(f"Minimum Transaction Amount: ${row['Min']:.2f}")
+    print(f"Net Flow: ${row['Net Flow']:.2f}")
+    print(f"Balance Trend: ${row['Trend']:.2f} per transaction")
+    print(f"Predicted Balance after {future_steps} more transactions: ${row['Forecast']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-account transaction analytics over the whole ledger.")
+    parser.add_argument("--database", default="bank_database.csv")
+    parser.add_argument("--account", type=int, help="print the statistics of one account")
+    parser.add_argument("--future-steps", type=int, default=5)
+    parser.add_argument("--output", help="write the statistics of every account to this CSV file")
+    args = parser.parse_args()
+
+    stats = account_stats(load_ledger_frame(ledger_file_for(args.database)), args.future_steps)
+    if args.account is not None:
+        print_stats(stats, args.account, args.future_steps)
+    if args.output:
+        stats_in_dollars(stats).to_csv(args.output, float_format="%.2f")
+        print(f"Statistics for {len(stats)} accounts written to {args.output}.")
+    elif args.account is None:
+        print(stats_in_dollars(stats).to_string(float_format=lambda value: f"{value:.2f}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+from account_store import AccountNotFound, InsufficientFunds, InvalidBatch
+from analytics import account_stats, entries_frame, stats_in_dollars
+from ledger import format_entry
+from money import format_cents, to_cents, to_dollars
+from pins import check_pin
+
+# Request handlers shared by the Flask server (atm_be.py) and the ASGI server
+# (atm_be_async.py). Each takes the Storage (see storage.py) and the decoded JSON body and
+# returns a (response dict, HTTP status) pair. The storage works in cents; amounts are
+# parsed from and returned as dollars here. The account routes take their account_number
+# from the session opened by login (see authenticate and sessions.py).
+
+# Largest number of operations accepted by one /batch request
+MAX_BATCH_SIZE = 10000
+
+# Aggregate fields of /stats that are amounts
+STATS_AMOUNTS = ('total_in', 'total_out', 'min', 'max', 'day_in', 'day_out')
+
+# Default and maximum number of ledger entries returned per /transactions page
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Default and largest number of transactions /analytics projects ahead
+FUTURE_STEPS = 5
+MAX_FUTURE_STEPS = 1000
+
+
+# Verify the PIN once and open a session; later requests carry its token instead
+def login(store, sessions, data):
+    if store is None:
+        return {"error": "Database not found"}, 500
+    if not isinstance(data, dict):
+        return {"error": "Login needs account_number and pin"}, 400
+    try:
+        account_number = int(data.get("account_number"))
+        pin = str(data["pin"])
+    except (KeyError, TypeError, ValueError):
+        return {"error": "Login needs account_number and pin"}, 400
+    try:
+        stored = store.get_account(account_number)['pin']
+    except AccountNotFound:
+        stored = None
+    if stored is None or not check_pin(account_number, stored, pin):
+        return {"error": "Invalid account number or PIN"}, 401
+    return {"message": "Login successful", "token": sessions.create(account_number),
+            "expires_in": sessions.ttl}, 200
+
+
+def logout(sessions, token):
+    if token:
+        sessions.revoke(token)
+    return {"message": "Logged out"}, 200
+
+
+# Resolve the session token of a request into the account it acts on
+def authenticate(sessions, token, data):
+    """
+    Returns (data, None) with account_number set to the session's account,
+    or (None, error response) when the token is missing, unknown or
+    expired. A sender in the body is dropped: transfers always leave the
+    logged-in account. A body that is not a JSON object counts as empty.
+    """
+    account_number = sessions.get(token) if token else None
+    if account_number is None:
+        return None, ({"error": "Login required"}, 401)
+    data = {key: value for key, value in (data if isinstance(data, dict) else {}).items() if key != "sender"}
+    data["account_number"] = account_number
+    return data, None
+
+
+def get_balance(store, data):
+    account_number = data.get("account_number")
+    try:
+        balance = store.get_balance(account_number)
+    except AccountNotFound:
+        return {"error": "Account not found"}, 404
+    return {"balance": to_dollars(balance)}, 200
+
+
+def withdraw(store, data):
+    account_number = data.get("account_number")
+    try:
+        amount = to_cents(data.get("amount"))
+    except ValueError:
+        return {"error": "Withdrawal needs a valid amount"}, 400
+    if not amount > 0:
+        return {"error": "Amount must be positive"}, 400
+    try:
+        balance = store.withdraw(account_number, amount)
+    except AccountNotFound:
+        return {"error": "Account not found"}, 404
+    except InsufficientFunds:
+        return {"error": "Insufficient funds"}, 400
+    return {"message": "Withdrawal successful", "balance": to_dollars(balance)}, 200
+
+
+def deposit(store, data):
+    account_number = data.get("account_number")
+    try:
+        amount = to_cents(data.get("amount"))
+    except ValueError:
+        return {"error": "Deposit needs a valid amount"}, 400
+    if not amount > 0:
+        return {"error": "Amount must be positive"}, 400
+    try:
+        balance = store.deposit(account_number, amount)
+    except AccountNotFound:
+        return {"error": "Account not found"}, 404
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return {"message": "Deposit successful", "balance": to_dollars(balance)}, 200
+
+
+def transfer(store, data):
+    try:
+        sender = int(data.get("sender", data.get("account_number")))
+        receiver = int(data.get("receiver", data.get("receiver_account_number")))
+        amount = to_cents(data.get("amount"))
+    except (TypeError, ValueError):
+        return {"error": "Transfer needs sender, receiver and amount"}, 400
+    if not amount > 0:
+        return {"error": "Amount must be positive"}, 400
+    try:
+        balance = store.transfer(sender, receiver, amount)
+    except AccountNotFound as e:
+        return {"error": f"Account {e.args[0]} not found"}, 404
+    except InsufficientFunds:
+        return {"error": "Insufficient funds"}, 400
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return {"message": f"${format_cents(amount)} transferred successfully to Account {receiver}.",
+            "balance": to_dollars(balance)}, 200
+
+
+# Participant side of a cross-shard transfer, driven by shard_router.py
+def prepare_transfer(store, data):
+    try:
+        txid = str(data["txid"])
+        account_number = int(data.get("account_number"))
+        amount = to_cents(data.get("amount"))
+        counterparty = data.get("counterparty")
+    except (KeyError, TypeError, ValueError):
+        return {"error": "Prepare needs txid, account_number and amount"}, 400
+    if amount == 0:
+        return {"error": "Amount must not be zero"}, 400
+    try:
+        balance = store.prepare_transfer(txid, account_number, amount, counterparty)
+    except AccountNotFound:
+        return {"error": f"Account {account_number} not found"}, 404
+    except InsufficientFunds:
+        return {"error": "Insufficient funds"}, 400
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return {"message": "Prepared", "balance": to_dollars(balance)}, 200
+
+
+def commit_transfer(store, data):
+    balance = store.commit_transfer(str(data.get("txid")))
+    if balance is None:
+        return {"error": "Unknown transaction"}, 404
+    return {"message": "Committed", "balance": to_dollars(balance)}, 200
+
+
+def abort_transfer(store, data):
+    store.abort_transfer(str(data.get("txid")))
+    return {"message": "Aborted"}, 200
+
+
+def pending_transfers(store):
+    return {"pending": store.pending_transfers()}, 200
+
+
+def account_details(store, account, if_none_match):
+    """
+    Returns (body, status, etag). When the client's If-None-Match already
+    holds the current version the answer is a bodiless 304, decided from the
+    version counter alone.
+    """
+    try:
+        account_number = int(account)
+        etag = store.etag(account_number)
+    except (TypeError, ValueError):
+        return {"success": False, "error": "Invalid account number"}, 400, None
+    except AccountNotFound:
+        return {"success": False, "error": "Account not found"}, 404, None
+    if etag in if_none_match:
+        return None, 304, etag
+    etag, details = store.get_details(account_number)
+    return {"success": True, **details, "balance": to_dollars(details['balance'])}, 200, etag
+
+
+def batch(store, data):
+    if not isinstance(data, dict):
+        return {"error": "The body must be a JSON object"}, 400
+    operations = data.get("operations")
+    if not isinstance(operations, list) or not operations:
+        return {"error": "operations must be a non-empty list"}, 400
+    if len(operations) > MAX_BATCH_SIZE:
+        return {"error": f"At most {MAX_BATCH_SIZE} operations per batch"}, 400
+    try:
+        parsed = [(op.get("op"), int(op.get("account_number")), to_cents(op.get("amount")))
+                  for op in operations]
+    except (AttributeError, TypeError, ValueError):
+        return {"error": "Each operation needs op, account_number and amount"}, 400
+    try:
+        results = store.apply_batch(parsed)
+    except InvalidBatch as e:
+        return {"error": "Invalid batch", "details": e.args[0]}, 400
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    results = [{"balance": to_dollars(result["balance"])} if "balance" in result else result
+               for result in results]
+    applied = sum("error" not in result for result in results)
+    return {"message": f"{applied} of {len(results)} operations applied", "results": results}, 200
+
+
+def stats(store, data):
+    account_number = data.get("account_number")
+    try:
+        aggregates = store.get_stats(account_number)
+    except AccountNotFound:
+        return {"error": "Account not found"}, 404
+    return {"account_number": account_number, **aggregates,
+            **{field: to_dollars(aggregates[field]) for field in STATS_AMOUNTS if field in aggregates}}, 200
+
+
+def transactions(store, data):
+    account_number = data.get("account_number")
+    try:
+        cursor = int(data.get("cursor") or 0)
+        limit = min(int(data.get("limit") or PAGE_SIZE), MAX_PAGE_SIZE)
+        if cursor < 0 or limit <= 0:
+            raise ValueError("cursor and limit must be positive")
+        min_amount = data.get("min_amount")
+        max_amount = data.get("max_amount")
+        entries, next_cursor = store.get_statement(
+            account_number, cursor, limit,
+            start=data.get("start"), end=data.get("end"),
+            min_amount=None if min_amount is None else to_cents(min_amount),
+            max_amount=None if max_amount is None else to_cents(max_amount))
+    except AccountNotFound:
+        return {"error": "Account not found"}, 404
+    except (TypeError, ValueError):
+        return {"error": "Invalid page parameters"}, 400
+    return {"transactions": "".join(format_entry(entry) + ", " for entry in entries),
+            "entries": [{**entry, 'Amount': to_dollars(entry['Amount'])} for entry in entries],
+            "next_cursor": next_cursor}, 200
+
+
+def analytics(store, data):
+    account_number = data.get("account_number")
+    try:
+        future_steps = data.get("future_steps")
+        future_steps = FUTURE_STEPS if future_steps is None else int(future_steps)
+    except (TypeError, ValueError):
+        return {"error": "future_steps must be an integer"}, 400
+    if not 1 <= future_steps <= MAX_FUTURE_STEPS:
+        return {"error": f"future_steps must be between 1 and {MAX_FUTURE_STEPS}"}, 400
+    try:
+        entries = store.get_history(account_number)
+    except AccountNotFound:
+        return {"error": "Account not found"}, 404
+    stats = account_stats(entries_frame(entries), future_steps)
+    if stats.empty:
+        return {"message": "No transactions to analyze."}, 200
+    row = stats_in_dollars(stats).iloc[0]
+    return {"account_number": account_number, "count": int(row['Count']),
+            **{column.lower().replace(" ", "_"): float(row[column]) for column in stats.columns[1:]}}, 200
@@ -1,146 +1,140 @@
-import pandas as pd
+from ledger import format_entry
+from money import format_cents, to_cents
+from profiling import Profiler
+from storage import AccountNotFound, InsufficientFunds, TableInUse, open_storage
 
-# Load the database (CSV file) into a Pandas DataFrame
+# Menu choices by name, used to label CLI profiles (see profiling.py)
+OPERATIONS = {"1": "balance", "2": "withdraw", "3": "deposit", "4": "statements", "5": "transfer", "6": "analyze", "7": "exit"}
+
+# Off unless ATM_PROFILE_RATE is set; targets are named "cli:<operation>"
+PROFILER = Profiler.from_environ()
+
+# Open the account storage (CSV file, binary store or SQLite database)
 def load_database(file_name):
     """
-    Loads the CSV file into a Pandas DataFrame.
-    Replaces NaN values in the 'Transactions' column with an empty string.
-    Ensures the 'Balance' column is numeric.
+    Opens the storage backend for the given file.
+    Returns None if the database does not exist or the server has it open.
     """
     try:
-        df = pd.read_csv(file_name)
-        df['Transactions'] = df['Transactions'].fillna("")  # Replace NaN with empty strings
-        
-        # Ensure the 'Balance' column is numeric
-        if not pd.api.types.is_numeric_dtype(df['Balance']):
-            print("Warning: Converting 'Balance' column to numeric type.")
-            df['Balance'] = pd.to_numeric(df['Balance'], errors='coerce')  # Convert to numeric, invalid values become NaN
-            df['Balance'] = df['Balance'].fillna(0.0)  # Replace NaN with 0.0
-        
-        print("Database loaded successfully.")
-        return df
-    except FileNotFoundError:
+        store = open_storage(file_name, lite=True)
+    except TableInUse as e:
+        print(f"Error: {e}. Stop the server first, or use it instead.")
+        return None
+    if store is None:
         print(f"Error: File '{file_name}' not found.")
         return None
+    print("Database loaded successfully.")
+    return store
 
-# Save the updated DataFrame back to the CSV file
-def save_database(df, file_name):
+# Make every change durable and release the storage
+def save_database(store):
     """
-    Saves the updated DataFrame back to the CSV file.
+    Closes the storage; every change was already recorded when it was made.
     """
     try:
-        df.to_csv(file_name, index=False)
+        store.close()
         print("Database saved successfully.")
     except Exception as e:
         print(f"Error saving database: {e}")
 
-# Find account details by account number
-def find_account(df, account_number):
-    """
-    Finds the account index in the DataFrame based on the account number.
-    Returns the row index if found, otherwise returns None.
-    """
-    account = df[df['Account Number'] == account_number]
-    return None if account.empty else account.index[0]
-
 # Display account balance
-def display_balance(df, account_index):
+def display_balance(store, account_number):
     """
     Displays the current balance of the account.
     """
-    balance = df.loc[account_index, 'Balance']
-    print(f"Your current balance is: ${balance:.2f}")
+    balance = store.get_balance(account_number)
+    print(f"Your current balance is: ${format_cents(balance)}")
 
 # Withdraw money from the account
-def withdraw(df, account_index, amount):
+def withdraw(store, account_number, amount):
     """
     Withdraws money from the account if sufficient funds are available.
-    Updates the balance and transaction history.
+    The storage records the withdrawal in the ledger.
     """
-    balance = df.loc[account_index, 'Balance']
-    if amount > balance:
+    try:
+        store.withdraw(account_number, amount)
+    except InsufficientFunds:
         print("Insufficient funds!")
         return False
-    df.loc[account_index, 'Balance'] -= amount
-    transactions = df.loc[account_index, 'Transactions'] or ""
-    transactions += f"Withdrawal: -${amount:.2f}, "
-    df.loc[account_index, 'Transactions'] = transactions
-    print(f"${amount:.2f} withdrawn successfully.")
+    print(f"${format_cents(amount)} withdrawn successfully.")
     return True
 
 # Deposit money into the account
-def deposit(df, account_index, amount):
+def deposit(store, account_number, amount):
     """
     Deposits money into the account.
-    Updates the balance and transaction history.
+    The storage records the deposit in the ledger.
     """
-    df.loc[account_index, 'Balance'] += amount
-    transactions = df.loc[account_index, 'Transactions'] or ""
-    transactions += f"Deposit: +${amount:.2f}, "
-    df.loc[account_index, 'Transactions'] = transactions
-    print(f"${amount:.2f} deposited successfully.")
+    store.deposit(account_number, amount)
+    print(f"${format_cents(amount)} deposited successfully.")
 
 # View transaction history
-def view_statements(df, account_index):
+def view_statements(store, account_number, page_size=10):
     """
-    Displays the transaction history of the account.
+    Displays the transaction history of the account from the ledger,
+    one page at a time.
     """
-    transactions = df.loc[account_index, 'Transactions']
-    if transactions:
-        print("Transaction History:")
-        print(transactions)
-    else:
+    entries, cursor = store.get_statement(account_number, limit=page_size)
+    if not entries:
         print("No transactions recorded yet.")
+        return
+    print("Transaction History:")
+    while True:
+        for entry in entries:
+            print(format_entry(entry))
+        if cursor is None or input("Show more? (y/n): ").strip().lower() != "y":
+            break
+        entries, cursor = store.get_statement(account_number, cursor, page_size)
 
 # Transfer money to another account
-def transfer_money(df, sender_index, receiver_account_number, amount):
+def transfer_money(store, sender_account_number, receiver_account_number, amount):
     """
     Transfers money from one account to another if sufficient funds are available.
-    Updates both accounts' balances and transaction histories.
+    Both balances and both ledger entries change in one atomic step.
     """
-    # Check sender's balance
-    sender_balance = df.loc[sender_index, 'Balance']
-    if amount > sender_balance:
+    try:
+        store.transfer(sender_account_number, receiver_account_number, amount)
+    except InsufficientFunds:
         print("Insufficient funds for transfer!")
         return False
-    
-    # Find the receiver's account
-    receiver_index = find_account(df, receiver_account_number)
-    if receiver_index is None:
+    except AccountNotFound:
         print("Receiver account not found!")
         return False
-    
-    # Update sender's account
-    df.loc[sender_index, 'Balance'] -= amount  # Deduct amount from sender's balance
-    sender_transactions = df.loc[sender_index, 'Transactions'] or ""
-    sender_transactions += f"Transfer to Account {receiver_account_number}: -${amount:.2f}, "
-    df.loc[sender_index, 'Transactions'] = sender_transactions
-    
-    # Update receiver's account
-    df.loc[receiver_index, 'Balance'] += amount  # Add amount to receiver's balance
-    receiver_transactions = df.loc[receiver_index, 'Transactions'] or ""
-    receiver_transactions += f"Transfer from Account {df.loc[sender_index, 'Account Number']}: +${amount:.2f}, "
-    df.loc[receiver_index, 'Transactions'] = receiver_transactions
-    
-    print(f"${amount:.2f} transferred successfully to Account {receiver_account_number}.")
+    except ValueError as e:
+        print(e)
+        return False
+    print(f"${format_cents(amount)} transferred successfully to Account {receiver_account_number}.")
     return True
 
+# Analyze the account's transactions and forecast its balance
+def analyze_transactions(store, account_number):
+    """
+    Shows transaction statistics and a linear balance forecast for the account,
+    computed by the vectorized analytics engine over its ledger entries.
+    The engine (and with it pandas) is only loaded the first time.
+    """
+    from analytics import account_stats, entries_frame, print_stats
+
+    stats = account_stats(entries_frame(store.get_history(account_number)))
+    print_stats(stats, account_number)
+
 # Main function to handle user interaction
-def main():
-    file_name = "bank_database.csv"  # Define the file name here
-    df = load_database(file_name)
-    if df is None:
+def main(file_name="bank_database.csv"):
+    with PROFILER.profile("cli:load"):
+        store = load_database(file_name)
+    if store is None:
         return
     
     # Input account number
     try:
         account_number = int(input("Enter your account number: "))
-        account_index = find_account(df, account_number)
-        if account_index is None:
+        if not store.exists(account_number):
             print("Account not found!")
+            save_database(store)
             return
     except ValueError:
         print("Invalid account number. Please enter a numeric value.")
+        save_database(store)
         return
     
     print("\nWelcome to the ATM!")
@@ -151,52 +145,56 @@ def main():
         print("3. Deposit Money")
         print("4. View Statements")
         print("5. Transfer Money to Another Account")
-        print("6. Exit")
-        choice = input("Enter your choice (1-6): ")
-        
-        # Dynamically retrieve the account index to ensure it's up-to-date
-        account_index = find_account(df, account_number)
+        print("6. Analyze Transactions")
+        print("7. Exit")
+        choice = input("Enter your choice (1-7): ")
         
-        if choice == "1":
-            display_balance(df, account_index)
-        elif choice == "2":
-            try:
-                amount = float(input("Enter the amount to withdraw: "))
-                if amount <= 0:
-                    print("Invalid amount! Please enter a positive number.")
-                else:
-                    withdraw(df, account_index, amount)
-            except ValueError:
-                print("Please enter a valid number.")
-        elif choice == "3":
-            try:
-                amount = float(input("Enter the amount to deposit: "))
-                if amount <= 0:
-                    print("Invalid amount! Please enter a positive number.")
-                else:
-                    deposit(df, account_index, amount)
-            except ValueError:
-                print("Please enter a valid number.")
-        elif choice == "4":
-            view_statements(df, account_index)
-        elif choice == "5":
-            try:
-                receiver_account_number = int(input("Enter the receiver's account number: "))
-                amount = float(input("Enter the amount to transfer: "))
-                if amount <= 0:
-                    print("Invalid amount! Please enter a positive number.")
-                else:
-                    transfer_money(df, account_index, receiver_account_number, amount)
-            except ValueError:
-                print("Please enter valid numbers for the account and amount.")
-        elif choice == "6":
-            print("Thank you for using the ATM. Goodbye!")
-            break
-        else:
-            print("Invalid choice. Please try again.")
+        with PROFILER.profile("cli:" + OPERATIONS.get(choice, "invalid")):
+            if choice == "1":
+                display_balance(store, account_number)
+            elif choice == "2":
+                try:
+                    amount = to_cents(input("Enter the amount to withdraw: "))
+                    if amount <= 0:
+                        print("Invalid amount! Please enter a positive number.")
+                    else:
+                        withdraw(store, account_number, amount)
+                except ValueError:
+                    print("Please enter a valid number.")
+            elif choice == "3":
+                try:
+                    amount = to_cents(input("Enter the amount to deposit: "))
+                    if amount <= 0:
+                        print("Invalid amount! Please enter a positive number.")
+                    else:
+                        deposit(store, account_number, amount)
+                except ValueError:
+                    print("Please enter a valid number.")
+            elif choice == "4":
+                view_statements(store, account_number)
+            elif choice == "5":
+                try:
+                    receiver_account_number = int(input("Enter the receiver's account number: "))
+                    amount = to_cents(input("Enter the amount to transfer: "))
+                    if amount <= 0:
+                        print("Invalid amount! Please enter a positive number.")
+                    else:
+                        transfer_money(store, account_number, receiver_account_number, amount)
+                except ValueError:
+                    print("Please enter valid numbers for the account and amount.")
+            elif choice == "6":
+                analyze_transactions(store, account_number)
+            elif choice == "7":
+                print("Thank you for using the ATM. Goodbye!")
+                break
+            else:
+                print("Invalid choice. Please try again.")
     
     # Save changes to the database before exiting
-    save_database(df, file_name)
+    with PROFILER.profile("cli:save"):
+        save_database(store)
+    if PROFILER.profiled:
+        print(f"Profile report written to {PROFILER.write_report()}.")
 
 if __name__ == "__main__":
     main()
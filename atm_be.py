@@ -1,82 +1,164 @@
-from flask import Flask, request, jsonify
-import pandas as pd
+import os
+import time
+
+from flask import Flask, g, request, jsonify
+from metrics import CONTENT_TYPE, REGISTRY
+from profiling import Profiler
+from sessions import SessionTable, bearer_token
+from storage import open_storage
+import api
 
 app = Flask(__name__)
-FILE_NAME = "bank_database.csv"
+# A CSV file, a binary store directory (see binary_store.py) or a SQLite .db file
+FILE_NAME = os.environ.get("BANK_DATABASE", "bank_database.csv")
+
+# The storage is opened once for the life of the server
+store = open_storage(FILE_NAME)
+
+# Off unless ATM_PROFILE_RATE is set or it is switched on through /admin/profiling
+PROFILER = Profiler.from_environ()
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
 
-def load_database():
-    try:
-        df = pd.read_csv(FILE_NAME)
-        df['Transactions'] = df['Transactions'].fillna("")
-        df['Balance'] = pd.to_numeric(df['Balance'], errors='coerce').fillna(0.0)
-        return df
-    except FileNotFoundError:
-        return None
+# Sessions opened by /login (see sessions.py); the account routes need one
+SESSIONS = SessionTable.from_environ()
 
-def save_database(df):
-    df.to_csv(FILE_NAME, index=False)
+def respond(result):
+    body, status = result
+    return jsonify(body), status
+
+def session_token():
+    return bearer_token(request.headers.get("Authorization"))
+
+# Run an account route for the account of the request's session
+def authenticated(handler):
+    data, error = api.authenticate(SESSIONS, session_token(), request.get_json(silent=True))
+    return respond(error or handler(store, data))
 
 @app.route('/login', methods=['POST'])
 def login():
-    data = request.json
-    account_number = data.get("account_number")
-    df = load_database()
-    if df is None:
-        return jsonify({"error": "Database not found"}), 500
-    account = df[df['Account Number'] == account_number]
-    if account.empty:
-        return jsonify({"error": "Account not found"}), 404
-    return jsonify({"message": "Login successful"})
+    return respond(api.login(store, SESSIONS, request.json))
+
+@app.route('/logout', methods=['POST'])
+def logout():
+    return respond(api.logout(SESSIONS, session_token()))
 
 @app.route('/balance', methods=['POST'])
 def get_balance():
-    data = request.json
-    account_number = data.get("account_number")
-    df = load_database()
-    account = df[df['Account Number'] == account_number]
-    if account.empty:
-        return jsonify({"error": "Account not found"}), 404
-    return jsonify({"balance": account.iloc[0]['Balance']})
+    return authenticated(api.get_balance)
 
 @app.route('/withdraw', methods=['POST'])
 def withdraw():
-    data = request.json
-    account_number = data.get("account_number")
-    amount = float(data.get("amount"))
-    df = load_database()
-    index = df[df['Account Number'] == account_number].index
-    if index.empty:
-        return jsonify({"error": "Account not found"}), 404
-    if df.loc[index[0], 'Balance'] < amount:
-        return jsonify({"error": "Insufficient funds"}), 400
-    df.loc[index[0], 'Balance'] -= amount
-    df.loc[index[0], 'Transactions'] += f"Withdrawal: -${amount:.2f}, "
-    save_database(df)
-    return jsonify({"message": "Withdrawal successful", "balance": df.loc[index[0], 'Balance']})
+    return authenticated(api.withdraw)
 
 @app.route('/deposit', methods=['POST'])
 def deposit():
-    data = request.json
-    account_number = data.get("account_number")
-    amount = float(data.get("amount"))
-    df = load_database()
-    index = df[df['Account Number'] == account_number].index
-    if index.empty:
-        return jsonify({"error": "Account not found"}), 404
-    df.loc[index[0], 'Balance'] += amount
-    df.loc[index[0], 'Transactions'] += f"Deposit: +${amount:.2f}, "
-    save_database(df)
-    return jsonify({"message": "Deposit successful", "balance": df.loc[index[0], 'Balance']})
+    return authenticated(api.deposit)
+
+@app.route('/transfer', methods=['POST'])
+def transfer():
+    return authenticated(api.transfer)
+
+# Details of the session's account; an account query parameter is ignored
+@app.route('/get_account_details', methods=['GET'])
+def get_account_details():
+    data, error = api.authenticate(SESSIONS, session_token(), None)
+    if error is not None:
+        return respond(error)
+    body, status, etag = api.account_details(store, data["account_number"], request.if_none_match)
+    response = app.response_class(status=status) if body is None else jsonify(body)
+    response.status_code = status
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+# Bulk deposits and withdrawals on any accounts for upstream systems. Local callers only.
+@app.route('/batch', methods=['POST'])
+def batch():
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        return jsonify({"error": "Forbidden"}), 403
+    return respond(api.batch(store, request.json))
 
 @app.route('/transactions', methods=['POST'])
 def transactions():
-    data = request.json
-    account_number = data.get("account_number")
-    df = load_database()
-    account = df[df['Account Number'] == account_number]
-    if account.empty:
-        return jsonify({"error": "Account not found"}), 404
-    return jsonify({"transactions": account.iloc[0]['Transactions']})
+    return authenticated(api.transactions)
+
+@app.route('/stats', methods=['POST'])
+def stats():
+    return authenticated(api.stats)
+
+@app.route('/analytics', methods=['POST'])
+def analytics():
+    return authenticated(api.analytics)
+
+# Every request is timed and counted by route for /metrics
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    rule = request.url_rule
+    REGISTRY.observe_request(rule.rule if rule else "unmatched", response.status_code,
+                             time.perf_counter() - g.request_start)
+    return response
+
+# Sampled requests to the selected routes are profiled
+@app.before_request
+def start_profile():
+    rule = request.url_rule
+    g.profile = PROFILER.start(rule.rule if rule else "unmatched")
+
+@app.teardown_request
+def stop_profile(exc):
+    PROFILER.stop(g.pop('profile', None))
+
+# Switch profiling on or off without a restart: POST {"rate", "routes", "mode"}.
+# GET returns the settings and the aggregated report. Local callers only.
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def profiling():
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        return jsonify({"error": "Forbidden"}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "The body must be a JSON object"}), 400
+        try:
+            PROFILER.configure(rate=data.get("rate"), targets=data.get("routes"), mode=data.get("mode"),
+                               interval=data.get("interval"))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+    return jsonify({**PROFILER.settings(), "report": PROFILER.report()})
+
+# Two-phase commit endpoints a shard router (see shard_router.py) drives for
+# transfers between shards. Local callers only.
+@app.route('/2pc/prepare', methods=['POST'])
+def prepare_transfer():
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        return jsonify({"error": "Forbidden"}), 403
+    return respond(api.prepare_transfer(store, request.json))
+
+@app.route('/2pc/commit', methods=['POST'])
+def commit_transfer():
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        return jsonify({"error": "Forbidden"}), 403
+    return respond(api.commit_transfer(store, request.json))
+
+@app.route('/2pc/abort', methods=['POST'])
+def abort_transfer():
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        return jsonify({"error": "Forbidden"}), 403
+    return respond(api.abort_transfer(store, request.json))
+
+@app.route('/2pc/pending', methods=['GET'])
+def pending_transfers():
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        return jsonify({"error": "Forbidden"}), 403
+    return respond(api.pending_transfers(store))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # No reloader: its parent process would open the table as well
+    app.run(debug=True, use_reloader=False)
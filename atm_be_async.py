@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+
+from quart import Quart, g, request, jsonify
+from metrics import CONTENT_TYPE, REGISTRY
+from sessions import SessionTable, bearer_token
+from storage import open_storage
+import api
+
+# ASGI variant of atm_be.py, wire-compatible with script.js.
+# Run with an ASGI server, e.g. `hypercorn atm_be_async:app --bind 127.0.0.1:5000`,
+# or `python atm_be_async.py` for the built-in development server.
+app = Quart(__name__)
+# A CSV file, a binary store directory (see binary_store.py) or a SQLite .db file
+FILE_NAME = os.environ.get("BANK_DATABASE", "bank_database.csv")
+
+# The storage is opened once for the life of the server
+store = open_storage(FILE_NAME)
+
+# Sessions opened by /login (see sessions.py); the account routes need one
+SESSIONS = SessionTable.from_environ()
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+
+def respond(result):
+    body, status = result
+    return jsonify(body), status
+
+def session_token():
+    return bearer_token(request.headers.get("Authorization"))
+
+# Reads are answered on the event loop when the store keeps them in memory
+# (see Storage.in_memory); anything that writes the log (and may fsync), and
+# every call into a store that queries a database, runs in a worker thread so
+# the loop never blocks on disk.
+async def call(handler, *args, in_thread=False):
+    if in_thread or store is None or not store.in_memory:
+        return await asyncio.to_thread(handler, *args)
+    return handler(*args)
+
+async def offload(handler):
+    data = await request.get_json()
+    return respond(await asyncio.to_thread(handler, store, data))
+
+# Run an account route for the account of the request's session, in a worker
+# thread like offload() if in_thread
+async def authenticated(handler, in_thread=False):
+    data, error = api.authenticate(SESSIONS, session_token(), await request.get_json(silent=True))
+    if error is not None:
+        return respond(error)
+    return respond(await call(handler, store, data, in_thread=in_thread))
+
+@app.route('/login', methods=['POST'])
+async def login():
+    return respond(await call(api.login, store, SESSIONS, await request.get_json()))
+
+@app.route('/logout', methods=['POST'])
+async def logout():
+    return respond(api.logout(SESSIONS, session_token()))
+
+@app.route('/balance', methods=['POST'])
+async def get_balance():
+    return await authenticated(api.get_balance)
+
+@app.route('/withdraw', methods=['POST'])
+async def withdraw():
+    return await authenticated(api.withdraw, in_thread=True)
+
+@app.route('/deposit', methods=['POST'])
+async def deposit():
+    return await authenticated(api.deposit, in_thread=True)
+
+@app.route('/transfer', methods=['POST'])
+async def transfer():
+    return await authenticated(api.transfer, in_thread=True)
+
+# Details of the session's account; an account query parameter is ignored
+@app.route('/get_account_details', methods=['GET'])
+async def get_account_details():
+    data, error = api.authenticate(SESSIONS, session_token(), None)
+    if error is not None:
+        return respond(error)
+    body, status, etag = await call(api.account_details, store, data["account_number"], request.if_none_match)
+    response = app.response_class("", status=status) if body is None else jsonify(body)
+    response.status_code = status
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+# Bulk deposits and withdrawals on any accounts for upstream systems. Local callers only.
+@app.route('/batch', methods=['POST'])
+async def batch():
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        return respond(({"error": "Forbidden"}, 403))
+    return await offload(api.batch)
+
+@app.route('/transactions', methods=['POST'])
+async def transactions():
+    return await authenticated(api.transactions, in_thread=True)
+
+@app.route('/stats', methods=['POST'])
+async def stats():
+    return await authenticated(api.stats)
+
+@app.route('/analytics', methods=['POST'])
+async def analytics():
+    return await authenticated(api.analytics, in_thread=True)
+
+# Every request is timed and counted by route for /metrics
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    rule = request.url_rule
+    REGISTRY.observe_request(rule.rule if rule else "unmatched", response.status_code,
+                             time.perf_counter() - g.request_start)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+if __name__ == '__main__':
+    # No reloader: its parent process would open the table as well
+    app.run(debug=True, use_reloader=False)
@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from binary_store import csv_to_binary
+from sqlite_store import import_csv
+from storage import open_storage
+from stress_check import PIN, make_database
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+BACKENDS = ['csv', 'binary', 'sqlite']
+
+
+# Time a function over a list of argument tuples, in nanoseconds per call
+def time_calls(function, calls):
+    samples = np.empty(len(calls), dtype=np.int64)
+    for i, args in enumerate(calls):
+        start = time.perf_counter_ns()
+        function(*args)
+        samples[i] = time.perf_counter_ns() - start
+    return samples
+
+
+def summarize(name, backend, accounts, samples):
+    micros = samples / 1000
+    return {'name': name, 'backend': backend, 'accounts': accounts, 'calls': len(samples),
+            'mean_us': float(micros.mean()), 'p50_us': float(np.percentile(micros, 50)),
+            'p95_us': float(np.percentile(micros, 95)), 'min_us': float(micros.min())}
+
+
+# Write a synthetic database of the given size in the backend's format
+def prepare(workdir, accounts, backend):
+    csv_file = os.path.join(workdir, f"bench_{accounts}.csv")
+    if not os.path.exists(csv_file):
+        make_database(csv_file, accounts, 1_000_000)
+    if backend == 'csv':
+        return csv_file
+    path = os.path.join(workdir, f"bench_{accounts}.{'bin' if backend == 'binary' else 'db'}")
+    if not os.path.exists(path):
+        (csv_to_binary if backend == 'binary' else import_csv)(csv_file, path)
+    return path
+
+
+def storage_options(backend):
+    # Compaction is timed explicitly as "save", so keep the background flusher out of the way
+    return {} if backend == 'sqlite' else {'flush_interval': 3600}
+
+
+# Time the storage operations behind the CLI's core functions
+def bench_core(path, backend, accounts, operations, repeats, rng):
+    """
+    load_database -> open_storage, find_account -> get_account,
+    withdraw/deposit/transfer_money -> the storage mutations and
+    save_database -> flush after a round of mutations.
+    """
+    numbers = [1001 + rng.randrange(accounts) for _ in range(2 * operations)]
+    results = []
+    load = time_calls(lambda: open_storage(path, **storage_options(backend)).close(), [()] * repeats)
+    results.append(summarize('load_database', backend, accounts, load))
+
+    store = open_storage(path, **storage_options(backend))
+    results.append(summarize('find_account', backend, accounts,
+                             time_calls(store.get_account, [(n,) for n in numbers[:operations]])))
+    results.append(summarize('deposit', backend, accounts,
+                             time_calls(store.deposit, [(n, 1000) for n in numbers[:operations]])))
+    results.append(summarize('withdraw', backend, accounts,
+                             time_calls(store.withdraw, [(n, 1000) for n in numbers[:operations]])))
+    pairs = [(a, b, 100) for a, b in zip(numbers[:operations], numbers[operations:]) if a != b]
+    results.append(summarize('transfer_money', backend, accounts, time_calls(store.transfer, pairs)))
+
+    def save():
+        store.deposit(numbers[0], 100)
+        store.flush()
+    results.append(summarize('save_database', backend, accounts, time_calls(save, [()] * repeats)))
+    store.close()
+    return results
+
+
+# Time every atm_be.py route through the Flask test client
+def bench_routes(path, backend, accounts, operations, rng):
+    os.environ.setdefault("BANK_DATABASE", os.path.join(os.path.dirname(path), "missing.csv"))
+    import atm_be
+
+    atm_be.store = open_storage(path, **storage_options(backend))
+    client = atm_be.app.test_client()
+    numbers = [1001 + rng.randrange(accounts) for _ in range(operations)]
+    receivers = [1001 + (n - 1000) % accounts for n in numbers]
+    tokens = {n: client.post('/login', json={'account_number': n, 'pin': PIN}).json['token'] for n in set(numbers)}
+
+    def post(route, n, body=None):
+        return client.post(route, json=body or {}, headers={'Authorization': f"Bearer {tokens[n]}"})
+
+    routes = {
+        '/login': lambda n, r: client.post('/login', json={'account_number': n, 'pin': PIN}),
+        '/balance': lambda n, r: post('/balance', n),
+        '/deposit': lambda n, r: post('/deposit', n, {'amount': 10}),
+        '/withdraw': lambda n, r: post('/withdraw', n, {'amount': 10}),
+        '/transfer': lambda n, r: post('/transfer', n, {'receiver': r, 'amount': 1}),
+        '/batch': lambda n, r: client.post('/batch', json={'operations': [
+            {'op': 'deposit', 'account_number': n, 'amount': 1},
+            {'op': 'withdraw', 'account_number': r, 'amount': 1}]}),
+        '/transactions': lambda n, r: post('/transactions', n),
+        '/stats': lambda n, r: post('/stats', n),
+        '/analytics': lambda n, r: post('/analytics', n),
+        '/get_account_details': lambda n, r: client.get('/get_account_details',
+                                                        headers={'Authorization': f"Bearer {tokens[n]}"}),
+    }
+    results = [summarize('route ' + route, backend, accounts, time_calls(call, list(zip(numbers, receivers))))
+               for route, call in routes.items()]
+    atm_be.store.close()
+    return results
+
+
+# Compare results with a baseline run and list the ones that got slower
+def regressions(results, baseline, threshold):
+    """
+    A result regresses when its p50 is more than threshold (a fraction)
+    above the baseline entry with the same name, backend and size.
+    """
+    previous = {(r['name'], r['backend'], r['accounts']): r for r in baseline['results']}
+    slower = []
+    for result in results:
+        before = previous.get((result['name'], result['backend'], result['accounts']))
+        if before and result['p50_us'] > before['p50_us'] * (1 + threshold):
+            slower.append(f"{result['name']} [{result['backend']}, {result['accounts']} accounts]: "
+                          f"p50 {before['p50_us']:.1f}us -> {result['p50_us']:.1f}us")
+    return slower
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the core account operations and the API routes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                        help="account counts to generate (e.g. 1000 10000000)")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--operations", type=int, default=1000, help="calls per operation and route")
+    parser.add_argument("--repeats", type=int, default=3, help="calls for load_database and save_database")
+    parser.add_argument("--no-routes", action="store_true", help="skip the Flask route timings")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="keep the generated databases here instead of a temporary directory")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed p50 slowdown against the baseline, as a fraction")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        for accounts in args.sizes:
+            for backend in args.backends:
+                rng = random.Random(args.seed)
+                path = prepare(workdir, accounts, backend)
+                results += bench_core(path, backend, accounts, args.operations, args.repeats, rng)
+                if not args.no_routes:
+                    results += bench_routes(path, backend, accounts, args.operations, rng)
+
+    print(f"{'benchmark':<28}{'backend':<8}{'accounts':>10}{'p50 us':>12}{'p95 us':>12}{'mean us':>12}")
+    for r in results:
+        print(f"{r['name']:<28}{r['backend']:<8}{r['accounts']:>10}{r['p50_us']:>12.1f}"
+              f"{r['p95_us']:>12.1f}{r['mean_us']:>12.1f}")
+    report = {'commit': current_commit(), 'python': platform.python_version(), 'machine': platform.machine(),
+              'operations': args.operations, 'seed': args.seed, 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}.")
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            slower = regressions(results, json.load(f), args.threshold)
+        for line in slower:
+            print("Regression: " + line)
+        print("No regressions." if not slower else f"{len(slower)} regressions found.")
+        sys.exit(1 if slower else 0)
+
+
+if __name__ == "__main__":
+    main()
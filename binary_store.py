@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from money import cents_array, format_cents_array, parse_cents_array
+from pins import HASH_PREFIX, stored_digest
+
+# One fixed-width .npy file per column inside the store directory; balances are int64 cents
+COLUMNS = {
+    'account_number': np.dtype(np.int64),
+    'pin_hash': np.dtype((np.uint8, 32)),
+    'name': np.dtype('S64'),
+    'balance': np.dtype(np.int64),
+    'live': np.dtype(np.bool_),
+}
+
+
+# Encode a name into the 64-byte column, cut back to a whole UTF-8 character
+def encode_name(name):
+    return name.encode('utf-8')[:64].decode('utf-8', 'ignore').encode('utf-8')
+
+
+class BinaryAccounts:
+    """
+    Columnar binary account table opened with mmap.
+    Opening it only maps the column files, so startup does not depend on the
+    number of accounts, and writing an element of balance changes the file
+    in place. meta.json records how many rows are in use; the files are
+    allocated with spare capacity so new accounts rarely need a resize.
+    A store written with float dollar balances is converted to cents when opened.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding='utf-8') as f:
+            self.count = json.load(f)['count']
+        self._map()
+        if self._balance.dtype != COLUMNS['balance']:
+            self._upgrade_balances()
+
+    def _map(self):
+        for name in COLUMNS:
+            setattr(self, '_' + name, np.load(os.path.join(self.path, name + ".npy"), mmap_mode='r+'))
+
+    def _upgrade_balances(self):
+        file_name = os.path.join(self.path, "balance.npy")
+        column = np.lib.format.open_memmap(file_name + ".tmp", mode='w+', dtype=COLUMNS['balance'],
+                                           shape=self._balance.shape)
+        column[:] = cents_array(self._balance)
+        column.flush()
+        del column
+        os.replace(file_name + ".tmp", file_name)
+        self._map()
+
+    @property
+    def capacity(self):
+        return len(self._account_number)
+
+    # Views over the rows in use; writes go straight to the mapped files
+    @property
+    def account_numbers(self):
+        return self._account_number[:self.count]
+
+    @property
+    def pin_hashes(self):
+        return self._pin_hash[:self.count]
+
+    @property
+    def names(self):
+        return self._name[:self.count]
+
+    @property
+    def balances(self):
+        return self._balance[:self.count]
+
+    @property
+    def live(self):
+        return self._live[:self.count]
+
+    def row(self, row):
+        """
+        Returns (account_number, stored PIN, name) of one row, read from the mapped columns.
+        """
+        return (int(self._account_number[row]), HASH_PREFIX + self._pin_hash[row].tobytes().hex(),
+                self._name[row].decode('utf-8', 'ignore'))
+
+    def rows(self, rows):
+        """
+        Returns lists of the account numbers, stored PINs and names of many rows.
+        """
+        digests = self._pin_hash[rows].tobytes()
+        return (self._account_number[rows].tolist(),
+                [HASH_PREFIX + digests[i:i + 32].hex() for i in range(0, len(digests), 32)],
+                [name.decode('utf-8', 'ignore') for name in self._name[rows].tolist()])
+
+    @classmethod
+    def create(cls, path, account_numbers, pin_hashes, names, balances, capacity=None):
+        """
+        Writes a new store directory from column arrays and opens it.
+        """
+        count = len(account_numbers)
+        capacity = max(capacity or 0, count + 1024, 2 * count)
+        os.makedirs(path, exist_ok=True)
+        values = {'account_number': account_numbers, 'pin_hash': pin_hashes, 'name': names,
+                  'balance': balances, 'live': np.ones(count, dtype=bool)}
+        # Each column is written under a temporary name and swapped in, so
+        # existing mappings of the old files stay valid
+        for name, dtype in COLUMNS.items():
+            file_name = os.path.join(path, name + ".npy")
+            column = np.lib.format.open_memmap(file_name + ".tmp", mode='w+',
+                                               dtype=dtype.base, shape=(capacity,) + dtype.shape)
+            column[:count] = values[name]
+            column.flush()
+            del column
+            os.replace(file_name + ".tmp", file_name)
+        _write_meta(path, count)
+        return cls(path)
+
+    def append(self, account_number, pin_hash, name, balance):
+        """
+        Adds one account row (pin_hash being the 32-byte digest) and returns its row number.
+        """
+        if self.count == self.capacity:
+            self._grow()
+        row = self.count
+        self._account_number[row] = account_number
+        self._pin_hash[row] = np.frombuffer(pin_hash, dtype=np.uint8)
+        self._name[row] = encode_name(name)
+        self._balance[row] = balance
+        self._live[row] = True
+        self.count += 1
+        _write_meta(self.path, self.count)
+        return row
+
+    def _grow(self):
+        columns = {name: np.array(getattr(self, '_' + name)[:self.count]) for name in COLUMNS}
+        self.flush()
+        BinaryAccounts.create(self.path, columns['account_number'], columns['pin_hash'], columns['name'],
+                              columns['balance'], capacity=2 * self.count)
+        self._map()
+        self._live[:self.count] = columns['live']
+
+    def flush(self):
+        """
+        Forces the mapped pages of every column out to disk.
+        """
+        for name in COLUMNS:
+            getattr(self, '_' + name).flush()
+
+
+def _write_meta(path, count):
+    tmp_name = os.path.join(path, "meta.json.tmp")
+    with open(tmp_name, 'w', encoding='utf-8') as f:
+        json.dump({'count': count}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, os.path.join(path, "meta.json"))
+
+
+# Fold the mutations still in a table's write-ahead log into the table
+def compact(table):
+    from account_store import AccountStore
+
+    store = AccountStore.load(table)
+    if store is None:
+        raise FileNotFoundError(table)
+    store.close()
+
+
+# Convert the CSV account table into a binary store
+def csv_to_binary(csv_file, path):
+    """
+    Reads the CSV schema (Account Number, pin, Name, Balance, ...) and writes
+    the binary columns. Plain PINs are hashed on the way in; extra columns
+    are not carried over. Mutations still in the table's log are compacted
+    into it first, so the table must not be open elsewhere.
+    """
+    compact(csv_file)
+    df = pd.read_csv(csv_file, dtype={'pin': str, 'Balance': str})
+    numbers = df['Account Number'].to_numpy(dtype=np.int64)
+    pin_hashes = np.frombuffer(b"".join(
+        stored_digest(number, pin) for number, pin in zip(numbers.tolist(), df['pin'].fillna("").tolist())
+    ), dtype=np.uint8).reshape(len(df), 32)
+    names = df['Name'].fillna("").map(encode_name).to_numpy(dtype='S64')
+    balances = parse_cents_array(df['Balance'])
+    return BinaryAccounts.create(path, numbers, pin_hashes, names, balances)
+
+
+# Every row of a binary store (closed accounts included) in the CSV schema, Balance in cents
+def binary_frame(accounts):
+    digests = np.asarray(accounts.pin_hashes).tobytes()
+    return pd.DataFrame({
+        'Account Number': np.array(accounts.account_numbers),
+        'pin': [HASH_PREFIX + digests[i:i + 32].hex() for i in range(0, len(digests), 32)],
+        'Name': pd.Series(np.array(accounts.names), dtype=object).str.decode('utf-8', 'ignore'),
+        'Balance': np.array(accounts.balances),
+        'Withdrawal': None,
+        'Deposit': None,
+    })
+
+
+# The live accounts of a binary store in the CSV schema
+def binary_to_frame(accounts):
+    return binary_frame(accounts)[np.asarray(accounts.live)].reset_index(drop=True)
+
+
+def binary_to_csv(path, csv_file):
+    """
+    Writes the live accounts of a binary store as CSV. PINs are written in
+    their hashed form, which the PIN check accepts. The store's log is
+    compacted first, as in csv_to_binary.
+    """
+    compact(path)
+    df = binary_to_frame(BinaryAccounts(path))
+    df.assign(Balance=format_cents_array(df['Balance'])).to_csv(csv_file, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the account table between CSV and the binary mmap format.")
+    parser.add_argument("direction", choices=["to-binary", "to-csv"])
+    parser.add_argument("source")
+    parser.add_argument("target")
+    args = parser.parse_args()
+    if args.direction == "to-binary":
+        accounts = csv_to_binary(args.source, args.target)
+        print(f"Wrote {accounts.count} accounts to {args.target}.")
+    else:
+        binary_to_csv(args.source, args.target)
+        print(f"Wrote {args.target}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+import bisect
+import csv
+import io
+import os
+import re
+import threading
+from datetime import datetime
+
+from money import format_cents, format_cents_array, to_cents
+
+LEDGER_COLUMNS = ['Seq', 'Account Number', 'Type', 'Amount', 'Counterparty', 'Timestamp']
+
+# Matches one entry of the legacy 'Transactions' string column
+LEGACY_ENTRY = re.compile(
+    r"(Withdrawal|Deposit|Transfer to (?:Account )?(\d+)|Transfer from (?:Account )?(\d+)): ([+-])\$([\d.]+)"
+)
+
+
+# Derive the ledger file name from the account table file name
+def ledger_file_for(file_name):
+    return os.path.splitext(file_name)[0] + "_ledger.csv"
+
+
+# Derive the file the running aggregates of a ledger are saved to
+def aggregates_file_for(ledger_file):
+    return os.path.splitext(ledger_file)[0] + ".aggregates.npz"
+
+
+def timestamp_now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class Ledger:
+    """
+    Append-only transaction ledger stored in its own CSV file.
+    One typed row per entry: sequence number, account, type, signed amount,
+    counterparty and timestamp. Amounts are int64 cents in memory and
+    decimal dollars in the file. A per-account index of byte offsets lets one
+    account's history be read without scanning the whole file.
+    Every append also updates the RunningAggregates, which are saved next to
+    the ledger and caught up from the ledger's tail when it is reopened.
+    With aggregates=False they are neither loaded nor kept (so NumPy is not
+    imported); the next ledger opened with them catches up on the new entries.
+    Entries are not necessarily in Seq order (concurrent writers append as
+    they apply), so the file's entries with a sequence number above
+    recorded_after are counted by Seq in recorded, for replay to skip.
+    A 'close' entry ends an account's history: the entries before it are
+    no longer indexed or aggregated, so a reopened account number starts
+    with none.
+    """
+
+    def __init__(self, file_name, aggregates=True, recorded_after=None):
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self._offsets = {}
+        self.last_seq = 0
+        self.recorded_after = recorded_after
+        self.recorded = {}
+        if not os.path.exists(file_name) or os.path.getsize(file_name) == 0:
+            with open(file_name, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerow(LEDGER_COLUMNS)
+        self.aggregates_file = aggregates_file_for(file_name)
+        self.aggregates = None
+        if aggregates:
+            from aggregates import RunningAggregates
+            self.aggregates = RunningAggregates.load(self.aggregates_file)
+            if self.aggregates.covered > os.path.getsize(file_name):
+                self.aggregates = RunningAggregates()
+        self._build_index()
+        self._file = open(file_name, 'ab')
+
+    def _build_index(self):
+        with open(self.file_name, 'rb') as f:
+            offset = len(f.readline())
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                entry = self._parse(line)
+                if entry['Type'] == 'close':
+                    self._offsets.pop(entry['Account Number'], None)
+                else:
+                    self._offsets.setdefault(entry['Account Number'], []).append(offset)
+                self.last_seq = max(self.last_seq, entry['Seq'])
+                if self.recorded_after is not None and entry['Seq'] > self.recorded_after:
+                    self.recorded[entry['Seq']] = self.recorded.get(entry['Seq'], 0) + 1
+                if self.aggregates is not None and offset >= self.aggregates.covered:
+                    self.aggregates.fold(entry)
+                offset += len(line)
+        if self.aggregates is not None:
+            self.aggregates.covered = offset
+        if offset != os.path.getsize(self.file_name):
+            os.truncate(self.file_name, offset)
+
+    @staticmethod
+    def _parse(line):
+        seq, account, kind, amount, counterparty, timestamp = next(csv.reader([line.decode('utf-8')]))
+        return {'Seq': int(seq), 'Account Number': int(account), 'Type': kind,
+                'Amount': to_cents(amount), 'Counterparty': int(counterparty) if counterparty else None,
+                'Timestamp': timestamp}
+
+    def __len__(self):
+        return sum(len(offsets) for offsets in self._offsets.values())
+
+    def append(self, account_number, kind, amount, counterparty=None, seq=None, timestamp=None):
+        """
+        Appends one entry of amount cents. Outflows are recorded with a negative amount.
+        When seq is None the next ledger sequence number is allocated.
+        """
+        return self._write([(account_number, kind, amount, counterparty)], seq, timestamp)
+
+    def append_transfer(self, sender, receiver, amount, seq=None, timestamp=None):
+        """
+        Appends both sides of a transfer of amount cents with a single write,
+        so a crash never leaves only one of them in the file.
+        """
+        return self._write([(sender, 'transfer_out', -amount, receiver),
+                            (receiver, 'transfer_in', amount, sender)], seq, timestamp)
+
+    def _write(self, entries, seq, timestamp):
+        if timestamp is None:
+            timestamp = timestamp_now()
+        with self._lock:
+            if seq is None:
+                seq = self.last_seq + 1
+            self.last_seq = max(self.last_seq, seq)
+            offset = self._file.tell()
+            lines = []
+            for account_number, kind, amount, counterparty in entries:
+                buffer = io.StringIO()
+                csv.writer(buffer, lineterminator="\n").writerow(
+                    [seq, account_number, kind, format_cents(amount),
+                     "" if counterparty is None else counterparty, timestamp])
+                lines.append(buffer.getvalue().encode('utf-8'))
+            self._file.write(b"".join(lines))
+            self._file.flush()
+            # Readers take no lock, so an offset is published only once its row is in the file
+            for (account_number, kind, *_), line in zip(entries, lines):
+                if kind == 'close':
+                    self._offsets.pop(account_number, None)
+                else:
+                    self._offsets.setdefault(account_number, []).append(offset)
+                offset += len(line)
+            if self.aggregates is not None:
+                for account_number, kind, amount, _ in entries:
+                    if kind == 'close':
+                        self.aggregates.forget(account_number)
+                    else:
+                        self.aggregates.update(account_number, int(amount), timestamp)
+                self.aggregates.covered = self._file.tell()
+            return seq
+
+    def append_frame(self, frame):
+        """
+        Appends many entries at once from a DataFrame with the ledger columns
+        (Amount in cents). The rows are serialized in one pass and written
+        with a single write.
+        """
+        import numpy as np
+
+        if frame.empty:
+            return
+        data = frame[LEDGER_COLUMNS].assign(Amount=format_cents_array(frame['Amount'])).to_csv(
+            header=False, index=False, lineterminator="\n").encode('utf-8')
+        line_ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n")) + 1
+        with self._lock:
+            base = self._file.tell()
+            self._file.write(data)
+            self._file.flush()
+            starts = np.concatenate(([0], line_ends[:-1])) + base
+            for account_number, offset in zip(frame['Account Number'].tolist(), starts.tolist()):
+                self._offsets.setdefault(account_number, []).append(offset)
+            self.last_seq = max(self.last_seq, int(frame['Seq'].max()))
+            if self.aggregates is not None:
+                self.aggregates.update_frame(frame)
+                self.aggregates.covered = self._file.tell()
+
+    def history(self, account_number):
+        """
+        Returns the account's entries in the order they were recorded.
+        """
+        offsets = self._offsets.get(account_number, [])
+        entries = []
+        with open(self.file_name, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                entries.append(self._parse(f.readline()))
+        return entries
+
+    def page(self, account_number, cursor=0, limit=50, start=None, end=None,
+             min_amount=None, max_amount=None):
+        """
+        Returns one page of the account's history and the cursor of the next page.
+        The cursor is a position in the account's offset index, so only the rows
+        on the page are read from disk. start/end bound the timestamp (ISO strings;
+        a date-only end includes that whole day) and min_amount/max_amount bound the absolute amount
+        in cents.
+        next_cursor is None once the history is exhausted.
+        """
+        offsets = self._offsets.get(account_number, [])
+        entries = []
+        with open(self.file_name, 'rb') as f:
+            def read(position):
+                f.seek(offsets[position])
+                return self._parse(f.readline())
+
+            # Entries are appended in time order, so the start date can be bisected
+            if start is not None:
+                cursor = bisect.bisect_left(range(len(offsets)), start, lo=cursor,
+                                            key=lambda position: read(position)['Timestamp'])
+            while cursor < len(offsets) and len(entries) < limit:
+                entry = read(cursor)
+                if end is not None and entry['Timestamp'][:len(end)] > end:
+                    cursor = len(offsets)
+                    break
+                cursor += 1
+                if min_amount is not None and abs(entry['Amount']) < min_amount:
+                    continue
+                if max_amount is not None and abs(entry['Amount']) > max_amount:
+                    continue
+                entries.append(entry)
+        return entries, cursor if cursor < len(offsets) else None
+
+    def stats(self, account_number):
+        """
+        Returns the account's running aggregates in O(1), or None if it has no
+        entries (or the aggregates are not kept).
+        """
+        if self.aggregates is None:
+            return None
+        return self.aggregates.get(account_number)
+
+    def save_aggregates(self):
+        """
+        Makes the ledger durable and saves the aggregates covering it.
+        """
+        with self._lock:
+            os.fsync(self._file.fileno())
+            if self.aggregates is not None:
+                self.aggregates.save(self.aggregates_file)
+
+    def close(self):
+        self.save_aggregates()
+        with self._lock:
+            self._file.close()
+
+
+# Drop the entries that closed accounts left behind from a whole-ledger frame
+def drop_closed(frame):
+    """
+    Returns the rows of a ledger frame (in file order, with the Type column)
+    that come after their account's last 'close' entry, as Ledger indexes them.
+    """
+    import pandas as pd
+
+    closes = frame['Type'] == 'close'
+    if not closes.any():
+        return frame
+    position = pd.RangeIndex(len(frame))
+    last_close = pd.Series(position[closes.to_numpy()]).groupby(frame['Account Number'][closes].to_numpy()).max()
+    cutoff = frame['Account Number'].map(last_close).fillna(-1).to_numpy()
+    return frame[position.to_numpy() > cutoff]
+
+
+# Format a ledger entry the way the old 'Transactions' column did
+def format_entry(entry):
+    amount = entry['Amount']
+    sign = "-" if amount < 0 else "+"
+    if entry['Type'] == 'transfer_out':
+        label = f"Transfer to Account {entry['Counterparty']}"
+    elif entry['Type'] == 'transfer_in':
+        label = f"Transfer from Account {entry['Counterparty']}"
+    else:
+        label = entry['Type'].capitalize()
+    return f"{label}: {sign}${format_cents(abs(amount))}"
+
+
+# Move the legacy 'Transactions' string column into the ledger
+def migrate_transactions(df, ledger):
+    """
+    Parses the old per-row 'Transactions' strings into typed ledger entries
+    (only if the ledger is still empty) and drops the column from the table.
+    Migrated entries carry sequence number 0 and no timestamp.
+    """
+    if 'Transactions' not in df.columns:
+        return df
+    if len(ledger) == 0:
+        for account_number, transactions in zip(df['Account Number'], df['Transactions'].fillna("")):
+            for match in LEGACY_ENTRY.finditer(transactions):
+                label, to_account, from_account, sign, amount = match.groups()
+                amount = to_cents(amount) if sign == "+" else -to_cents(amount)
+                if to_account:
+                    kind, counterparty = 'transfer_out', int(to_account)
+                elif from_account:
+                    kind, counterparty = 'transfer_in', int(from_account)
+                else:
+                    kind, counterparty = label.lower(), None
+                ledger.append(int(account_number), kind, amount, counterparty, seq=0, timestamp="")
+    return df.drop(columns=['Transactions'])
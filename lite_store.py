@@ -0,0 +1,326 @@
+import atexit
+import csv
+import operator
+import os
+import threading
+
+from ledger import Ledger, ledger_file_for, timestamp_now
+from metrics import REGISTRY
+from money import check_cents, format_cents, to_cents
+from storage import AccountNotFound, InsufficientFunds, Storage, lock_table, validate_batch
+from wal import WriteAheadLog, read_checkpoint, upgrade_record, write_checkpoint
+
+# Columns every account table has, in this order
+BASE_COLUMNS = ['Account Number', 'pin', 'Name', 'Balance']
+
+
+# Parse a Balance cell the way read_accounts does: anything that is not a number counts as 0
+def _balance_cents(value):
+    try:
+        return to_cents(value) if value.strip() else 0
+    except ValueError:
+        return 0
+
+
+# Whether the log holds cross-shard transfer records (see shard_router.py)
+def _logs_transfers(file_name):
+    try:
+        with open(file_name + ".wal", encoding='utf-8') as f:
+            return any('"txid"' in line for line in f)
+    except FileNotFoundError:
+        return False
+
+
+# Summarize ledger entries into the fields of the running aggregates
+def entry_stats(entries):
+    """
+    Pure-Python equivalent of RunningAggregates.get() over the given entries.
+    """
+    if not entries:
+        return {}
+    amounts = [entry['Amount'] for entry in entries]
+    last = max((entry['Timestamp'] for entry in entries if entry['Timestamp']), default=None)
+    last_day = [entry['Amount'] for entry in entries if last and entry['Timestamp'][:10] == last[:10]]
+    return {'count': len(amounts), 'total_in': sum(a for a in amounts if a > 0),
+            'total_out': sum(-a for a in amounts if a < 0), 'min': min(amounts), 'max': max(amounts),
+            'last_activity': last, 'day_in': sum(a for a in last_day if a > 0),
+            'day_out': sum(-a for a in last_day if a < 0)}
+
+
+class LiteStore(Storage):
+    """
+    Storage for a CSV account table that needs neither pandas nor NumPy, for
+    short interactive sessions (atm.py, atm1.py) where importing them would
+    cost more than the session itself.
+    Rows are kept as their raw CSV cells with balances in cents alongside.
+    It shares the write-ahead log, checkpoint and ledger formats with
+    AccountStore, so either can open what the other wrote. Every mutation
+    is logged durably before it is applied; the table file is rewritten on
+    flush() and close(). The running aggregates are not kept; AccountStore
+    catches them up from the ledger the next time it opens the table.
+    Like AccountStore it holds the table's lock while it is open.
+    """
+
+    def __init__(self, file_name, header, rows, fsync=True, lock=None):
+        self._table_lock = lock or lock_table(file_name)
+        self.file_name = file_name
+        self.header = header
+        self._columns = {name: header.index(name) for name in BASE_COLUMNS}
+        self.rows = {}
+        self.balances = {}
+        for row in rows:
+            account_number = int(row[self._columns['Account Number']])
+            self.rows[account_number] = row
+            self.balances[account_number] = _balance_cents(row[self._columns['Balance']])
+        self.versions = dict.fromkeys(self.rows, 0)
+        self.epoch = os.urandom(4).hex()
+        self.checkpoint_seq = read_checkpoint(file_name)
+        self.ledger = Ledger(ledger_file_for(file_name), aggregates=False, recorded_after=self.checkpoint_seq)
+        self._lock = threading.Lock()
+        self.wal = WriteAheadLog(file_name + ".wal", fsync=fsync)
+        for record in self.wal.replay(self.checkpoint_seq):
+            self._apply(upgrade_record(record))
+        self.wal.last_seq = max(self.wal.last_seq, self.checkpoint_seq, self.ledger.last_seq)
+        self.ledger.recorded.clear()
+        self._closed = False
+        atexit.register(self.close)
+
+    @classmethod
+    def load(cls, file_name, fsync=True, **options):
+        """
+        Reads the table once. Returns None if the file does not exist.
+        A table that still has the legacy Transactions column, or a shard
+        with cross-shard transfers in its log, is opened with AccountStore
+        instead. Raises TableInUse if another store has the table open.
+        """
+        if not os.path.exists(file_name):
+            return None
+        lock = lock_table(file_name)
+        try:
+            with open(file_name, newline='', encoding='utf-8') as f:
+                reader = csv.reader(f)
+                header = next(reader, [])
+                rows = [row for row in reader if row]
+            if 'Transactions' in header or _logs_transfers(file_name):
+                lock.close()
+                from account_store import AccountStore
+                return AccountStore.load(file_name, fsync=fsync, **options)
+            return cls(file_name, header, rows, fsync, lock=lock)
+        except BaseException:
+            lock.close()
+            raise
+
+    def _require(self, account_number):
+        if account_number not in self.rows:
+            raise AccountNotFound(account_number)
+        return self.balances[account_number]
+
+    def _log(self, records):
+        """
+        Makes records durable with one log write, then applies them in order.
+        Must be called with the lock held.
+        """
+        with REGISTRY.phase('mutation'):
+            self.wal.append_many(records)
+            for record in records:
+                self._apply(record)
+
+    def _apply(self, record):
+        """
+        Applies one logged mutation; same rules as AccountStore._apply.
+        """
+        account_number = record['account']
+        op = record['op']
+        if op == 'open':
+            if account_number not in self.rows:
+                row = [""] * len(self.header)
+                for name, value in (('Account Number', account_number), ('pin', record['pin']),
+                                    ('Name', record['name'])):
+                    row[self._columns[name]] = str(value)
+                self.rows[account_number] = row
+                self.balances[account_number] = record['balance']
+                self.versions[account_number] = 0
+        elif op == 'close':
+            if self.rows.pop(account_number, None) is not None:
+                del self.balances[account_number], self.versions[account_number]
+        elif op == 'settle':
+            for number, balance in zip(record['accounts'], record['balances']):
+                self.balances[number] = balance
+                self.versions[number] += 1
+        elif op == 'transfer':
+            self.balances[account_number] = record['balance']
+            self.balances[record['receiver']] = record['receiver_balance']
+            self.versions[account_number] += 1
+            self.versions[record['receiver']] += 1
+        else:
+            self.balances[account_number] = record['balance']
+            self.versions[account_number] += 1
+        if op != 'settle' and record['seq'] in self.ledger.recorded:
+            return
+        if op == 'transfer':
+            self.ledger.append_transfer(account_number, record['receiver'], record['amount'],
+                                        seq=record['seq'], timestamp=record.get('ts'))
+        elif op == 'settle':
+            # Only reached when replaying a settlement logged by AccountStore
+            from settlement import ledger_frames
+            for frame in ledger_frames(record['source'], record['accounts'], record['seq'], record['ts'],
+                                       skip=self.ledger.recorded.get(record['seq'], 0)):
+                self.ledger.append_frame(frame)
+        elif op == 'withdraw':
+            self.ledger.append(account_number, 'withdrawal', -record['amount'],
+                               seq=record['seq'], timestamp=record.get('ts'))
+        elif op == 'deposit' or (op == 'open' and record['balance'] > 0):
+            self.ledger.append(account_number, 'deposit', record['balance'] if op == 'open' else record['amount'],
+                               seq=record['seq'], timestamp=record.get('ts'))
+        elif op == 'close':
+            self.ledger.append(account_number, 'close', 0, seq=record['seq'], timestamp=record.get('ts'))
+
+    def exists(self, account_number):
+        return account_number in self.rows
+
+    def get_account(self, account_number):
+        balance = self._require(account_number)
+        row = self.rows[account_number]
+        return {'account_number': account_number, 'pin': row[self._columns['pin']],
+                'name': row[self._columns['Name']], 'balance': balance}
+
+    def accounts(self):
+        with self._lock:
+            numbers = list(self.rows)
+        for account_number in numbers:
+            try:
+                yield self.get_account(account_number)
+            except AccountNotFound:
+                continue
+
+    def get_balance(self, account_number):
+        return self._require(account_number)
+
+    def etag(self, account_number):
+        self._require(account_number)
+        return f"{self.epoch}-{self.versions[account_number]}"
+
+    def get_details(self, account_number):
+        with self._lock:
+            account = self.get_account(account_number)
+            version = self.versions[account_number]
+        return f"{self.epoch}-{version}", {'account_number': account_number, 'name': account['name'],
+                                           'balance': account['balance']}
+
+    def add_account(self, account_number, pin, name, balance=0):
+        balance = operator.index(balance)
+        with self._lock:
+            if account_number in self.rows:
+                raise ValueError(f"Account {account_number} already exists")
+            self._log([{'account': account_number, 'op': 'open', 'amount': 0, 'balance': balance,
+                        'pin': pin, 'name': name, 'ts': timestamp_now()}])
+
+    def remove_account(self, account_number):
+        with self._lock:
+            if self._require(account_number) != 0:
+                raise ValueError(f"Account {account_number} has a nonzero balance")
+            self._log([{'account': account_number, 'op': 'close', 'amount': 0, 'balance': 0,
+                        'ts': timestamp_now()}])
+
+    def withdraw(self, account_number, amount):
+        amount = operator.index(amount)
+        with self._lock:
+            balance = self._require(account_number)
+            if balance < amount:
+                raise InsufficientFunds(account_number)
+            self._log([{'account': account_number, 'op': 'withdraw', 'amount': amount,
+                        'balance': balance - amount, 'ts': timestamp_now()}])
+            return balance - amount
+
+    def deposit(self, account_number, amount):
+        amount = operator.index(amount)
+        with self._lock:
+            balance = check_cents(self._require(account_number) + amount)
+            self._log([{'account': account_number, 'op': 'deposit', 'amount': amount,
+                        'balance': balance, 'ts': timestamp_now()}])
+            return balance
+
+    def transfer(self, sender, receiver, amount):
+        if sender == receiver:
+            raise ValueError("Cannot transfer to the same account")
+        amount = operator.index(amount)
+        with self._lock:
+            sender_balance = self._require(sender)
+            receiver_balance = self._require(receiver)
+            if sender_balance < amount:
+                raise InsufficientFunds(sender)
+            self._log([{'account': sender, 'op': 'transfer', 'amount': amount, 'balance': sender_balance - amount,
+                        'receiver': receiver, 'receiver_balance': check_cents(receiver_balance + amount),
+                        'ts': timestamp_now()}])
+            return sender_balance - amount
+
+    def apply_batch(self, operations):
+        """
+        Same contract as AccountStore.apply_batch.
+        """
+        with self._lock:
+            validate_batch(operations, self.rows)
+            balances = {n: self.balances[n] for _, n, _ in operations}
+            timestamp = timestamp_now()
+            results, records = [], []
+            for op, account_number, amount in operations:
+                balance = balances[account_number]
+                if op == 'withdraw' and balance < amount:
+                    results.append({'error': "Insufficient funds"})
+                    continue
+                balance = balance - amount if op == 'withdraw' else check_cents(balance + amount)
+                balances[account_number] = balance
+                records.append({'account': account_number, 'op': op, 'amount': int(amount),
+                                'balance': balance, 'ts': timestamp})
+                results.append({'balance': balance})
+            if records:
+                self._log(records)
+        return results
+
+    def get_history(self, account_number):
+        self._require(account_number)
+        return self.ledger.history(account_number)
+
+    def get_statement(self, account_number, cursor=0, limit=50, **filters):
+        self._require(account_number)
+        return self.ledger.page(account_number, cursor, limit, **filters)
+
+    def get_stats(self, account_number):
+        """
+        Computed from the account's ledger entries, as the aggregates are not kept.
+        """
+        return entry_stats(self.get_history(account_number))
+
+    def flush(self):
+        """
+        Rewrites the table file with the current balances, then checkpoints
+        and truncates the log.
+        """
+        with self._lock:
+            if self.wal.last_seq == self.checkpoint_seq:
+                return
+            with REGISTRY.phase('save'):
+                seq = self.wal.last_seq
+                balance_column = self._columns['Balance']
+                tmp_name = self.file_name + ".tmp"
+                with open(tmp_name, 'w', newline='', encoding='utf-8') as f:
+                    writer = csv.writer(f, lineterminator="\n")
+                    writer.writerow(self.header)
+                    for account_number, row in self.rows.items():
+                        row[balance_column] = format_cents(self.balances[account_number])
+                        writer.writerow(row)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_name, self.file_name)
+                self.ledger.save_aggregates()
+                write_checkpoint(self.file_name, seq)
+                self.checkpoint_seq = seq
+                self.wal.truncate(seq)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.flush()
+            self.wal.close()
+            self.ledger.close()
+            self._table_lock.close()
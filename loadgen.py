@@ -0,0 +1,410 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from ledger import aggregates_file_for, ledger_file_for
+from sharding import HERE, WORKER, wait_ready
+from storage import SQLITE_EXTENSIONS, TableInUse, lock_table
+
+# The load generator only ever talks to a server on this machine
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+ROUTES = ('/login', '/balance', '/withdraw', '/deposit', '/transfer', '/transactions', '/stats', '/analytics',
+          '/get_account_details', '/logout')
+# Relative weights of the operations of a synthetic session, between its login and logout
+DEFAULT_MIX = {'/balance': 40, '/withdraw': 15, '/deposit': 15, '/transactions': 30}
+WITHDRAWALS = (20, 40, 60, 100, 200)
+
+
+class Client:
+    """
+    One worker's keep-alive connection to the server and the session
+    tokens of the accounts it logged in.
+    """
+
+    def __init__(self, url, timeout=30):
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self.connection = None
+        self.tokens = {}
+
+    def request(self, method, path, body=None, token=None):
+        """
+        Returns (status, decoded JSON body or None). The status is 0 when
+        the server could not be reached; the connection is then reopened
+        on the next request.
+        """
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.connection.request(method, path, body=None if body is None else json.dumps(body), headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            if self.connection is not None:
+                self.connection.close()
+            self.connection = None
+            return 0, None
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+
+
+class Pacer:
+    """
+    Spaces requests 1/rate seconds apart across all workers (open loop).
+    Latency is measured from a request's scheduled send time, so time spent
+    queued behind a slow server is counted instead of hidden. Without a rate
+    every worker sends its next request as soon as the previous one is answered.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = None
+
+    def wait(self):
+        """
+        Blocks until the next send slot and returns its time (perf_counter seconds).
+        """
+        if not self.rate:
+            return time.perf_counter()
+        with self._lock:
+            now = time.perf_counter()
+            slot = self._next = now if self._next is None else self._next + 1 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+        return slot
+
+
+class Recorder:
+    """
+    Latency and status of every request, by route.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, route, seconds, status):
+        samples = self.samples.get(route)
+        if samples is None:
+            with self._lock:
+                samples = self.samples.setdefault(route, [])
+        samples.append((seconds, status))
+
+
+# Send one request at the pacer's next slot and record it
+def timed(client, pacer, recorder, route, method, path, body=None, token=None):
+    start = pacer.wait()
+    status, data = client.request(method, path, body, token)
+    recorder.record(route, time.perf_counter() - start, status)
+    return status, data
+
+
+def login(client, pacer, recorder, account, pin):
+    status, data = timed(client, pacer, recorder, '/login', 'POST', '/login', {'account_number': account, 'pin': pin})
+    token = data.get('token') if status == 200 and isinstance(data, dict) else None
+    if token:
+        client.tokens[account] = token
+    else:
+        client.tokens.pop(account, None)
+    return token
+
+
+# Replay one trace step: {"route", "account", "amount", "receiver", "pin"}, all but route optional
+def run_step(client, pacer, recorder, step, pin):
+    """
+    An account without a session is logged in first, and once more if its
+    session has expired.
+    """
+    route = step['route']
+    account = step.get('account')
+    pin = str(step.get('pin', pin))
+    if route == '/login':
+        login(client, pacer, recorder, account, pin)
+        return
+    if route == '/get_account_details':
+        method, path, body = 'GET', f"{route}?account={account}", None
+    else:
+        method, path, body = 'POST', route, {key: step[key] for key in ('amount', 'receiver') if key in step}
+    token = client.tokens.get(account)
+    resumed = token is not None
+    if not resumed:
+        token = login(client, pacer, recorder, account, pin)
+    status, _ = timed(client, pacer, recorder, route, method, path, body, token)
+    if status == 401 and resumed and route != '/logout':
+        token = login(client, pacer, recorder, account, pin)
+        timed(client, pacer, recorder, route, method, path, body, token)
+    if route == '/logout':
+        client.tokens.pop(account, None)
+
+
+# Read a trace of JSON lines, skipping blank lines
+def read_trace(file_name):
+    steps = []
+    with open(file_name, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            step = json.loads(line)
+            if step.get('route') not in ROUTES:
+                raise ValueError(f"{file_name}:{number}: unknown route {step.get('route')!r}")
+            steps.append(step)
+    return steps
+
+
+# Parse "route=weight,..." (leading slashes optional) into a session mix
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        route, _, weight = part.partition("=")
+        route = "/" + route.strip().lstrip("/")
+        if route not in ROUTES or route in ('/login', '/logout'):
+            raise argparse.ArgumentTypeError(f"cannot mix in {route}")
+        try:
+            mix[route] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid weight for {route}: {weight!r}") from None
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one positive weight")
+    return mix
+
+
+# Generate the steps of one synthetic session: login, a few operations, logout
+def synth_session(rng, accounts, mix, length):
+    account = rng.choice(accounts)
+    steps = [{'route': '/login', 'account': account}]
+    for route in rng.choices(list(mix), weights=list(mix.values()), k=rng.randint(*length)):
+        step = {'route': route, 'account': account}
+        if route == '/withdraw':
+            step['amount'] = rng.choice(WITHDRAWALS)
+        elif route == '/deposit':
+            step['amount'] = round(rng.uniform(20, 500), 2)
+        elif route == '/transfer':
+            step['receiver'] = rng.choice(accounts)
+            step['amount'] = round(rng.uniform(1, 50), 2)
+        steps.append(step)
+    steps.append({'route': '/logout', 'account': account})
+    return steps
+
+
+def replay(url, steps, concurrency, pacer, recorder, pin):
+    """
+    Each account's steps go to the same worker in trace order, so a
+    session's requests keep their order while different accounts run
+    concurrently.
+    """
+    queues = [[] for _ in range(concurrency)]
+    for step in steps:
+        queues[hash(step.get('account')) % concurrency].append(step)
+
+    def work(queue):
+        client = Client(url)
+        for step in queue:
+            run_step(client, pacer, recorder, step, pin)
+
+    run_workers([lambda queue=queue: work(queue) for queue in queues])
+
+
+def synthesize(url, accounts, mix, length, concurrency, pacer, recorder, pin, duration, seed, trace=None):
+    """
+    Every worker runs sessions back to back until duration seconds have
+    passed. The steps sent are appended to trace (a list) if one is given.
+    """
+    deadline = time.perf_counter() + duration
+    lock = threading.Lock()
+
+    def work(worker):
+        client = Client(url)
+        rng = random.Random(seed * 1_000_003 + worker)
+        while time.perf_counter() < deadline:
+            for step in synth_session(rng, accounts, mix, length):
+                if trace is not None:
+                    with lock:
+                        trace.append(step)
+                run_step(client, pacer, recorder, step, pin)
+
+    run_workers([lambda worker=worker: work(worker) for worker in range(concurrency)])
+
+
+def run_workers(targets):
+    threads = [threading.Thread(target=target, daemon=True) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+# Throughput, error rate and latency percentiles per route, and over all routes
+def summarize(recorder, elapsed):
+    """
+    A request is an error when it was answered with status 400 or above
+    (as in /metrics) or not answered at all.
+    """
+    results = []
+    groups = sorted(recorder.samples.items()) + [('all', [s for samples in recorder.samples.values() for s in samples])]
+    for route, samples in groups:
+        if not samples:
+            continue
+        seconds = np.array([sample[0] for sample in samples]) * 1000
+        errors = sum(1 for _, status in samples if status == 0 or status >= 400)
+        results.append({'route': route, 'requests': len(samples), 'throughput': len(samples) / elapsed,
+                        'errors': errors, 'error_rate': errors / len(samples),
+                        'p50_ms': float(np.percentile(seconds, 50)), 'p95_ms': float(np.percentile(seconds, 95)),
+                        'p99_ms': float(np.percentile(seconds, 99)), 'max_ms': float(seconds.max())})
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Copy a table with its log, checkpoint and ledger into directory; returns the copy's name
+def copy_table(database, directory):
+    """
+    A CSV file or binary store is copied under its lock, so no writer
+    changes it meanwhile (TableInUse if a server has it open). A SQLite
+    database is copied with its -wal and -shm files.
+    """
+    database = os.path.normpath(database)
+    if not os.path.exists(database):
+        raise FileNotFoundError(f"{database} not found")
+    target = os.path.join(directory, os.path.basename(database))
+    sqlite = os.path.splitext(database)[1].lower() in SQLITE_EXTENSIONS
+    lock = None if sqlite else lock_table(database)
+    try:
+        if os.path.isdir(database):
+            shutil.copytree(database, target)
+        else:
+            shutil.copyfile(database, target)
+        ledger = ledger_file_for(database)
+        companions = [(database + suffix, target + suffix) for suffix in
+                      (("-wal", "-shm") if sqlite else (".wal", ".checkpoint"))]
+        companions += [(ledger, ledger_file_for(target)),
+                       (aggregates_file_for(ledger), aggregates_file_for(ledger_file_for(target)))]
+        for source, copy in companions:
+            if os.path.exists(source):
+                shutil.copyfile(source, copy)
+    finally:
+        if lock is not None:
+            lock.close()
+    return target
+
+
+# Start atm_be.py on a table in a child process and return (process, url)
+def start_server(database):
+    port = free_port()
+    env = dict(os.environ, BANK_DATABASE=os.path.abspath(database))
+    process = subprocess.Popen([sys.executable, "-c", WORKER, "127.0.0.1", str(port)], cwd=HERE, env=env)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(url)
+    except RuntimeError:
+        process.terminate()
+        raise
+    return process, url
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--url", default="http://127.0.0.1:5000", help="server to load (local addresses only)")
+    common.add_argument("--database", help="start atm_be.py on a copy of this table instead of using --url")
+    common.add_argument("--in-place", action="store_true",
+                        help="run on the --database table itself, changing its balances, instead of a copy")
+    common.add_argument("--concurrency", type=int, default=8, help="worker threads, each with one connection")
+    common.add_argument("--rate", type=float, help="requests per second over all workers (default: as fast as possible)")
+    common.add_argument("--pin", default="1234", help="PIN for logins the trace does not give one for")
+    common.add_argument("--output", help="write the report as JSON to this file")
+    parser = argparse.ArgumentParser(description="Replay request traces or generate session traffic against a "
+                                                 "local ATM server and report per-route latency.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("replay", parents=[common], help="replay a trace of JSON lines (route, account, amount)")
+    run.add_argument("trace")
+    synth = commands.add_parser("synth", parents=[common],
+                                help="run synthetic sessions: login, a mix of operations, logout")
+    synth.add_argument("--accounts", default="1001-1100", help="account numbers to use, as FIRST-LAST")
+    synth.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                       help="weights of the session operations, e.g. balance=40,withdraw=15,deposit=15,transactions=30")
+    synth.add_argument("--session-length", type=int, nargs=2, default=(2, 6), metavar=("MIN", "MAX"),
+                       help="operations per session")
+    synth.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    synth.add_argument("--seed", type=int, default=0)
+    synth.add_argument("--record", help="write the generated steps to this trace file for later replay")
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+    if urllib.parse.urlsplit(args.url).hostname not in LOCAL_HOSTS:
+        parser.error("--url must point at a server on this machine")
+    if args.command == "replay":
+        try:
+            steps = read_trace(args.trace)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    else:
+        first, _, last = args.accounts.partition("-")
+        accounts = list(range(int(first), int(last or first) + 1))
+        trace = [] if args.record else None
+
+    workdir = tempfile.TemporaryDirectory(prefix="loadgen-") if args.database and not args.in_place else None
+    try:
+        database = copy_table(args.database, workdir.name) if workdir else args.database
+    except (OSError, TableInUse) as e:
+        workdir.cleanup()
+        parser.error(str(e))
+    process, url = start_server(database) if database else (None, args.url)
+    pacer, recorder = Pacer(args.rate), Recorder()
+    try:
+        start = time.perf_counter()
+        if args.command == "replay":
+            replay(url, steps, args.concurrency, pacer, recorder, args.pin)
+        else:
+            synthesize(url, accounts, args.mix, args.session_length, args.concurrency, pacer, recorder, args.pin,
+                       args.duration, args.seed, trace)
+        elapsed = time.perf_counter() - start
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if workdir is not None:
+            workdir.cleanup()
+
+    results = summarize(recorder, elapsed)
+    print(f"{'route':<22}{'requests':>10}{'req/s':>10}{'errors':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(f"{r['route']:<22}{r['requests']:>10}{r['throughput']:>10.1f}{100 * r['error_rate']:>8.1f}%"
+              f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+    if args.command == "synth" and args.record:
+        with open(args.record, 'w', encoding='utf-8') as f:
+            for step in trace:
+                f.write(json.dumps(step) + "\n")
+        print(f"{len(trace)} steps written to {args.record}.")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'command': args.command, 'concurrency': args.concurrency, 'rate': args.rate,
+                       'seconds': elapsed, 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
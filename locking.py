@@ -0,0 +1,45 @@
+import threading
+from contextlib import contextmanager
+
+
+class StripedLock:
+    """
+    A fixed pool of locks shared out among accounts by hashing the account number.
+    Operations on accounts in different stripes run in parallel; operations on
+    the same account are serialized. Several stripes are always acquired in
+    ascending stripe order, so multi-account operations cannot deadlock.
+    """
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def stripe(self, key):
+        return hash(key) % len(self._locks)
+
+    @contextmanager
+    def hold(self, *keys):
+        """
+        Holds the stripes covering every given key for the duration of the block.
+        """
+        stripes = sorted({self.stripe(key) for key in keys})
+        for stripe in stripes:
+            self._locks[stripe].acquire()
+        try:
+            yield
+        finally:
+            for stripe in reversed(stripes):
+                self._locks[stripe].release()
+
+    @contextmanager
+    def hold_all(self):
+        """
+        Holds every stripe, excluding all account operations (used for
+        structural changes and consistent snapshots).
+        """
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
@@ -0,0 +1,142 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+STORAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0, 30.0)
+# Bucket upper bounds for the number of log records made durable by one fsync
+GROUP_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. observe() is one bisect over the bucket bounds
+    and a few additions under a lock.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def render(self, name, labels):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {total}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """
+    Process-wide request and storage metrics rendered in the Prometheus
+    text exposition format.
+    Per route: request count, error count (status >= 400) and a latency
+    histogram. Per storage phase (load, mutation, sync, save): a duration
+    histogram. Per write-ahead log: the group commit settings and a
+    histogram of records per group.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.errors = {}
+        self.latency = {}
+        self.phases = {}
+        self.commit_settings = {}
+        self.commit_groups = {}
+
+    def observe_request(self, route, status, seconds):
+        histogram = self.latency.get(route)
+        if histogram is None:
+            with self._lock:
+                histogram = self.latency.setdefault(route, Histogram(LATENCY_BUCKETS))
+                self.requests.setdefault(route, 0)
+                self.errors.setdefault(route, 0)
+        histogram.observe(seconds)
+        with self._lock:
+            self.requests[route] += 1
+            if status >= 400:
+                self.errors[route] += 1
+
+    def observe_phase(self, phase, seconds):
+        histogram = self.phases.get(phase)
+        if histogram is None:
+            with self._lock:
+                histogram = self.phases.setdefault(phase, Histogram(STORAGE_BUCKETS))
+        histogram.observe(seconds)
+
+    def configure_group_commit(self, log, window, size):
+        with self._lock:
+            self.commit_settings[log] = (window, size)
+            self.commit_groups.setdefault(log, Histogram(GROUP_BUCKETS))
+
+    def observe_group_commit(self, log, records):
+        histogram = self.commit_groups.get(log)
+        if histogram is None:
+            with self._lock:
+                histogram = self.commit_groups.setdefault(log, Histogram(GROUP_BUCKETS))
+        histogram.observe(records)
+
+    @contextmanager
+    def phase(self, phase):
+        """
+        Times the enclosed block as one observation of a storage phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, time.perf_counter() - start)
+
+    def render(self):
+        lines = ["# HELP atm_requests_total Requests handled, by route.",
+                 "# TYPE atm_requests_total counter"]
+        with self._lock:
+            requests, errors = dict(self.requests), dict(self.errors)
+            latency, phases = dict(self.latency), dict(self.phases)
+            settings, groups = dict(self.commit_settings), dict(self.commit_groups)
+        lines += [f'atm_requests_total{{route="{route}"}} {count}' for route, count in sorted(requests.items())]
+        lines += ["# HELP atm_request_errors_total Requests answered with status 400 or above, by route.",
+                  "# TYPE atm_request_errors_total counter"]
+        lines += [f'atm_request_errors_total{{route="{route}"}} {count}' for route, count in sorted(errors.items())]
+        lines += ["# HELP atm_request_duration_seconds Request latency, by route.",
+                  "# TYPE atm_request_duration_seconds histogram"]
+        for route, histogram in sorted(latency.items()):
+            lines += histogram.render("atm_request_duration_seconds", f'route="{route}"')
+        lines += ["# HELP atm_storage_duration_seconds Time spent in storage load, mutation, sync and save phases.",
+                  "# TYPE atm_storage_duration_seconds histogram"]
+        for phase, histogram in sorted(phases.items()):
+            lines += histogram.render("atm_storage_duration_seconds", f'phase="{phase}"')
+        lines += ["# HELP atm_wal_commit_window_seconds Longest wait for a group commit to fill, by log.",
+                  "# TYPE atm_wal_commit_window_seconds gauge"]
+        lines += [f'atm_wal_commit_window_seconds{{log="{log}"}} {window}' for log, (window, _) in sorted(settings.items())]
+        lines += ["# HELP atm_wal_commit_size_records Pending records that close a group commit early, by log.",
+                  "# TYPE atm_wal_commit_size_records gauge"]
+        lines += [f'atm_wal_commit_size_records{{log="{log}"}} {size}' for log, (_, size) in sorted(settings.items())]
+        lines += ["# HELP atm_wal_commit_group_records Records made durable per fsync, by log.",
+                  "# TYPE atm_wal_commit_group_records histogram"]
+        for log, histogram in sorted(groups.items()):
+            lines += histogram.render("atm_wal_commit_group_records", f'log="{log}"')
+        return "\n".join(lines) + "\n"
+
+
+# Shared by the storage backends and the servers
+REGISTRY = Metrics()
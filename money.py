@@ -0,0 +1,95 @@
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+# Balances and amounts are int64 cents everywhere inside the program. These
+# helpers are the only place dollars are parsed or formatted: user input,
+# JSON bodies and the decimal text in the CSV files. NumPy and pandas are only
+# imported by the array helpers, so the scalar ones stay cheap to load.
+
+# Largest amount or balance in cents that fits the int64 balance columns
+MAX_CENTS = 2 ** 63 - 1
+# Below this many cents a float64 dollar value converts to cents exactly
+EXACT_FLOAT_CENTS = 2 ** 50
+
+
+# Parse an amount in dollars into integer cents
+def to_cents(amount):
+    """
+    Accepts a str, int or float in dollars and returns the nearest whole
+    number of cents (half a cent rounds away from zero). Floats are read as
+    their shortest decimal form, so 0.1 is exactly 10 cents.
+    Raises ValueError for anything that is not a finite number or does not
+    fit in int64 cents.
+    """
+    if isinstance(amount, bool):
+        raise ValueError(f"Invalid amount: {amount!r}")
+    try:
+        value = Decimal(str(amount).strip())
+        if not value.is_finite():
+            raise ValueError(f"Invalid amount: {amount!r}")
+        cents = int(value.scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {amount!r}") from None
+    return check_cents(cents, "Amount")
+
+
+# Reject amounts and balances the int64 columns cannot hold
+def check_cents(cents, what="Balance"):
+    """
+    Returns cents unchanged, or raises ValueError if they are outside int64.
+    Stores call it on every balance they compute before logging it.
+    """
+    if not -MAX_CENTS <= cents <= MAX_CENTS:
+        raise ValueError(f"{what} out of range")
+    return cents
+
+
+# Dollars as a float, for JSON responses
+def to_dollars(cents):
+    return int(cents) / 100
+
+
+# Format cents as decimal dollars without a currency sign, e.g. -1234 -> "-12.34"
+def format_cents(cents):
+    cents = int(cents)
+    sign = "-" if cents < 0 else ""
+    return f"{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}"
+
+
+# Vectorized conversion of dollar values (with at most two decimals) to cents
+def cents_array(dollars):
+    import numpy as np
+    return np.rint(np.asarray(dollars, dtype=np.float64) * 100).astype(np.int64)
+
+
+# Vectorized to_cents over the decimal text of a CSV column
+def parse_cents_array(texts):
+    """
+    Returns int64 cents for a sequence of dollar strings; cells that are not
+    a number (or are out of range) count as 0, like LiteStore reads them.
+    Values are parsed as float64 and only those too large for it to hold
+    exactly go through to_cents, so every int64 balance reloads unchanged.
+    """
+    import numpy as np
+    import pandas as pd
+
+    texts = np.asarray(texts, dtype=object)
+    cents = np.rint(pd.to_numeric(pd.Series(texts), errors='coerce').fillna(0.0).to_numpy(dtype=np.float64) * 100)
+    large = np.flatnonzero(~(np.abs(cents) < EXACT_FLOAT_CENTS))
+    cents[large] = 0
+    cents = cents.astype(np.int64)
+    for position in large.tolist():
+        try:
+            cents[position] = to_cents(texts[position])
+        except ValueError:
+            pass
+    return cents
+
+
+# Vectorized format_cents, for writing int64 cents to a CSV column
+def format_cents_array(cents):
+    import numpy as np
+
+    cents = np.asarray(cents, dtype=np.int64)
+    whole, fraction = np.divmod(np.abs(cents), 100)
+    return np.strings.add(np.strings.add(np.where(cents < 0, "-", ""), whole.astype(str)),
+                          np.strings.add(".", np.strings.zfill(fraction.astype(str), 2)))
@@ -0,0 +1,30 @@
+import hashlib
+import hmac
+
+# Stored PINs that are already hashed carry this prefix; anything else is a legacy plain PIN
+HASH_PREFIX = "sha256:"
+
+
+# Hash a PIN, salted with its account number
+def pin_digest(account_number, pin):
+    return hashlib.sha256(f"{account_number}:{pin}".encode('utf-8')).digest()
+
+
+def hash_pin(account_number, pin):
+    return HASH_PREFIX + pin_digest(account_number, pin).hex()
+
+
+# Digest of a stored PIN, hashing it first if it is a legacy plain PIN
+def stored_digest(account_number, stored):
+    stored = str(stored)
+    if stored.startswith(HASH_PREFIX):
+        return bytes.fromhex(stored[len(HASH_PREFIX):])
+    return pin_digest(account_number, stored)
+
+
+# Check an entered PIN against a stored one (hashed or legacy plain)
+def check_pin(account_number, stored, pin):
+    stored = str(stored)
+    if stored.startswith(HASH_PREFIX):
+        return hmac.compare_digest(stored, hash_pin(account_number, pin))
+    return hmac.compare_digest(stored, str(pin))
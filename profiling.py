@@ -0,0 +1,210 @@
+import io
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+MODES = ('deterministic', 'sampling')
+
+# cProfile and pstats are imported on first use so that an idle profiler costs nothing at startup
+
+
+# Label a code object the way pstats does: file:line(function)
+def _label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+
+class _Sampler(threading.Thread):
+    """
+    Samples the call stack of one thread at a fixed interval until stopped.
+    Stacks are counted root first, as tuples of function labels.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return self.stacks
+
+
+class Profiler:
+    """
+    Opt-in per-request profiler for the server routes and CLI operations.
+    A fraction (rate) of the calls to the selected targets is profiled,
+    either with cProfile (deterministic) or by sampling the thread's stack
+    every interval seconds (sampling, cheaper on long requests). Each
+    profiled call writes its own dump to output_dir (.prof for pstats,
+    .stacks in collapsed-stack format for flame graphs) and is folded into
+    an aggregated top-functions report.
+    With rate 0 (the default) start() costs one comparison.
+    Only one deterministic profile runs at a time; calls sampled while
+    another one is running are skipped.
+    """
+
+    def __init__(self, rate=0.0, targets=None, mode='deterministic', output_dir="profiles", interval=0.001):
+        self._lock = threading.Lock()
+        self._deterministic = threading.Lock()
+        self.configure(rate, targets or "", mode, output_dir, interval)
+        self.profiled = 0
+        self._stats = None
+        self._samples = Counter()
+        self._total_samples = 0
+
+    @classmethod
+    def from_environ(cls, environ=os.environ):
+        """
+        Reads ATM_PROFILE_RATE, ATM_PROFILE_TARGETS (comma separated),
+        ATM_PROFILE_MODE, ATM_PROFILE_DIR and ATM_PROFILE_INTERVAL.
+        """
+        return cls(rate=float(environ.get("ATM_PROFILE_RATE", 0)),
+                   targets=environ.get("ATM_PROFILE_TARGETS"),
+                   mode=environ.get("ATM_PROFILE_MODE", MODES[0]),
+                   output_dir=environ.get("ATM_PROFILE_DIR", "profiles"),
+                   interval=float(environ.get("ATM_PROFILE_INTERVAL", 0.001)))
+
+    def configure(self, rate=None, targets=None, mode=None, output_dir=None, interval=None):
+        """
+        Changes the settings that are not None. targets is a list or a
+        comma-separated string; an empty one selects every target.
+        Raises ValueError (or TypeError) for an invalid rate, targets, mode
+        or interval; every setting is checked before any is changed, so a
+        rejected call changes nothing.
+        """
+        if rate is not None:
+            rate = float(rate)
+            if not 0 <= rate <= 1:
+                raise ValueError("rate must be between 0 and 1")
+        if targets is not None:
+            if isinstance(targets, str):
+                targets = targets.split(",")
+            if not isinstance(targets, (list, tuple, set)) or not all(isinstance(t, str) for t in targets):
+                raise TypeError("targets must be a list of names or a comma-separated string")
+            targets = {target.strip() for target in targets if target.strip()}
+        if mode is not None and mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if interval is not None:
+            interval = float(interval)
+            if not interval > 0:
+                raise ValueError("interval must be positive")
+        for name, value in (('rate', rate), ('targets', targets), ('mode', mode),
+                            ('output_dir', output_dir), ('interval', interval)):
+            if value is not None:
+                setattr(self, name, value)
+
+    def settings(self):
+        return {'rate': self.rate, 'targets': sorted(self.targets), 'mode': self.mode,
+                'output_dir': self.output_dir, 'interval': self.interval, 'profiled': self.profiled}
+
+    def start(self, name):
+        """
+        Starts profiling the current call to target name if it is sampled.
+        Returns a handle for stop(), or None.
+        """
+        if self.rate <= 0 or (self.targets and name not in self.targets) or random.random() >= self.rate:
+            return None
+        if self.mode == 'sampling':
+            sampler = _Sampler(threading.get_ident(), self.interval)
+            sampler.start()
+            return name, sampler
+        if not self._deterministic.acquire(blocking=False):
+            return None
+        import cProfile
+
+        profile = cProfile.Profile()
+        profile.enable()
+        return name, profile
+
+    def stop(self, handle):
+        """
+        Stops a profile started by start(), writes its dump and folds it into the report.
+        """
+        if handle is None:
+            return
+        name, profiler = handle
+        if not isinstance(profiler, _Sampler):
+            import pstats
+
+            profiler.disable()
+            self._deterministic.release()
+            profiler.dump_stats(self._dump_path(name, ".prof"))
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profiler)
+                else:
+                    self._stats.add(profiler)
+                self.profiled += 1
+            return
+        stacks = profiler.stop()
+        with open(self._dump_path(name, ".stacks"), 'w', encoding='utf-8') as f:
+            for stack, count in stacks.items():
+                f.write(f"{';'.join(stack)} {count}\n")
+        with self._lock:
+            for stack, count in stacks.items():
+                for function in set(stack):
+                    self._samples[function] += count
+                self._total_samples += count
+            self.profiled += 1
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Profiles the enclosed block as one call to target name (if sampled).
+        """
+        handle = self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(handle)
+
+    def _dump_path(self, name, extension):
+        os.makedirs(self.output_dir, exist_ok=True)
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") or "root"
+        return os.path.join(self.output_dir, f"{safe_name}-{time.strftime('%Y%m%dT%H%M%S')}-"
+                                             f"{threading.get_ident()}-{time.perf_counter_ns()}{extension}")
+
+    def report(self, limit=20):
+        """
+        Returns the aggregated top functions of every profiled call as text.
+        """
+        with self._lock:
+            lines = [f"Profiled calls: {self.profiled}"]
+            if self._stats is not None:
+                buffer = io.StringIO()
+                self._stats.stream = buffer
+                self._stats.sort_stats('cumulative').print_stats(limit)
+                lines += ["", "Deterministic profiles, by cumulative time:", buffer.getvalue().strip()]
+            if self._total_samples:
+                lines += ["", f"Sampled stacks ({self._total_samples} samples), by inclusive samples:"]
+                for function, count in self._samples.most_common(limit):
+                    lines.append(f"{100 * count / self._total_samples:6.1f}%  {count:8d}  {function}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, limit=20):
+        """
+        Writes report() to report.txt in the output directory and returns its path.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, "report.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.report(limit))
+        return path
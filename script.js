@@ -1,9 +1,31 @@
 document.addEventListener("DOMContentLoaded", function () {
+    // POST to an account route with the session token from login
+    function authorizedPost(path, body) {
+        return fetch("http://127.0.0.1:5000" + path, {
+            method: "POST",
+            headers: {
+                "Content-Type": "application/json",
+                "Authorization": "Bearer " + sessionStorage.getItem("token")
+            },
+            body: JSON.stringify(body || {})
+        })
+        .then(response => {
+            if (response.status === 401) {
+                sessionStorage.removeItem("token");
+                document.querySelector(".dashboard").style.display = "none";
+                document.querySelector(".login-container").style.display = "block";
+                document.getElementById("loginMessage").innerText = "Session expired. Please log in again.";
+            }
+            return response.json();
+        });
+    }
+
     function login() {
         let accountNumber = document.getElementById("accountNumber").value;
+        let pin = document.getElementById("pin").value;
         
-        if (!accountNumber) {
-            document.getElementById("loginMessage").innerText = "Please enter an account number.";
+        if (!accountNumber || !pin) {
+            document.getElementById("loginMessage").innerText = "Please enter an account number and PIN.";
             return;
         }
         
@@ -12,16 +34,16 @@ document.addEventListener("DOMContentLoaded", function () {
         fetch("http://127.0.0.1:5000/login", {
             method: "POST",
             headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ account_number: parseInt(accountNumber) })
+            body: JSON.stringify({ account_number: parseInt(accountNumber), pin: pin })
         })
         .then(response => response.json())
         .then(data => {
-            console.log("Login response data:", data);
-            if (data.message) {
+            if (data.token) {
                 document.querySelector(".login-container").style.display = "none";
                 document.querySelector(".dashboard").style.display = "block";
                 document.getElementById("responseMessage").innerText = "Login successful!";
-                sessionStorage.setItem("accountNumber", accountNumber);
+                document.getElementById("pin").value = "";
+                sessionStorage.setItem("token", data.token);
             } else {
                 document.getElementById("loginMessage").innerText = data.error;
             }
@@ -30,28 +52,17 @@ document.addEventListener("DOMContentLoaded", function () {
     }
     
     function checkBalance() {
-        let accountNumber = sessionStorage.getItem("accountNumber");
-        fetch("http://127.0.0.1:5000/balance", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ account_number: parseInt(accountNumber) })
-        })
-        .then(response => response.json())
+        authorizedPost("/balance")
         .then(data => {
-            document.getElementById("responseMessage").innerText = "Balance: $" + data.balance;
+            document.getElementById("responseMessage").innerText =
+                data.error ? data.error : "Balance: $" + data.balance;
         })
         .catch(error => console.error("Error fetching balance:", error));
     }
     
     function withdraw() {
-        let accountNumber = sessionStorage.getItem("accountNumber");
         let amount = prompt("Enter withdrawal amount:");
-        fetch("http://127.0.0.1:5000/withdraw", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ account_number: parseInt(accountNumber), amount: parseFloat(amount) })
-        })
-        .then(response => response.json())
+        authorizedPost("/withdraw", { amount: parseFloat(amount) })
         .then(data => {
             document.getElementById("responseMessage").innerText = data.message || data.error;
         })
@@ -59,14 +70,8 @@ document.addEventListener("DOMContentLoaded", function () {
     }
     
     function deposit() {
-        let accountNumber = sessionStorage.getItem("accountNumber");
         let amount = prompt("Enter deposit amount:");
-        fetch("http://127.0.0.1:5000/deposit", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ account_number: parseInt(accountNumber), amount: parseFloat(amount) })
-        })
-        .then(response => response.json())
+        authorizedPost("/deposit", { amount: parseFloat(amount) })
         .then(data => {
             document.getElementById("responseMessage").innerText = data.message || data.error;
         })
@@ -74,15 +79,10 @@ document.addEventListener("DOMContentLoaded", function () {
     }
     
     function viewTransactions() {
-        let accountNumber = sessionStorage.getItem("accountNumber");
-        fetch("http://127.0.0.1:5000/transactions", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ account_number: parseInt(accountNumber) })
-        })
-        .then(response => response.json())
+        authorizedPost("/transactions")
         .then(data => {
-            document.getElementById("responseMessage").innerText = "Transactions: " + data.transactions;
+            document.getElementById("responseMessage").innerText =
+                data.error ? data.error : "Transactions: " + data.transactions;
         })
         .catch(error => console.error("Error fetching transactions:", error));
     }
@@ -0,0 +1,90 @@
+import os
+import secrets
+import threading
+import time
+
+# Seconds a session stays valid after /login unless ATM_SESSION_TTL says otherwise
+DEFAULT_TTL = 900
+
+
+# Token of an "Authorization: Bearer <token>" header, or None
+def bearer_token(authorization):
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer":
+        return None
+    return token.strip() or None
+
+
+class SessionTable:
+    """
+    In-memory table of login sessions: token -> value (the account a
+    session was opened for). Every session lives for the same ttl seconds,
+    so the table is kept in expiry order and expired sessions are evicted
+    from its front on each call; resolving a token is one dictionary lookup.
+    Sessions do not survive a restart.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, clock=time.monotonic):
+        if not ttl > 0:
+            raise ValueError("ttl must be positive")
+        self.ttl = ttl
+        self._clock = clock
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls, environ=os.environ):
+        """
+        Reads ATM_SESSION_TTL (seconds).
+        """
+        return cls(float(environ.get("ATM_SESSION_TTL", DEFAULT_TTL)))
+
+    def _evict(self, now):
+        """
+        Drops expired sessions. Must be called with the lock held.
+        """
+        while self._sessions:
+            token = next(iter(self._sessions))
+            if self._sessions[token][0] > now:
+                return
+            del self._sessions[token]
+
+    def create(self, value):
+        """
+        Opens a session for value and returns its new random token.
+        """
+        token = secrets.token_urlsafe(32)
+        self.put(token, value)
+        return token
+
+    def put(self, token, value):
+        """
+        Records a session under a token issued elsewhere (see shard_router.py).
+        """
+        with self._lock:
+            now = self._clock()
+            self._evict(now)
+            self._sessions.pop(token, None)
+            self._sessions[token] = (now + self.ttl, value)
+
+    def get(self, token):
+        """
+        Returns the value of a live session, or None if the token is unknown or expired.
+        """
+        entry = self._sessions.get(token)
+        if entry is None:
+            return None
+        if entry[0] <= self._clock():
+            with self._lock:
+                self._evict(self._clock())
+            return None
+        return entry[1]
+
+    def revoke(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def __len__(self):
+        with self._lock:
+            self._evict(self._clock())
+            return len(self._sessions)
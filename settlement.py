@@ -0,0 +1,130 @@
+import argparse
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from ledger import LEDGER_COLUMNS
+from money import format_cents, parse_cents_array
+
+# Settlement files carry one deposit or withdrawal per line
+SETTLEMENT_COLUMNS = ['Account Number', 'Type', 'Amount']
+SETTLEMENT_TYPES = ('deposit', 'withdrawal')
+CHUNK_SIZE = 1_000_000
+
+
+# Stream the settlement file in chunks of typed rows
+def read_chunks(file_name, chunksize=CHUNK_SIZE):
+    """
+    Yields DataFrames of at most chunksize lines with 'Amount' in cents and a
+    signed 'Net' column (withdrawals negative). Raises ValueError on an unknown type or an
+    amount that is not a positive number.
+    """
+    for chunk in pd.read_csv(file_name, usecols=SETTLEMENT_COLUMNS, chunksize=chunksize,
+                             dtype={'Account Number': np.int64, 'Type': str, 'Amount': str}):
+        kind = chunk['Type'].str.strip().str.lower()
+        if not kind.isin(SETTLEMENT_TYPES).all():
+            raise ValueError(f"Unknown settlement type(s): {sorted(set(kind) - set(SETTLEMENT_TYPES))}")
+        chunk['Amount'] = parse_cents_array(chunk['Amount'])
+        if not (chunk['Amount'] > 0).all():
+            raise ValueError("Settlement amounts must be positive numbers")
+        chunk['Type'] = kind
+        chunk['Net'] = np.where(kind == 'withdrawal', -chunk['Amount'], chunk['Amount'])
+        yield chunk
+
+
+# Aggregate the whole file into one net amount per account
+def net_amounts(file_name, chunksize=CHUNK_SIZE):
+    """
+    Returns a Series of net amounts in cents indexed by account number.
+    Each chunk is reduced with a groupby and the partial sums are combined.
+    """
+    partials = [chunk.groupby('Account Number')['Net'].sum()
+                for chunk in read_chunks(file_name, chunksize)]
+    if not partials:
+        return pd.Series(dtype=np.int64)
+    return pd.concat(partials).groupby(level=0).sum()
+
+
+# Directory holding the copies of the settlement files applied to an account table
+def settlements_dir_for(file_name):
+    return file_name + ".settlements"
+
+
+# Copy a settlement file next to the table's log before it is applied
+def copy_settlement(file_name, table_file):
+    """
+    Returns the path of the copy. The store reads only the copy, so moving
+    or editing the original afterwards cannot change what is replayed.
+    """
+    directory = settlements_dir_for(table_file)
+    os.makedirs(directory, exist_ok=True)
+    copy = os.path.abspath(os.path.join(directory, uuid.uuid4().hex + ".csv"))
+    shutil.copyfile(file_name, copy)
+    with open(copy, 'rb') as f:
+        os.fsync(f.fileno())
+    return copy
+
+
+# Turn the accepted settlement lines into ledger rows, chunk by chunk
+def ledger_frames(file_name, accepted, seq, timestamp, chunksize=CHUNK_SIZE, skip=0):
+    """
+    Yields DataFrames in the ledger layout for the lines whose account is in
+    accepted, all tagged with the settlement's sequence number. The first
+    skip rows (already in the ledger) are left out.
+    """
+    accepted = pd.Index(accepted)
+    for chunk in read_chunks(file_name, chunksize):
+        chunk = chunk[chunk['Account Number'].isin(accepted)]
+        if skip >= len(chunk):
+            skip -= len(chunk)
+            continue
+        chunk, skip = chunk.iloc[skip:], 0
+        yield pd.DataFrame({
+            'Seq': seq,
+            'Account Number': chunk['Account Number'].to_numpy(),
+            'Type': chunk['Type'].to_numpy(),
+            'Amount': chunk['Net'].to_numpy(),
+            'Counterparty': "",
+            'Timestamp': timestamp,
+        }, columns=LEDGER_COLUMNS)
+
+
+def main():
+    from storage import SQLITE_EXTENSIONS, TableInUse, open_storage
+
+    parser = argparse.ArgumentParser(description="Apply a settlement file of deposits and withdrawals in bulk.")
+    parser.add_argument("settlement_file", help="CSV with 'Account Number', 'Type' and 'Amount' columns")
+    parser.add_argument("--database", default="bank_database.csv")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    # Only the in-memory AccountStore (CSV file or binary store) can settle
+    if os.path.splitext(args.database)[1].lower() in SQLITE_EXTENSIONS:
+        print("Error: settlement files can only be applied to a CSV table or a binary store.")
+        return
+    try:
+        store = open_storage(args.database)
+    except TableInUse as e:
+        print(f"Error: {e}. Stop the server before applying a settlement file.")
+        return
+    if store is None:
+        print(f"Error: File '{args.database}' not found.")
+        return
+    try:
+        accepted, rejected = store.settle(args.settlement_file, args.chunksize)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    finally:
+        store.close()
+    print(f"Settled {len(accepted)} accounts (net ${format_cents(accepted.sum())}).")
+    if len(rejected):
+        print(f"Rejected {len(rejected)} accounts (unknown or would be overdrawn): "
+              f"{', '.join(map(str, rejected[:20]))}{' ...' if len(rejected) > 20 else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+import uuid
+
+from flask import Flask, g, jsonify, request
+from metrics import CONTENT_TYPE, REGISTRY
+from money import format_cents, to_cents
+from sessions import SessionTable, bearer_token
+from sharding import ShardMap
+from wal import WriteAheadLog
+
+app = Flask(__name__)
+
+# Base URLs of the shard workers (atm_be.py), in shard order; see sharding.py
+SHARD_URLS = [url.strip() for url in os.environ.get("ATM_SHARDS", "").split(",") if url.strip()]
+if not SHARD_URLS:
+    raise RuntimeError("Set ATM_SHARDS to the comma-separated URLs of the shard servers")
+SHARD_MAP = ShardMap.from_environ(len(SHARD_URLS))
+
+# Commit decisions of cross-shard transfers, made durable before any shard commits
+DECISIONS = WriteAheadLog(os.environ.get("ATM_SHARD_DECISIONS", "shard_router.wal"))
+# Cross-shard transfers some shard has not acknowledged the decision of yet:
+# txid -> [decision path (None until the commit is logged), shards left].
+# Their records stay in DECISIONS until no shard is left.
+UNFINISHED = {}
+UNFINISHED_LOCK = threading.Lock()
+# Seconds between attempts to deliver unacknowledged decisions
+RETRY_INTERVAL = float(os.environ.get("ATM_SHARD_RETRY", 5))
+
+# Request headers passed on to the shards, besides Content-Type
+REQUEST_HEADERS = ('Authorization', 'If-None-Match')
+# Response headers passed back from the shards
+FORWARDED_HEADERS = ('Content-Type', 'ETag')
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+
+# Shard and account of every session a shard opened through /login. Same TTL
+# as the shards' own tables, which remain the ones that check the token.
+SESSIONS = SessionTable.from_environ()
+
+
+class ShardClient:
+    """
+    HTTP client for one shard. Every thread keeps its own kept-alive
+    connection, so forwarding a request does not pay for a new TCP
+    connection.
+    """
+
+    def __init__(self, url, timeout=30):
+        parts = urllib.parse.urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Returns (status, headers, body). Raises OSError or HTTPException if
+        the shard cannot be reached; the connection is then dropped.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port,
+                                                                             timeout=self.timeout)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, response.getheaders(), response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            raise
+
+
+SHARDS = [ShardClient(url) for url in SHARD_URLS]
+
+
+# Shard that owns an account; malformed numbers go to shard 0, which answers with the usual error
+def account_shard(account_number):
+    try:
+        return SHARD_MAP.shard(int(account_number))
+    except (TypeError, ValueError):
+        return 0
+
+
+# Pass the current request through to a shard unchanged
+def forward(shard):
+    headers = {'Content-Type': request.content_type or 'application/json'}
+    for name in REQUEST_HEADERS:
+        if name in request.headers:
+            headers[name] = request.headers[name]
+    path = request.path + ("?" + request.query_string.decode() if request.query_string else "")
+    try:
+        status, response_headers, body = SHARDS[shard].request(request.method, path, request.get_data(), headers)
+    except (OSError, http.client.HTTPException):
+        return jsonify({"error": f"Shard {shard} unavailable"}), 502
+    response = app.response_class(body, status=status)
+    for name, value in response_headers:
+        if name in FORWARDED_HEADERS:
+            response.headers[name] = value
+    return response
+
+
+# Send a JSON request to a shard and decode the answer
+def call(shard, path, data=None, method='POST'):
+    try:
+        status, _, body = SHARDS[shard].request(method, path, None if data is None else json.dumps(data),
+                                                {'Content-Type': 'application/json'})
+    except (OSError, http.client.HTTPException):
+        return 502, {"error": f"Shard {shard} unavailable"}
+    return status, json.loads(body)
+
+
+# Move money between accounts on different shards with a two-phase commit
+def transfer_across(sender, receiver, amount, sender_shard, receiver_shard):
+    """
+    Both shards prepare first: the sender's shard reserves the debit and the
+    receiver's shard checks the account. If either refuses, both are told
+    to abort and its answer is returned. Otherwise the commit decision is
+    made durable in the decision log before either shard commits, so a
+    transfer is never half applied. A shard that does not acknowledge its
+    commit (or abort) is sent it again in the background until it does;
+    the transfer is then answered with 202 instead of 200.
+    """
+    txid = uuid.uuid4().hex
+    sides = [(sender_shard, sender, -amount, receiver), (receiver_shard, receiver, amount, sender)]
+    balance = None
+    for shard, account_number, delta, counterparty in sides:
+        status, body = call(shard, "/2pc/prepare", {"txid": txid, "account_number": account_number,
+                                                    "amount": format_cents(delta), "counterparty": counterparty})
+        if status != 200:
+            with UNFINISHED_LOCK:
+                UNFINISHED[txid] = ["/2pc/abort", {sender_shard, receiver_shard}]
+            finish(txid)
+            return body, status
+        if shard == sender_shard:
+            balance = body['balance']
+    # Registered before it is logged, so compact_decisions() keeps the record
+    with UNFINISHED_LOCK:
+        UNFINISHED[txid] = [None, {sender_shard, receiver_shard}]
+    DECISIONS.append_many([{'op': 'commit', 'txid': txid}])
+    with UNFINISHED_LOCK:
+        UNFINISHED[txid][0] = "/2pc/commit"
+    left = finish(txid)
+    if left:
+        return {"message": f"${format_cents(amount)} transfer to Account {receiver} is committed; "
+                           f"shard {', '.join(map(str, sorted(left)))} will be updated as soon as it answers.",
+                "balance": balance}, 202
+    return {"message": f"${format_cents(amount)} transferred successfully to Account {receiver}.",
+            "balance": balance}, 200
+
+
+# Send a transfer's decision to the shards that have not acknowledged it
+def finish(txid):
+    """
+    A commit is acknowledged with 200, or 404 from a shard that already
+    committed it; an abort with 200. Returns the shards still left.
+    """
+    with UNFINISHED_LOCK:
+        if txid not in UNFINISHED:
+            return set()
+        path, shards = UNFINISHED[txid][0], set(UNFINISHED[txid][1])
+    acknowledged = set()
+    for shard in shards:
+        status, _ = call(shard, path, {"txid": txid})
+        if status == 200 or (status == 404 and path == "/2pc/commit"):
+            acknowledged.add(shard)
+    # The retry thread may have finished it meanwhile
+    with UNFINISHED_LOCK:
+        entry = UNFINISHED.get(txid)
+        if entry is None:
+            return set()
+        entry[1] -= acknowledged
+        if not entry[1]:
+            del UNFINISHED[txid]
+        return set(entry[1])
+
+
+# Drop the decisions every shard has acknowledged from the decision log
+def compact_decisions():
+    records = list(DECISIONS.replay())
+    # Taken after reading the log: a transfer is registered before its record is written
+    with UNFINISHED_LOCK:
+        unfinished = set(UNFINISHED)
+    keep = {record['seq'] for record in records if record['txid'] in unfinished}
+    if len(keep) < len(records):
+        DECISIONS.truncate(records[-1]['seq'], keep)
+
+
+# Deliver the decisions that did not reach every shard, for as long as the router runs
+def retry_unfinished():
+    while True:
+        time.sleep(RETRY_INTERVAL)
+        with UNFINISHED_LOCK:
+            decided = [txid for txid, (path, _) in UNFINISHED.items() if path is not None]
+        for txid in decided:
+            finish(txid)
+        compact_decisions()
+
+
+# Settle the transfers a crash left prepared on any shard
+def recover():
+    """
+    A prepared transfer is committed if its decision was logged and aborted
+    otherwise. Decisions a shard does not acknowledge stay in the decision
+    log and are retried by a background thread, which this starts. Must run
+    once, before the router serves requests. Returns the number of
+    transfers settled.
+    """
+    committed = {record['txid'] for record in DECISIONS.replay() if record['op'] == 'commit'}
+    settled = 0
+    for shard in range(len(SHARDS)):
+        status, body = call(shard, "/2pc/pending", method='GET')
+        if status != 200:
+            raise RuntimeError(f"Shard {shard} did not list its pending transfers: {body.get('error')}")
+        for txid in body['pending']:
+            with UNFINISHED_LOCK:
+                UNFINISHED.setdefault(txid, ["/2pc/commit" if txid in committed else "/2pc/abort", set()])[1].add(shard)
+            settled += 1
+    for txid in list(UNFINISHED):
+        finish(txid)
+    compact_decisions()
+    threading.Thread(target=retry_unfinished, daemon=True).start()
+    return settled
+
+
+def session_token():
+    return bearer_token(request.headers.get("Authorization"))
+
+# The request's JSON body if it is an object, else an empty one (the shard rejects it)
+def json_object():
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+# The (shard, account number) of the request's session, or None
+def session():
+    token = session_token()
+    return SESSIONS.get(token) if token else None
+
+# Logins go to the account's shard; the token it issues is remembered so the
+# session's later requests are routed without a body to look into
+@app.route('/login', methods=['POST'])
+def login():
+    account_number = json_object().get("account_number")
+    shard = account_shard(account_number)
+    response = forward(shard)
+    if response.status_code == 200:
+        SESSIONS.put(response.get_json()["token"], (shard, int(account_number)))
+    return response
+
+@app.route('/logout', methods=['POST'])
+def logout():
+    current = session()
+    if current is None:
+        return jsonify({"message": "Logged out"}), 200
+    SESSIONS.revoke(session_token())
+    return forward(current[0])
+
+@app.route('/balance', methods=['POST'])
+@app.route('/withdraw', methods=['POST'])
+@app.route('/deposit', methods=['POST'])
+@app.route('/transactions', methods=['POST'])
+@app.route('/stats', methods=['POST'])
+@app.route('/analytics', methods=['POST'])
+@app.route('/get_account_details', methods=['GET'])
+def by_session():
+    current = session()
+    if current is None:
+        return jsonify({"error": "Login required"}), 401
+    return forward(current[0])
+
+@app.route('/transfer', methods=['POST'])
+def transfer():
+    current = session()
+    if current is None:
+        return jsonify({"error": "Login required"}), 401
+    sender_shard, sender = current
+    data = json_object()
+    try:
+        receiver = int(data.get("receiver", data.get("receiver_account_number")))
+        amount = to_cents(data.get("amount"))
+    except (TypeError, ValueError):
+        return forward(sender_shard)
+    receiver_shard = SHARD_MAP.shard(receiver)
+    if sender_shard == receiver_shard or not amount > 0:
+        return forward(sender_shard)
+    body, status = transfer_across(sender, receiver, amount, sender_shard, receiver_shard)
+    return jsonify(body), status
+
+# A batch is applied atomically by one shard, so it may not span shards. Local callers only,
+# as on the shards themselves (which only ever see the router's address)
+@app.route('/batch', methods=['POST'])
+def batch():
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        return jsonify({"error": "Forbidden"}), 403
+    operations = json_object().get("operations")
+    shards = {account_shard(op.get("account_number")) for op in operations if isinstance(op, dict)} \
+        if isinstance(operations, list) else set()
+    if len(shards) > 1:
+        return jsonify({"error": "All operations of a batch must belong to accounts on the same shard"}), 400
+    return forward(shards.pop() if shards else 0)
+
+# Every request is timed and counted by route for /metrics
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    rule = request.url_rule
+    REGISTRY.observe_request(rule.rule if rule else "unmatched", response.status_code,
+                             time.perf_counter() - g.request_start)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+if __name__ == '__main__':
+    recover()
+    app.run(threaded=True)
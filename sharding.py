@@ -0,0 +1,180 @@
+import argparse
+import bisect
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from ledger import ledger_file_for
+from storage import SQLITE_EXTENSIONS, is_binary_store
+
+SCHEMES = ('hash', 'range')
+MANIFEST = "shards.json"
+
+# Runs one shard: atm_be.py serving the table named by BANK_DATABASE
+WORKER = "import sys, atm_be; atm_be.app.run(host=sys.argv[1], port=int(sys.argv[2]), threaded=True)"
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class ShardMap:
+    """
+    Assigns every account number to one of count shards, either by hash
+    (account number modulo count) or by range (bounds[i] being the first
+    account number of shard i + 1).
+    """
+
+    def __init__(self, count, scheme='hash', bounds=None):
+        if count < 1:
+            raise ValueError("at least one shard is needed")
+        if scheme not in SCHEMES:
+            raise ValueError(f"scheme must be one of {', '.join(SCHEMES)}")
+        self.count = count
+        self.scheme = scheme
+        self.bounds = sorted(int(bound) for bound in bounds or [])
+        if scheme == 'range' and len(self.bounds) != count - 1:
+            raise ValueError("range sharding needs one bound less than the number of shards")
+
+    @classmethod
+    def from_environ(cls, count, environ=os.environ):
+        """
+        Reads ATM_SHARD_SCHEME and ATM_SHARD_BOUNDS (comma separated).
+        """
+        bounds = environ.get("ATM_SHARD_BOUNDS", "")
+        return cls(count, environ.get("ATM_SHARD_SCHEME", 'hash'),
+                   [bound for bound in bounds.split(",") if bound.strip()])
+
+    def shard(self, account_number):
+        if self.scheme == 'hash':
+            return account_number % self.count
+        return bisect.bisect_right(self.bounds, account_number)
+
+
+# Partition a CSV account table and its ledger into one table per shard
+def split_table(csv_file, out_dir, count, scheme='hash'):
+    """
+    Writes shard<i>.csv and shard<i>_ledger.csv for every shard plus a
+    shards.json manifest to out_dir. The table is compacted first and its
+    cells are copied unchanged. With range sharding the bounds are chosen
+    so the shards hold about the same number of accounts.
+    Returns the ShardMap.
+    """
+    import numpy as np
+    import pandas as pd
+
+    from account_store import AccountStore
+
+    if is_binary_store(csv_file) or os.path.splitext(csv_file)[1].lower() in SQLITE_EXTENSIONS:
+        raise ValueError("only CSV account tables can be split")
+    if os.path.exists(os.path.join(out_dir, MANIFEST)):
+        raise FileExistsError(os.path.join(out_dir, MANIFEST))
+    store = AccountStore.load(csv_file)
+    if store is None:
+        raise FileNotFoundError(csv_file)
+    store.close()
+
+    df = pd.read_csv(csv_file, dtype=str, keep_default_na=False)
+    ledger = pd.read_csv(ledger_file_for(csv_file), dtype=str, keep_default_na=False)
+    numbers = df['Account Number'].astype(np.int64).to_numpy()
+    bounds = []
+    if scheme == 'range':
+        ordered = np.sort(numbers)
+        bounds = [int(ordered[len(ordered) * i // count]) for i in range(1, count)]
+    shard_map = ShardMap(count, scheme, bounds)
+
+    def shards_of(account_numbers):
+        if scheme == 'hash':
+            return account_numbers % count
+        return np.searchsorted(shard_map.bounds, account_numbers, side='right')
+
+    table_shards = shards_of(numbers)
+    ledger_shards = shards_of(ledger['Account Number'].astype(np.int64).to_numpy())
+    os.makedirs(out_dir, exist_ok=True)
+    files = []
+    for shard in range(count):
+        file_name = f"shard{shard}.csv"
+        df[table_shards == shard].to_csv(os.path.join(out_dir, file_name), index=False)
+        ledger[ledger_shards == shard].to_csv(os.path.join(out_dir, ledger_file_for(file_name)), index=False)
+        files.append(file_name)
+    with open(os.path.join(out_dir, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump({'scheme': scheme, 'bounds': shard_map.bounds, 'files': files}, f, indent=2)
+    return shard_map
+
+
+def read_manifest(out_dir):
+    with open(os.path.join(out_dir, MANIFEST), encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Wait until a server answers on /metrics
+def wait_ready(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url + "/metrics", timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not start")
+            time.sleep(0.1)
+
+
+# Start one worker process per shard, then the router in this process
+def serve(out_dir, host="127.0.0.1", port=5000, base_port=5001):
+    """
+    Each worker is atm_be.py on its shard's table, listening on base_port + i.
+    The router (shard_router.py) listens on port and settles transfers left
+    in doubt by an earlier run before it starts serving, then keeps
+    retrying commits a shard did not acknowledge.
+    """
+    manifest = read_manifest(out_dir)
+    urls = [f"http://{host}:{base_port + shard}" for shard in range(len(manifest['files']))]
+    workers = []
+    # Stop the workers on SIGTERM as well as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for shard, file_name in enumerate(manifest['files']):
+            env = dict(os.environ, BANK_DATABASE=os.path.abspath(os.path.join(out_dir, file_name)))
+            workers.append(subprocess.Popen([sys.executable, "-c", WORKER, host, str(base_port + shard)],
+                                            cwd=HERE, env=env))
+        for url in urls:
+            wait_ready(url)
+        os.environ.update(ATM_SHARDS=",".join(urls), ATM_SHARD_SCHEME=manifest['scheme'],
+                          ATM_SHARD_BOUNDS=",".join(map(str, manifest['bounds'])),
+                          ATM_SHARD_DECISIONS=os.path.join(out_dir, "router.wal"))
+        import shard_router
+
+        shard_router.recover()
+        shard_router.app.run(host=host, port=port, threaded=True)
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split the account table into shards and serve them behind a router.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    split = commands.add_parser("split", help="partition a CSV table and its ledger")
+    split.add_argument("source", help="accounts CSV file")
+    split.add_argument("out_dir", help="directory for the shard tables")
+    split.add_argument("--shards", type=int, default=4)
+    split.add_argument("--scheme", choices=SCHEMES, default='hash')
+    run = commands.add_parser("serve", help="run one worker per shard and the router")
+    run.add_argument("out_dir", help="directory written by split")
+    run.add_argument("--host", default="127.0.0.1")
+    run.add_argument("--port", type=int, default=5000, help="router port")
+    run.add_argument("--base-port", type=int, default=5001, help="port of shard 0; shard i uses base-port + i")
+    args = parser.parse_args()
+    if args.command == "split":
+        shard_map = split_table(args.source, args.out_dir, args.shards, args.scheme)
+        print(f"Split {args.source} into {shard_map.count} shards by {shard_map.scheme} in {args.out_dir}.")
+    else:
+        serve(args.out_dir, args.host, args.port, args.base_port)
+
+
+if __name__ == "__main__":
+    main()
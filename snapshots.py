@@ -0,0 +1,158 @@
+import threading
+
+import numpy as np
+
+# Changed rows a version carries on top of its base arrays before they are folded into new ones
+MAX_CHANGES = 512
+# Rows a publish copies before they are merged into the shared changes dict
+RECENT_CHANGES = 64
+# Elements copied per slice when folding, so writers get the GIL in between
+COPY_SLICE = 1 << 18
+
+
+class Version:
+    """
+    Immutable point-in-time view of every row's balance, live flag and
+    version counter. It is a set of read-only base arrays plus the rows
+    changed since they were copied: a shared changes dict and a small
+    dict of the most recent ones on top of it; rows at or past size did
+    not exist yet. Readers hold on to one Version for as long as they
+    need a consistent view and take no lock. An old Version is freed as
+    soon as the last reader drops it.
+    """
+
+    __slots__ = ('seq', 'size', 'balances', 'live', 'versions', 'changes', 'recent')
+
+    def __init__(self, seq, size, balances, live, versions, changes, recent):
+        self.seq = seq
+        self.size = size
+        self.balances = balances
+        self.live = live
+        self.versions = versions
+        self.changes = changes
+        self.recent = recent
+
+    def row(self, row):
+        """
+        Returns (balance, live, version) of a row, or None if it did not exist yet.
+        """
+        if row is None or row >= self.size:
+            return None
+        changed = self.recent.get(row) or self.changes.get(row)
+        if changed is not None:
+            return changed
+        return self.balances.item(row), self.live.item(row), self.versions.item(row)
+
+    def arrays(self):
+        """
+        Returns writable copies of the (balances, live, versions) arrays with the changes applied.
+        """
+        balances = np.zeros(self.size, dtype=np.int64)
+        live = np.zeros(self.size, dtype=bool)
+        versions = np.zeros(self.size, dtype=np.int64)
+        for start in range(0, len(self.balances), COPY_SLICE):
+            end = min(start + COPY_SLICE, len(self.balances))
+            balances[start:end] = self.balances[start:end]
+            live[start:end] = self.live[start:end]
+            versions[start:end] = self.versions[start:end]
+        for changes in (self.changes, self.recent):
+            if changes:
+                rows = np.fromiter(changes, dtype=np.int64, count=len(changes))
+                values = list(changes.values())
+                balances[rows] = [value[0] for value in values]
+                live[rows] = [value[1] for value in values]
+                versions[rows] = [value[2] for value in values]
+        return balances, live, versions
+
+
+# Wrap copied arrays as the read-only base of a Version
+def _base(seq, size, balances, live, versions, changes=None, recent=None):
+    for array in (balances, live, versions):
+        array.flags.writeable = False
+    return Version(seq, size, balances, live, versions, changes or {}, recent or {})
+
+
+class VersionChain:
+    """
+    Publishes a new Version after every applied mutation (copy-on-write).
+    A publish copies the previous Version's recent dict (at most
+    RECENT_CHANGES rows) and adds the new rows; every RECENT_CHANGES rows
+    the recent dict is merged into a new shared changes dict. So a publish
+    costs O(RECENT_CHANGES + changes / RECENT_CHANGES), whatever the number
+    of accounts.
+
+    Once the changes outgrow max_changes, a background thread folds them
+    into fresh base arrays: an O(accounts) copy (about 60 ms for 10M
+    accounts) made without the chain's lock and in slices, so writers keep
+    publishing meanwhile and wait at most one interpreter switch interval
+    (5 ms) for the GIL. The new base is then swapped in with the rows
+    changed since. Only a mutation that touches more rows than
+    max_changes at once (a settlement, already O(rows)) folds in place.
+    Readers pay one or two dict lookups per row on top of the array read.
+    """
+
+    def __init__(self, seq, balances, live, versions, max_changes=MAX_CHANGES):
+        self.max_changes = max_changes
+        self._lock = threading.Lock()
+        self.current = _base(seq, len(balances), balances.copy(), live.copy(), versions.copy())
+        self._fold_wanted = threading.Event()
+        self._closed = False
+        self._folder = threading.Thread(target=self._fold_loop, daemon=True)
+        self._folder.start()
+
+    def publish(self, seq, rows, balances, live, versions):
+        """
+        Makes the given rows' values (read from the writer's live arrays,
+        under the stripes it holds) visible to new readers as one atomic step.
+        """
+        with self._lock:
+            previous = self.current
+            if len(rows) > self.max_changes:
+                rows = np.asarray(rows, dtype=np.int64)
+                size = max(previous.size, int(rows.max()) + 1)
+                new_balances, new_live, new_versions = Version(
+                    previous.seq, size, previous.balances, previous.live, previous.versions,
+                    previous.changes, previous.recent).arrays()
+                new_balances[rows], new_live[rows], new_versions[rows] = balances[rows], live[rows], versions[rows]
+                self.current = _base(max(previous.seq, seq), size, new_balances, new_live, new_versions)
+                return
+            recent = previous.recent.copy()
+            size = previous.size
+            for row in rows:
+                row = int(row)
+                recent[row] = (balances.item(row), live.item(row), versions.item(row))
+                size = max(size, row + 1)
+            changes = previous.changes
+            if len(recent) > RECENT_CHANGES:
+                changes = {**changes, **recent}
+                recent = {}
+            self.current = Version(max(previous.seq, seq), size, previous.balances, previous.live,
+                                   previous.versions, changes, recent)
+        if len(changes) > self.max_changes:
+            self._fold_wanted.set()
+
+    def _fold_loop(self):
+        while True:
+            self._fold_wanted.wait()
+            self._fold_wanted.clear()
+            if self._closed:
+                return
+            view = self.current
+            balances, live, versions = view.arrays()
+            with self._lock:
+                current = self.current
+                if current.balances is not view.balances:
+                    # A settlement folded in the meantime
+                    continue
+                # Entries still identical to the folded view's are in the new base
+                changes = {row: value for row, value in current.changes.items()
+                           if view.changes.get(row) is not value}
+                self.current = _base(current.seq, current.size, balances, live, versions,
+                                     changes, current.recent)
+
+    def close(self):
+        """
+        Stops the background fold.
+        """
+        self._closed = True
+        self._fold_wanted.set()
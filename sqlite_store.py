@@ -0,0 +1,390 @@
+import argparse
+import contextlib
+import operator
+import os
+import queue
+import sqlite3
+
+from ledger import LEDGER_COLUMNS, drop_closed, ledger_file_for, timestamp_now
+from metrics import REGISTRY
+from money import check_cents, parse_cents_array
+from storage import AccountNotFound, InsufficientFunds, Storage, validate_batch
+
+# Balances and amounts are INTEGER cents
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    account_number INTEGER PRIMARY KEY,
+    pin TEXT,
+    name TEXT,
+    balance INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS ledger (
+    id INTEGER PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    account_number INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    counterparty INTEGER,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ledger_account ON ledger (account_number, id);
+CREATE INDEX IF NOT EXISTS ledger_seq ON ledger (seq);
+"""
+SCHEMA_VERSION = 1
+
+# Rebuilds a database written with REAL dollar columns (user_version 0) with cents
+CENTS_MIGRATION = """
+BEGIN IMMEDIATE;
+ALTER TABLE accounts RENAME TO accounts_dollars;
+ALTER TABLE ledger RENAME TO ledger_dollars;
+DROP INDEX ledger_account;
+DROP INDEX ledger_seq;
+""" + SCHEMA + """
+INSERT INTO accounts SELECT account_number, pin, name, CAST(ROUND(balance * 100) AS INTEGER), version
+    FROM accounts_dollars;
+INSERT INTO ledger SELECT id, seq, account_number, type, CAST(ROUND(amount * 100) AS INTEGER), counterparty,
+    timestamp FROM ledger_dollars;
+DROP TABLE accounts_dollars;
+DROP TABLE ledger_dollars;
+COMMIT;
+"""
+
+LEDGER_SELECT = "SELECT seq, account_number, type, amount, counterparty, timestamp FROM ledger"
+
+# Accounts read per query while iterating over the whole table
+ACCOUNTS_CHUNK = 1000
+
+
+class ConnectionPool:
+    """
+    Fixed set of SQLite connections shared between threads.
+    Each connection is used by one thread at a time; connection() blocks
+    while all of them are busy. Connections run in autocommit mode, so
+    writers open their own transactions.
+    """
+
+    def __init__(self, file_name, size=8, fsync=True):
+        self._idle = queue.LifoQueue()
+        self._connections = []
+        for _ in range(size):
+            connection = sqlite3.connect(file_name, timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+            self._connections.append(connection)
+            self._idle.put(connection)
+
+    @contextlib.contextmanager
+    def connection(self):
+        connection = self._idle.get()
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+    def close(self):
+        for connection in self._connections:
+            connection.close()
+
+
+class SqliteStore(Storage):
+    """
+    Storage backed by a SQLite database in WAL mode.
+    Accounts are keyed by account number and ledger entries are indexed by
+    account, so single-row updates and lookups do not touch the rest of the
+    table. WAL mode lets readers run concurrently with the single writer;
+    every mutation is one IMMEDIATE transaction covering the balance change
+    and its ledger entries. A database from before balances were kept in
+    cents is migrated when opened.
+    """
+
+    def __init__(self, file_name, fsync=True, pool_size=8):
+        self.file_name = file_name
+        self.pool = ConnectionPool(file_name, pool_size, fsync)
+        with self.pool.connection() as db:
+            if db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                balance = db.execute("SELECT type FROM pragma_table_info('accounts') WHERE name = 'balance'").fetchone()
+                if balance is not None and balance[0] == 'REAL':
+                    db.executescript(CENTS_MIGRATION)
+                db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            db.executescript(SCHEMA)
+        self.epoch = os.urandom(4).hex()
+
+    @classmethod
+    def load(cls, file_name, fsync=True, pool_size=8):
+        """
+        Opens the database. Returns None if the file does not exist.
+        """
+        if not os.path.exists(file_name):
+            return None
+        return cls(file_name, fsync, pool_size)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self.pool.connection() as db, REGISTRY.phase('mutation'):
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    @staticmethod
+    def _balance(db, account_number):
+        row = db.execute("SELECT balance FROM accounts WHERE account_number = ?", (account_number,)).fetchone()
+        if row is None:
+            raise AccountNotFound(account_number)
+        return row[0]
+
+    @staticmethod
+    def _record(db, balances, entries):
+        """
+        Writes new balances ({account_number: balance}) and appends ledger
+        entries ((account_number, type, amount, counterparty) tuples) under
+        the next sequence number. Must run inside a transaction.
+        """
+        db.executemany("UPDATE accounts SET balance = ?, version = version + 1 WHERE account_number = ?",
+                       [(balance, account_number) for account_number, balance in balances.items()])
+        seq = db.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM ledger").fetchone()[0]
+        timestamp = timestamp_now()
+        db.executemany("INSERT INTO ledger (seq, account_number, type, amount, counterparty, timestamp) "
+                       "VALUES (?, ?, ?, ?, ?, ?)",
+                       [(seq, account_number, kind, amount, counterparty, timestamp)
+                        for account_number, kind, amount, counterparty in entries])
+
+    def exists(self, account_number):
+        with self.pool.connection() as db:
+            return db.execute("SELECT 1 FROM accounts WHERE account_number = ?",
+                              (account_number,)).fetchone() is not None
+
+    def get_account(self, account_number):
+        with self.pool.connection() as db:
+            row = db.execute("SELECT account_number, pin, name, balance FROM accounts WHERE account_number = ?",
+                             (account_number,)).fetchone()
+        if row is None:
+            raise AccountNotFound(account_number)
+        return dict(zip(('account_number', 'pin', 'name', 'balance'), row))
+
+    def accounts(self):
+        last = None
+        while True:
+            with self.pool.connection() as db:
+                rows = db.execute("SELECT account_number, pin, name, balance FROM accounts "
+                                  "WHERE ? IS NULL OR account_number > ? ORDER BY account_number LIMIT ?",
+                                  (last, last, ACCOUNTS_CHUNK)).fetchall()
+            for row in rows:
+                yield dict(zip(('account_number', 'pin', 'name', 'balance'), row))
+            if len(rows) < ACCOUNTS_CHUNK:
+                return
+            last = rows[-1][0]
+
+    def get_balance(self, account_number):
+        with self.pool.connection() as db:
+            return self._balance(db, account_number)
+
+    def etag(self, account_number):
+        with self.pool.connection() as db:
+            row = db.execute("SELECT version FROM accounts WHERE account_number = ?", (account_number,)).fetchone()
+        if row is None:
+            raise AccountNotFound(account_number)
+        return f"{self.epoch}-{row[0]}"
+
+    def get_details(self, account_number):
+        with self.pool.connection() as db:
+            row = db.execute("SELECT account_number, name, balance, version FROM accounts "
+                             "WHERE account_number = ?", (account_number,)).fetchone()
+        if row is None:
+            raise AccountNotFound(account_number)
+        return f"{self.epoch}-{row[3]}", {'account_number': row[0], 'name': row[1], 'balance': row[2]}
+
+    def add_account(self, account_number, pin, name, balance=0):
+        balance = operator.index(balance)
+        with self._transaction() as db:
+            if db.execute("SELECT 1 FROM accounts WHERE account_number = ?", (account_number,)).fetchone():
+                raise ValueError(f"Account {account_number} already exists")
+            db.execute("INSERT INTO accounts (account_number, pin, name, balance) VALUES (?, ?, ?, ?)",
+                       (account_number, pin, name, balance))
+            if balance > 0:
+                self._record(db, {}, [(account_number, 'deposit', balance, None)])
+
+    def remove_account(self, account_number):
+        with self._transaction() as db:
+            if self._balance(db, account_number) != 0:
+                raise ValueError(f"Account {account_number} has a nonzero balance")
+            db.execute("DELETE FROM accounts WHERE account_number = ?", (account_number,))
+            # A reopened account number must not inherit the closed account's history
+            db.execute("DELETE FROM ledger WHERE account_number = ?", (account_number,))
+
+    def withdraw(self, account_number, amount):
+        amount = operator.index(amount)
+        with self._transaction() as db:
+            balance = self._balance(db, account_number)
+            if balance < amount:
+                raise InsufficientFunds(account_number)
+            self._record(db, {account_number: balance - amount},
+                         [(account_number, 'withdrawal', -amount, None)])
+            return balance - amount
+
+    def deposit(self, account_number, amount):
+        amount = operator.index(amount)
+        with self._transaction() as db:
+            balance = check_cents(self._balance(db, account_number) + amount)
+            self._record(db, {account_number: balance}, [(account_number, 'deposit', amount, None)])
+            return balance
+
+    def transfer(self, sender, receiver, amount):
+        if sender == receiver:
+            raise ValueError("Cannot transfer to the same account")
+        amount = operator.index(amount)
+        with self._transaction() as db:
+            sender_balance = self._balance(db, sender)
+            receiver_balance = self._balance(db, receiver)
+            if sender_balance < amount:
+                raise InsufficientFunds(sender)
+            self._record(db, {sender: sender_balance - amount, receiver: check_cents(receiver_balance + amount)},
+                         [(sender, 'transfer_out', -amount, receiver), (receiver, 'transfer_in', amount, sender)])
+            return sender_balance - amount
+
+    def apply_batch(self, operations):
+        """
+        Same contract as AccountStore.apply_batch; the whole batch is one
+        transaction and all its ledger entries share one sequence number.
+        """
+        with self._transaction() as db:
+            balances = {}
+            for account_number in {account_number for _, account_number, _ in operations}:
+                row = db.execute("SELECT balance FROM accounts WHERE account_number = ?",
+                                 (account_number,)).fetchone()
+                if row is not None:
+                    balances[account_number] = row[0]
+            validate_batch(operations, balances)
+
+            results, entries = [], []
+            for op, account_number, amount in operations:
+                balance = balances[account_number]
+                if op == 'withdraw' and balance < amount:
+                    results.append({'error': "Insufficient funds"})
+                    continue
+                balance = balance - amount if op == 'withdraw' else check_cents(balance + amount)
+                balances[account_number] = balance
+                amount = int(amount)
+                entries.append((account_number, 'withdrawal' if op == 'withdraw' else 'deposit',
+                                -amount if op == 'withdraw' else amount, None))
+                results.append({'balance': balance})
+            if entries:
+                self._record(db, {account_number: balances[account_number] for account_number, *_ in entries},
+                             entries)
+        return results
+
+    def get_history(self, account_number):
+        self.get_balance(account_number)
+        with self.pool.connection() as db:
+            rows = db.execute(LEDGER_SELECT + " WHERE account_number = ? ORDER BY id", (account_number,)).fetchall()
+        return [dict(zip(LEDGER_COLUMNS, row)) for row in rows]
+
+    def get_statement(self, account_number, cursor=0, limit=50, start=None, end=None,
+                      min_amount=None, max_amount=None):
+        """
+        Keyset-paginated version of Ledger.page: the cursor is the id of the
+        last entry returned, so each page is one indexed range scan.
+        """
+        self.get_balance(account_number)
+        clauses, params = ["account_number = ?", "id > ?"], [account_number, cursor]
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("substr(timestamp, 1, ?) <= ?")
+            params += [len(end), end]
+        if min_amount is not None:
+            clauses.append("abs(amount) >= ?")
+            params.append(min_amount)
+        if max_amount is not None:
+            clauses.append("abs(amount) <= ?")
+            params.append(max_amount)
+        with self.pool.connection() as db:
+            rows = db.execute(f"SELECT id, seq, account_number, type, amount, counterparty, timestamp FROM ledger "
+                              f"WHERE {' AND '.join(clauses)} ORDER BY id LIMIT ?", params + [limit + 1]).fetchall()
+        entries = [dict(zip(LEDGER_COLUMNS, row[1:])) for row in rows[:limit]]
+        return entries, rows[limit - 1][0] if len(rows) > limit else None
+
+    def get_stats(self, account_number):
+        """
+        Returns the same fields as the running aggregates, computed from the
+        account's indexed ledger rows.
+        """
+        self.get_balance(account_number)
+        with self.pool.connection() as db:
+            count, total_in, total_out, low, high, last = db.execute(
+                "SELECT COUNT(*), SUM(MAX(amount, 0)), SUM(MAX(-amount, 0)), MIN(amount), MAX(amount), "
+                "MAX(NULLIF(timestamp, '')) FROM ledger WHERE account_number = ?", (account_number,)).fetchone()
+            if count == 0:
+                return {}
+            day_in, day_out = db.execute(
+                "SELECT SUM(MAX(amount, 0)), SUM(MAX(-amount, 0)) FROM ledger "
+                "WHERE account_number = ? AND substr(timestamp, 1, 10) = ?",
+                (account_number, (last or "")[:10] or None)).fetchone()
+        return {'count': count, 'total_in': total_in, 'total_out': total_out, 'min': low, 'max': high,
+                'last_activity': last, 'day_in': day_in or 0, 'day_out': day_out or 0}
+
+    def flush(self):
+        """
+        Checkpoints the SQLite WAL into the main database file.
+        """
+        with self.pool.connection() as db, REGISTRY.phase('save'):
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        self.pool.close()
+
+
+# Copy a CSV account table and its ledger into a new SQLite database
+def import_csv(csv_file, db_file):
+    """
+    Loads the accounts and every ledger entry into db_file (which must not
+    exist yet). The table is opened as an AccountStore first, so mutations
+    still in its write-ahead log are included and a legacy Transactions
+    column is migrated into the ledger.
+    """
+    import pandas as pd
+
+    from account_store import AccountStore
+
+    if os.path.exists(db_file):
+        raise FileExistsError(db_file)
+    source = AccountStore.load(csv_file)
+    if source is None:
+        raise FileNotFoundError(csv_file)
+    df, _ = source.snapshot()
+    source.close()
+    entries = drop_closed(pd.read_csv(ledger_file_for(csv_file), dtype={'Amount': str, 'Timestamp': str},
+                                      keep_default_na=False))
+    counterparty = [None if pd.isna(value) else int(value)
+                    for value in pd.to_numeric(entries['Counterparty'], errors='coerce')]
+    store = SqliteStore(db_file)
+    with store._transaction() as db:
+        db.executemany("INSERT INTO accounts (account_number, pin, name, balance) VALUES (?, ?, ?, ?)",
+                       zip(df['Account Number'].tolist(), df['pin'].astype(str).tolist(),
+                           df['Name'].tolist(), df['Balance'].tolist()))
+        db.executemany("INSERT INTO ledger (seq, account_number, type, amount, counterparty, timestamp) "
+                       "VALUES (?, ?, ?, ?, ?, ?)",
+                       zip(entries['Seq'].tolist(), entries['Account Number'].tolist(), entries['Type'].tolist(),
+                           parse_cents_array(entries['Amount']).tolist(), counterparty,
+                           entries['Timestamp'].tolist()))
+    store.close()
+    return len(df), len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import the CSV account table and ledger into SQLite.")
+    parser.add_argument("source", help="accounts CSV file")
+    parser.add_argument("target", help="SQLite database to create (.db)")
+    args = parser.parse_args()
+    accounts, entries = import_csv(args.source, args.target)
+    print(f"Imported {accounts} accounts and {entries} ledger entries into {args.target}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import numbers
+import os
+
+from metrics import REGISTRY
+
+# File extensions that select the SQLite backend in open_storage()
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+
+class AccountNotFound(Exception):
+    pass
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+class TableInUse(Exception):
+    """
+    Raised when another process already has the account table open.
+    """
+
+
+class InvalidBatch(Exception):
+    """
+    Raised when a batch fails validation; args[0] lists the problems found.
+    """
+
+
+# Check every operation of a batch before any of it is applied
+def validate_batch(operations, known_accounts):
+    """
+    Raises InvalidBatch listing unknown ops, accounts not in known_accounts
+    and amounts that are not a positive whole number of cents.
+    """
+    errors = []
+    for position, (op, account_number, amount) in enumerate(operations):
+        if op not in ('deposit', 'withdraw'):
+            errors.append(f"Operation {position}: unknown op '{op}'")
+        elif account_number not in known_accounts:
+            errors.append(f"Operation {position}: account {account_number} not found")
+        elif not isinstance(amount, numbers.Integral) or not amount > 0:
+            errors.append(f"Operation {position}: amount must be a positive number of cents")
+    if errors:
+        raise InvalidBatch(errors)
+
+
+class Storage:
+    """
+    Interface shared by every account storage backend. The CLI (atm.py,
+    atm1.py) and both servers only talk to a Storage, so the backend can be
+    swapped without touching them.
+
+    Account numbers are ints; balances and amounts are ints in cents (see
+    money.py). Lookups and mutations raise
+    AccountNotFound for unknown accounts; withdrawals and transfers raise
+    InsufficientFunds instead of overdrawing, and ValueError rather than
+    store a balance outside int64 (see money.check_cents). Each mutation appends its
+    ledger entries in the same atomic step as the balance change. Ledger
+    entries are dicts keyed by ledger.LEDGER_COLUMNS.
+    """
+
+    # True if reads are answered from memory and never wait on disk or on writers
+    in_memory = False
+
+    def exists(self, account_number):
+        raise NotImplementedError
+
+    def get_account(self, account_number):
+        """
+        Returns {'account_number', 'pin', 'name', 'balance'} for the account.
+        """
+        raise NotImplementedError
+
+    def accounts(self):
+        """
+        Iterates over every account as returned by get_account().
+        """
+        raise NotImplementedError
+
+    def get_balance(self, account_number):
+        raise NotImplementedError
+
+    def etag(self, account_number):
+        """
+        Returns a tag that changes whenever the account changes.
+        """
+        raise NotImplementedError
+
+    def get_details(self, account_number):
+        """
+        Returns (etag, {'account_number', 'name', 'balance'}).
+        """
+        raise NotImplementedError
+
+    def add_account(self, account_number, pin, name, balance=0):
+        raise NotImplementedError
+
+    def remove_account(self, account_number):
+        """
+        Closes an account. Raises ValueError unless its balance is zero;
+        its history goes with it, so a reopened number starts with none.
+        """
+        raise NotImplementedError
+
+    def withdraw(self, account_number, amount):
+        """
+        Returns the new balance.
+        """
+        raise NotImplementedError
+
+    def deposit(self, account_number, amount):
+        """
+        Returns the new balance.
+        """
+        raise NotImplementedError
+
+    def transfer(self, sender, receiver, amount):
+        """
+        Returns the sender's new balance.
+        """
+        raise NotImplementedError
+
+    def apply_batch(self, operations):
+        """
+        Applies (op, account_number, amount) tuples as described in
+        AccountStore.apply_batch and returns one result dict per operation.
+        """
+        raise NotImplementedError
+
+    def prepare_transfer(self, txid, account_number, amount, counterparty=None):
+        """
+        First phase of a transfer whose other side lives in another shard
+        (see shard_router.py). amount is negative to debit the account and
+        positive to credit it. A debit is reserved at once, so the money
+        cannot be spent twice; nothing reaches the ledger before
+        commit_transfer(). Preparing a txid again is a no-op.
+        Returns the account's balance after the reservation.
+        """
+        raise NotImplementedError
+
+    def commit_transfer(self, txid):
+        """
+        Applies a prepared transfer and writes its ledger entry. Returns the
+        new balance, or None if txid is not prepared (e.g. already committed).
+        """
+        raise NotImplementedError
+
+    def abort_transfer(self, txid):
+        """
+        Releases a prepared transfer; an unknown txid is ignored.
+        """
+        raise NotImplementedError
+
+    def pending_transfers(self):
+        """
+        Returns the txids that are prepared but not yet committed or aborted.
+        """
+        raise NotImplementedError
+
+    def get_history(self, account_number):
+        raise NotImplementedError
+
+    def get_statement(self, account_number, cursor=0, limit=50, **filters):
+        """
+        Returns (entries, next_cursor); filters are start, end, min_amount and max_amount.
+        """
+        raise NotImplementedError
+
+    def get_stats(self, account_number):
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Makes every change so far durable in the main table file.
+        """
+
+    def close(self):
+        pass
+
+
+# Keep every other process off a table, its log and its ledger while it is open
+def lock_table(file_name):
+    """
+    Takes an exclusive flock on <file_name>.lock and returns the open lock
+    file; the lock is held until that file is closed or the process exits.
+    Raises TableInUse if another writer (in any process) holds it.
+    """
+    import fcntl
+
+    lock = open(file_name + ".lock", 'a')
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        raise TableInUse(f"{file_name} is already open by another writer") from None
+    return lock
+
+
+# Tell a binary store directory (see binary_store.py) apart from a CSV file
+def is_binary_store(path):
+    return os.path.isfile(os.path.join(path, "meta.json"))
+
+
+# Open the storage backend that matches the file name
+def open_storage(file_name, lite=False, **options):
+    """
+    A .db/.sqlite/.sqlite3 file opens a SqliteStore, a binary store directory
+    or a CSV file an AccountStore. With lite=True a CSV file opens a
+    LiteStore instead, which does not import pandas or NumPy.
+    Returns None if the table does not exist.
+    """
+    with REGISTRY.phase('load'):
+        if os.path.splitext(file_name)[1].lower() in SQLITE_EXTENSIONS:
+            from sqlite_store import SqliteStore
+            return SqliteStore.load(file_name, **options)
+        if lite and not is_binary_store(file_name):
+            from lite_store import LiteStore
+            return LiteStore.load(file_name, **options)
+        from account_store import AccountStore
+        return AccountStore.load(file_name, **options)
@@ -0,0 +1,171 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+
+import pandas as pd
+
+from account_store import AccountStore, InsufficientFunds
+from ledger import ledger_file_for
+from money import to_cents
+
+# PIN of every account in a synthetic table
+PIN = "1234"
+
+
+# Create a throwaway account table for the stress run
+def make_database(file_name, accounts, opening_balance):
+    pd.DataFrame({
+        'Account Number': range(1001, 1001 + accounts),
+        'pin': PIN,
+        'Name': [f"Stress {i}" for i in range(accounts)],
+        'Balance': float(opening_balance),
+        'Withdrawal': None,
+        'Deposit': None,
+    }).to_csv(file_name, index=False)
+
+
+# Check that the ledger holds one sequence number per logged mutation and adds up to every balance
+def reconcile(store, expected, opening, mutations, label):
+    ok = True
+    seqs = set()
+    for account_number, balance in expected.items():
+        entries = store.ledger.history(account_number)
+        seqs.update(entry['Seq'] for entry in entries)
+        net = sum(entry['Amount'] for entry in entries)
+        if opening + net != balance:
+            print(f"Ledger of {account_number} {label} adds up to {opening + net} != {balance}")
+            ok = False
+    missing = set(range(1, mutations + 1)) - seqs
+    if missing or len(seqs) != mutations:
+        print(f"Ledger {label} covers {len(seqs)} of {mutations} mutations "
+              f"({len(missing)} missing, e.g. {sorted(missing)[:5]})")
+        ok = False
+    return ok
+
+
+# Copy the table, log and checkpoint as a crash would leave them, minus the ledger entries of every other mutation past the checkpoint
+def crash_copy(store, file_name, crash_dir):
+    crash_file = os.path.join(crash_dir, os.path.basename(file_name))
+    with store._checkpoint_lock:
+        for suffix in ("", ".wal", ".checkpoint"):
+            if os.path.exists(file_name + suffix):
+                shutil.copyfile(file_name + suffix, crash_file + suffix)
+        checkpoint_seq = store.checkpoint_seq
+        with open(ledger_file_for(file_name), 'rb') as f:
+            lines = f.readlines()
+    kept = [lines[0]]
+    for line in lines[1:]:
+        seq = int(line.split(b",", 1)[0])
+        if seq <= checkpoint_seq or seq % 2:
+            kept.append(line)
+    with open(ledger_file_for(crash_file), 'wb') as f:
+        f.writelines(kept)
+    return crash_file
+
+
+# Hammer a few hot accounts from many threads and check nothing was lost
+def run(threads, operations, accounts, opening_balance, seed, fsync=True):
+    """
+    Every thread performs random deposits, withdrawals and transfers (in both
+    directions between the same pairs) of 1 to 100 cents on a small set of
+    accounts. Successful
+    operations are tallied per thread; at the end each balance must equal its
+    opening balance plus the net of the tallies, both in memory and after
+    reloading from the log. The ledger must hold an entry for every
+    successful operation and add up to the same balances, also after a
+    simulated crash that lost part of the ledger's tail.
+    With fsync on, concurrent writers share group commits.
+    Returns True if no update was lost.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        file_name = os.path.join(workdir, "bank_database.csv")
+        make_database(file_name, accounts, opening_balance)
+        store = AccountStore.load(file_name, flush_interval=0.05, fsync=fsync)
+        account_numbers = list(range(1001, 1001 + accounts))
+        tallies = [dict.fromkeys(account_numbers, 0) for _ in range(threads)]
+        counts = [0] * threads
+        start = threading.Barrier(threads)
+
+        def worker(index, tally, rng):
+            start.wait()
+            for _ in range(operations):
+                account_number = rng.choice(account_numbers)
+                amount = rng.randint(1, 100)
+                choice = rng.random()
+                if choice < 0.35:
+                    store.deposit(account_number, amount)
+                    tally[account_number] += amount
+                    counts[index] += 1
+                elif choice < 0.7 and len(account_numbers) > 1:
+                    receiver = rng.choice([n for n in account_numbers if n != account_number])
+                    try:
+                        store.transfer(account_number, receiver, amount)
+                        tally[account_number] -= amount
+                        tally[receiver] += amount
+                        counts[index] += 1
+                    except InsufficientFunds:
+                        pass
+                else:
+                    try:
+                        store.withdraw(account_number, amount)
+                        tally[account_number] -= amount
+                        counts[index] += 1
+                    except InsufficientFunds:
+                        pass
+
+        workers = [threading.Thread(target=worker, args=(i, tallies[i], random.Random(seed + i)))
+                   for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        opening = to_cents(opening_balance)
+        expected = {n: opening + sum(t[n] for t in tallies) for n in account_numbers}
+        mutations = sum(counts)
+        ok = True
+        for account_number in account_numbers:
+            if store.get_balance(account_number) != expected[account_number]:
+                print(f"Lost update on {account_number}: "
+                      f"{store.get_balance(account_number)} != {expected[account_number]}")
+                ok = False
+            if store.get_balance(account_number) < 0:
+                print(f"Account {account_number} overdrawn")
+                ok = False
+        ok = reconcile(store, expected, opening, mutations, "in memory") and ok
+        crash_dir = os.path.join(workdir, "crash")
+        os.mkdir(crash_dir)
+        crash_file = crash_copy(store, file_name, crash_dir)
+        store.close()
+
+        for name, label in ((file_name, "after reload"), (crash_file, "after crash")):
+            reloaded = AccountStore.load(name, flush_interval=60, fsync=False)
+            for account_number in account_numbers:
+                if reloaded.get_balance(account_number) != expected[account_number]:
+                    print(f"Balance of {account_number} differs {label}")
+                    ok = False
+            ok = reconcile(reloaded, expected, opening, mutations, label) and ok
+            reloaded.close()
+        return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent withdraw/deposit/transfer stress check for AccountStore.")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--operations", type=int, default=500, help="operations per thread")
+    parser.add_argument("--accounts", type=int, default=4)
+    parser.add_argument("--opening-balance", type=float, default=1000.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-fsync", action="store_true", help="skip fsync (and so group commit) on the log")
+    args = parser.parse_args()
+    ok = run(args.threads, args.operations, args.accounts, args.opening_balance, args.seed, not args.no_fsync)
+    print("No lost updates." if ok else "Stress check FAILED.")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+import time
+
+from metrics import REGISTRY
+from money import to_cents
+
+# Group commit defaults, overridden by ATM_COMMIT_WINDOW (seconds) and ATM_COMMIT_SIZE (records)
+COMMIT_WINDOW = 0.0
+COMMIT_SIZE = 256
+
+
+class WriteAheadLog:
+    """
+    Append-only journal of balance mutations.
+    Each record is one JSON line carrying a sequence number, the account, the
+    operation, the amount and the resulting balance, so replaying a record
+    twice leaves the balance unchanged.
+
+    Appends are group committed: records from concurrent writers are
+    written as they arrive and made durable together by one fsync. The
+    first writer to wait leads the group; it waits up to commit_window
+    seconds, or until commit_size records are pending, then syncs for
+    everyone. With a window of 0 a group is whatever arrived while the
+    previous fsync ran. append_many() returns only once its records are
+    durable.
+    """
+
+    def __init__(self, path, fsync=True, commit_window=None, commit_size=None):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._syncing = False
+        self._pending = 0
+        self.last_seq = self._recover()
+        self.durable_seq = self.last_seq
+        self._file = open(path, 'a', encoding='utf-8')
+        self.configure_commit(
+            os.environ.get("ATM_COMMIT_WINDOW", COMMIT_WINDOW) if commit_window is None else commit_window,
+            os.environ.get("ATM_COMMIT_SIZE", COMMIT_SIZE) if commit_size is None else commit_size)
+
+    def configure_commit(self, window, size):
+        """
+        Sets the group commit window (seconds) and the number of pending
+        records that closes a group early. Raises ValueError if either is out of range.
+        """
+        window, size = float(window), int(size)
+        if window < 0 or size < 1:
+            raise ValueError("the commit window must not be negative and the commit size must be positive")
+        self.commit_window, self.commit_size = window, size
+        REGISTRY.configure_group_commit(os.path.basename(self.path), window, size)
+
+    def _recover(self):
+        """
+        Cuts off a torn last line left by a crash and returns the last sequence number.
+        """
+        last_seq, good_end = 0, 0
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        last_seq = json.loads(line)['seq']
+                    except (json.JSONDecodeError, UnicodeDecodeError, KeyError):
+                        break
+                    good_end += len(line)
+        except FileNotFoundError:
+            return 0
+        if good_end != os.path.getsize(self.path):
+            os.truncate(self.path, good_end)
+        return last_seq
+
+    def append(self, account_number, op, amount, balance, **extra):
+        """
+        Appends one mutation record and makes it durable.
+        Returns the record's sequence number.
+        """
+        return self.append_many([{'account': account_number, 'op': op, 'amount': amount,
+                                  'balance': balance, **extra}])[0]
+
+    def append_many(self, records):
+        """
+        Appends several mutation records with a single write and waits until
+        they are durable (see the group commit notes above).
+        Each record is numbered in place; returns their sequence numbers.
+        """
+        with self._lock:
+            lines = []
+            for record in records:
+                self.last_seq += 1
+                record['seq'] = self.last_seq
+                lines.append(json.dumps({'seq': self.last_seq, **record}) + "\n")
+            self._file.write("".join(lines))
+            self._file.flush()
+            if self.fsync:
+                self._pending += len(records)
+                if self._pending >= self.commit_size:
+                    self._synced.notify_all()
+                self._wait_durable(self.last_seq)
+            return [record['seq'] for record in records]
+
+    def _wait_durable(self, seq):
+        """
+        Returns once every record up to seq is on disk, leading a group
+        commit if no fsync is running. Must be called with the lock held.
+        """
+        while self.durable_seq < seq:
+            if self._syncing:
+                self._synced.wait()
+                continue
+            self._syncing = True
+            try:
+                deadline = time.monotonic() + self.commit_window
+                while self._pending < self.commit_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._synced.wait(remaining)
+                target, records = self.last_seq, self._pending
+                fileno = self._file.fileno()
+                # Writers keep appending to the next group while this one syncs
+                self._lock.release()
+                try:
+                    start = time.perf_counter()
+                    os.fsync(fileno)
+                    REGISTRY.observe_phase('sync', time.perf_counter() - start)
+                finally:
+                    self._lock.acquire()
+                self._pending -= records
+                self.durable_seq = max(self.durable_seq, target)
+                REGISTRY.observe_group_commit(os.path.basename(self.path), records)
+            finally:
+                self._syncing = False
+                self._synced.notify_all()
+
+    def replay(self, after_seq=0):
+        """
+        Yields the records with a sequence number greater than after_seq.
+        A torn last line left by a crash is ignored.
+        """
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    if record['seq'] > after_seq:
+                        yield record
+        except FileNotFoundError:
+            return
+
+    def truncate(self, upto_seq, keep_seqs=()):
+        """
+        Drops every record up to and including upto_seq once it is checkpointed,
+        except those whose sequence number is in keep_seqs.
+        """
+        with self._lock:
+            while self._syncing:
+                self._synced.wait()
+            keep = [record for record in self.replay() if record['seq'] > upto_seq or record['seq'] in keep_seqs]
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in keep:
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            # Everything still logged was just synced with the new file
+            self._pending = 0
+            self.durable_seq = self.last_seq
+            self._synced.notify_all()
+
+    def close(self):
+        with self._lock:
+            while self._syncing:
+                self._synced.wait()
+            if self.fsync and self.durable_seq < self.last_seq:
+                os.fsync(self._file.fileno())
+                self._pending = 0
+                self.durable_seq = self.last_seq
+                self._synced.notify_all()
+            self._file.close()
+
+
+# Read the sequence number of the last mutation folded into the CSV file
+def read_checkpoint(file_name):
+    try:
+        with open(file_name + ".checkpoint", encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+# Record the sequence number of the last mutation folded into the CSV file
+def write_checkpoint(file_name, seq):
+    tmp_name = file_name + ".checkpoint.tmp"
+    with open(tmp_name, 'w', encoding='utf-8') as f:
+        f.write(str(seq))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, file_name + ".checkpoint")
+
+
+# Convert a log record written when balances were float dollars to cents
+def upgrade_record(record):
+    for key in ('amount', 'balance', 'receiver_balance'):
+        if isinstance(record.get(key), float):
+            record[key] = to_cents(record[key])
+    if record['op'] == 'settle' and any(isinstance(balance, float) for balance in record['balances']):
+        record['balances'] = [to_cents(balance) for balance in record['balances']]
+    return record